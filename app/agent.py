@@ -12,26 +12,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
 # from app.tools.embedding import retrieve_docs
-from app.tools.firestore import add_math_question, get_user_data, set_user_name, upsert_math_question_result, increment_user_level
-from app.templates import BASE_INSTRUCTION, CONTINUE_INSTRUCTION, PROCESS_INSTRUCTION, SETUP_INSTRUCTION
+from app.tools.firestore import add_math_question, get_next_question, set_user_name, upsert_math_question_result, increment_user_level
+from app.templates import BASE_INSTRUCTION, CONTINUE_INSTRUCTION, PROCESS_INSTRUCTION, PROVISIONAL_INSTRUCTION, RESUME_INSTRUCTION, SETUP_INSTRUCTION
 from google import genai
 from google.genai.types import Content, FunctionDeclaration, LiveConnectConfig, Tool
-from app.config import PROJECT_ID, LOCATION, credentials
+from app.client_pool import ClientPool
+from app.clients import LazyClient
+from app.config import LIVE_API_REGIONS, PROJECT_ID, LOCATION, credentials
 
 MODEL_ID = "gemini-2.0-flash-exp"
 
-genai_client = genai.Client(
-    project=PROJECT_ID,
-    location=LOCATION,
-    credentials=credentials,
-    vertexai=True
-)
+def _genai_client(region: str) -> genai.Client:
+    return genai.Client(
+        project=PROJECT_ID,
+        location=region,
+        credentials=credentials,
+        vertexai=True
+    )
+
+# genai のクライアントは HTTP セッションを持つので、fork したあとにワーカーごとに作る
+genai_client = LazyClient(functools.partial(_genai_client, LOCATION), f"genai {LOCATION}")
+
+live_pool = ClientPool({
+    region: genai_client if region == LOCATION else LazyClient(
+        functools.partial(_genai_client, region), f"genai {region}"
+    )
+    for region in LIVE_API_REGIONS
+})
+
+# ツールの宣言は fork の前に一度だけ作る。from_function がクライアントから見るのは vertexai だけ
+_declaration_client = SimpleNamespace(vertexai=True)
 
 tool_functions = {
     "set_user_name": set_user_name,
     "upsert_math_question_result": upsert_math_question_result,
     "add_math_question": add_math_question,
+    "get_next_question": get_next_question,
     "increment_user_level": increment_user_level,
 }
 
@@ -48,36 +69,46 @@ tools = [
     Tool(
         function_declarations=[
             FunctionDeclaration.from_function(
-                client=genai_client,
+                client=_declaration_client,
                 func=set_user_name,
             ),
             FunctionDeclaration.from_function(
-                client=genai_client,
+                client=_declaration_client,
                 func=upsert_math_question_result,
             ),
             FunctionDeclaration.from_function(
-                client=genai_client,
+                client=_declaration_client,
                 func=add_math_question,
             ),
             FunctionDeclaration.from_function(
-                client=genai_client,
+                client=_declaration_client,
+                func=get_next_question,
+            ),
+            FunctionDeclaration.from_function(
+                client=_declaration_client,
                 func=increment_user_level,
             ),
         ]
     ),
 ]
 
-def get_live_connect_config(user_id: str):
+def get_live_connect_config(
+    user_id: str, user_data: Optional[Dict[str, Any]], resumed: bool = False, provisional: bool = False
+):
     parts = [
         {"text": BASE_INSTRUCTION },
     ]
-    user_data = get_user_data(user_id)
-    if (user_data is None):
+    if provisional:
+        # ユーザー情報は後から届く
+        parts.append({"text": PROVISIONAL_INSTRUCTION})
+    elif (user_data is None):
         parts.append({"text":SETUP_INSTRUCTION})
         parts.append({"text": f"ユーザー情報"})
     else:
         parts.append({"text":CONTINUE_INSTRUCTION})
         parts.append({"text": f"ユーザー情報 {user_data}"})
+    if resumed:
+        parts.append({"text": RESUME_INSTRUCTION})
 
     parts.append({"text": f"""
         user_id: {user_id}
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from app.metrics import counter, gauge
+
+# 1つのリージョンへの接続をあきらめて、次のリージョンに切り替えるまでの秒数
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("LIVE_CONNECT_TIMEOUT_SECONDS", "10"))
+# 続けて失敗したリージョンは、この秒数のあいだ後回しにする
+FAILURE_COOLDOWN_SECONDS = 30.0
+COOLDOWN_AFTER_FAILURES = 2
+# 接続時間と失敗率の指数移動平均の重み
+EWMA_ALPHA = 0.3
+# 失敗率 100% のリージョンは、接続時間がこの倍数だけ遅いものとして扱う
+FAILURE_PENALTY = 10.0
+
+live_connects = counter("live_connect_total", "Live API connection attempts by region and outcome")
+live_connect_latency = gauge(
+    "live_connect_latency_seconds", "Moving average of Live API connect time by region"
+)
+
+
+class RegionStats:
+    """Connect latency and failure rate of one region, as moving averages."""
+
+    __slots__ = ("region", "latency", "failure_rate", "consecutive_failures", "cooldown_until")
+
+    def __init__(self, region: str) -> None:
+        self.region = region
+        self.latency: Optional[float] = None
+        self.failure_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_success(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else (
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+        )
+        self.failure_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_failure(self, now: float) -> None:
+        self.failure_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.failure_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= COOLDOWN_AFTER_FAILURES:
+            self.cooldown_until = now + FAILURE_COOLDOWN_SECONDS
+
+    def score(self) -> float:
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + FAILURE_PENALTY * self.failure_rate)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "region": self.region,
+            "latency_seconds": self.latency,
+            "failure_rate": round(self.failure_rate, 3),
+            "cooldown_until": self.cooldown_until,
+        }
+
+
+class ClientPool:
+    """Live API clients across regions; each session goes to the best one.
+
+    Regions are ranked by connect latency weighted by failure rate. Regions
+    not measured yet are tried first, so every region gets explored. A region that fails twice in a row is tried
+    last for a cooldown period. ``connect`` fails over to the next region
+    when opening the session fails or times out; when every region fails,
+    the last error is raised.
+    """
+
+    def __init__(
+        self,
+        clients: Dict[str, Any],
+        connect_timeout: float = CONNECT_TIMEOUT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if not clients:
+            raise ValueError("ClientPool needs at least one region")
+        self.clients = clients
+        self.connect_timeout = connect_timeout
+        self.clock = clock
+        self.stats = {region: RegionStats(region) for region in clients}
+
+    def ranked(self) -> List[str]:
+        """Return the regions, best first."""
+        now = self.clock()
+        return sorted(
+            self.clients,
+            key=lambda region: (self.stats[region].cooldown_until > now, self.stats[region].score()),
+        )
+
+    @asynccontextmanager
+    async def connect(self, model: str, config: Any = None, deadline: Optional[float] = None) -> AsyncIterator[Any]:
+        """Open a Live API session in the best available region.
+
+        Args:
+            model: The model to connect to
+            config: The LiveConnectConfig of the session
+            deadline: Seconds to spend on all regions together; the regions
+                left when it passes are not tried
+        """
+        last_error: BaseException = ConnectionError("No Live API region")
+        give_up_at = None if deadline is None else self.clock() + deadline
+        for region in self.ranked():
+            started = self.clock()
+            timeout = self.connect_timeout
+            if give_up_at is not None:
+                if started >= give_up_at:
+                    raise asyncio.TimeoutError(f"Live API connect deadline of {deadline}s passed") from last_error
+                timeout = min(timeout, give_up_at - started)
+            try:
+                live = self.clients[region].aio.live.connect(model=model, config=config)
+                session = await asyncio.wait_for(live.__aenter__(), timeout)
+            except Exception as e:
+                self.stats[region].record_failure(self.clock())
+                live_connects.inc(region=region, outcome="failure")
+                logging.warning(f"Live API connection to {region} failed, trying the next region: {e!r}")
+                last_error = e
+                continue
+            latency = self.clock() - started
+            self.stats[region].record_success(latency)
+            live_connects.inc(region=region, outcome="success")
+            live_connect_latency.set(self.stats[region].latency, region=region)
+            break
+        else:
+            # すべて失敗したら最後のエラーをそのまま投げる（呼び出し側の backoff が型を見る）
+            raise last_error
+
+        try:
+            yield session
+        except BaseException as e:
+            if not await live.__aexit__(type(e), e, e.__traceback__):
+                raise
+        else:
+            await live.__aexit__(None, None, None)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [self.stats[region].to_dict() for region in self.ranked()]
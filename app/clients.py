@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+# 作られた LazyClient。fork した子プロセスでは、親から引き継いだクライアントを捨てる
+_clients: "weakref.WeakSet[LazyClient]" = weakref.WeakSet()
+
+
+class LazyClient(Generic[T]):
+    """A client created on first use, once per process.
+
+    gRPC channels, HTTP sessions and the threads behind the Google Cloud
+    clients do not survive ``fork``. Modules create their clients through
+    this wrapper, so a server that imports the app before forking workers
+    (gunicorn's ``preload_app``) creates no client in the parent, and each
+    worker creates its own. Attribute access is forwarded to the client, so
+    the wrapper can stand where the client used to be.
+    """
+
+    def __init__(self, factory: Callable[[], T], name: str) -> None:
+        self._factory = factory
+        self._name = name
+        self._instance: Any = None
+        self._lock = threading.Lock()
+        _clients.add(self)
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def instance(self) -> T:
+        instance = self._instance
+        if instance is None:
+            # ツールはワーカースレッドからも呼ばれるので、作るのは1回だけにする
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    logging.info(f"Creating {self._name} client in process {os.getpid()}")
+                    instance = self._instance = self._factory()
+        return instance
+
+    def reset(self) -> None:
+        """Forget the client; the next use creates a new one."""
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.instance(), name)
+
+    def __repr__(self) -> str:
+        state = "initialized" if self.initialized else "not initialized"
+        return f"LazyClient({self._name}, {state})"
+
+
+def initialize_clients() -> None:
+    """Create every client now, in this process, instead of on first use."""
+    for client in list(_clients):
+        try:
+            client.instance()
+        except Exception as e:
+            # 作れなかったクライアントは、最初に使うときにもう一度作る
+            logging.error(f"Could not create {client._name} client: {e}")
+
+
+def _reset_after_fork() -> None:
+    for client in list(_clients):
+        client.reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
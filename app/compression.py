@@ -0,0 +1,86 @@
+import os
+import time
+import zlib
+from typing import FrozenSet, Optional
+
+from app.metrics import counter
+
+# /ws?compression=deflate で、クライアントが圧縮したメッセージを受け取れると伝えてくる
+DEFLATE = "deflate"
+# 圧縮するモデルからのメッセージの種類（app.trace.upstream_kind の分類）。
+# 音声は base64 の PCM で、縮む割に CPU を使うので既定では圧縮しない
+WS_COMPRESS_KINDS = frozenset(
+    kind for kind in os.getenv("WS_COMPRESS_KINDS", "toolCall,text,setupComplete,other").split(",") if kind
+)
+# ハフマン符号化だけで圧縮する種類。base64 の音声で縮むのは base64 の分（約25%）だけなので、
+# 文字列の一致を探さずに半分ほどの CPU で同じだけ縮められる。帯域を優先するときは "audio" を指定する
+WS_COMPRESS_HUFFMAN_KINDS = frozenset(
+    kind for kind in os.getenv("WS_COMPRESS_HUFFMAN_KINDS", "").split(",") if kind
+)
+# これより小さいメッセージは、縮む量より手間の方が大きいので圧縮しない
+WS_COMPRESS_MIN_BYTES = int(os.getenv("WS_COMPRESS_MIN_BYTES", "256"))
+WS_COMPRESS_LEVEL = int(os.getenv("WS_COMPRESS_LEVEL", "6"))
+
+compression_bytes = counter(
+    "ws_compression_bytes_total", "Bytes of compressed model messages before and after compression, by kind"
+)
+compression_seconds = counter("ws_compression_seconds_total", "Time spent compressing model messages, by kind")
+
+
+class CompressionPolicy:
+    """Which model messages are compressed before they are relayed to the client.
+
+    Messages of the listed kinds and at least ``min_bytes`` long are sent
+    zlib-compressed (RFC 1950, what the browser's ``DecompressionStream
+    ("deflate")`` reads); the rest, mostly audio, are sent as they are.
+    Kinds in ``huffman_kinds`` are only entropy coded, which recovers the
+    base64 overhead of audio and images at a fraction of the CPU. Each
+    message is compressed on its own, so the session keeps no compressor
+    state. The client tells the two apart by the first byte: plain messages
+    are JSON and start with ``{``, compressed ones with the zlib header.
+    """
+
+    __slots__ = ("kinds", "huffman_kinds", "min_bytes", "level")
+
+    def __init__(
+        self,
+        kinds: FrozenSet[str] = WS_COMPRESS_KINDS,
+        huffman_kinds: FrozenSet[str] = WS_COMPRESS_HUFFMAN_KINDS,
+        min_bytes: int = WS_COMPRESS_MIN_BYTES,
+        level: int = WS_COMPRESS_LEVEL,
+    ) -> None:
+        self.kinds = kinds
+        self.huffman_kinds = huffman_kinds
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def encode(self, message: bytes, kind: str) -> bytes:
+        """Return the message to send for a model message of ``kind``."""
+        if len(message) < self.min_bytes:
+            return message
+        if kind in self.kinds:
+            level, strategy = self.level, zlib.Z_DEFAULT_STRATEGY
+        elif kind in self.huffman_kinds:
+            level, strategy = 1, zlib.Z_HUFFMAN_ONLY
+        else:
+            return message
+        started = time.perf_counter()
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, strategy)
+        compressed = compressor.compress(message) + compressor.flush()
+        compression_seconds.inc(time.perf_counter() - started, kind=kind)
+        if len(compressed) >= len(message):
+            return message
+        compression_bytes.inc(len(message), kind=kind, stage="original")
+        compression_bytes.inc(len(compressed), kind=kind, stage="sent")
+        return compressed
+
+
+# 状態を持たないので、全セッションで共有する
+default_policy = CompressionPolicy()
+
+
+def negotiate(requested: Optional[str]) -> Optional[CompressionPolicy]:
+    """Return the compression policy for a client that asked for ``requested``, or None."""
+    if requested is None or DEFLATE not in (value.strip() for value in requested.split(",")):
+        return None
+    return default_policy
@@ -11,9 +11,23 @@ load_dotenv(override=True)
 # Constants
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT", project)
 LOCATION = os.getenv("GOOGLE_CLOUD_REGION", "us-central1")
+# Live API に接続するリージョン（カンマ区切り）。接続時間と失敗率を見て選ぶ
+LIVE_API_REGIONS = [
+    region for region in os.getenv("LIVE_API_REGIONS", LOCATION).split(",") if region
+]
 URLS = [
     "https://cloud.google.com/architecture/deploy-operate-generative-ai-applications"
 ]
+# ベクトルストアに取り込むローカルのドキュメント（カンマ区切り）。
+# 指定した場合は起動時に差分だけを取り込み直す
+DOCS_PATHS = [path for path in os.getenv("DOCS_PATHS", "").split(",") if path]
+# ベクトルストアに取り込む Web ページ（カンマ区切り）。DOCS_PATHS を指定した場合は、
+# 明示しない限りローカルのドキュメントだけを取り込む
+DOCS_URLS = [
+    url for url in os.getenv("DOCS_URLS", "" if DOCS_PATHS else ",".join(URLS)).split(",") if url
+]
+# /metrics と /debug/* を読むための Bearer トークン。空なら公開しない（404 を返す）
+OPS_TOKEN = os.getenv("OPS_TOKEN", "")
 
 if not PROJECT_ID or not LOCATION:
     raise ValueError(
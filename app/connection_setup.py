@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.metrics import counter
+
+# 接続準備の段階ごとの締め切り（秒）。過ぎたら待たずに次へ進む
+USER_DATA_DEADLINE_SECONDS = float(os.getenv("SETUP_USER_DATA_DEADLINE_SECONDS", "1.5"))
+LIVE_CONNECT_DEADLINE_SECONDS = float(os.getenv("SETUP_LIVE_CONNECT_DEADLINE_SECONDS", "15"))
+# 最初の読み取りがこの秒数で返らなければ、同じ読み取りをもう1つ投げる。0 で無効
+USER_DATA_HEDGE_AFTER_SECONDS = float(os.getenv("SETUP_USER_DATA_HEDGE_AFTER_SECONDS", "0.3"))
+# 締め切りに間に合わなかったときに使う、最後に分かっている学習状況の数
+USER_DATA_CACHE_SIZE = 1000
+
+# 読み取りの結果
+FRESH = "fresh"
+HEDGED = "hedged"
+CACHED = "cached"
+MINIMAL = "minimal"
+# /session/prefetch で読んでおいたもの
+PREFETCHED = "prefetched"
+
+setup_phase_seconds = counter(
+    "connection_setup_phase_seconds_total", "Time spent in each connection setup phase"
+)
+setup_phases = counter(
+    "connection_setup_phase_total", "Connection setup phases by outcome"
+)
+
+
+class SetupTimer:
+    """Times the phases of one connection setup, up to the ready status."""
+
+    __slots__ = ("started", "phases", "_phase_started")
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.phases: Dict[str, float] = {}
+        self._phase_started = self.started
+
+    def phase(self, name: str, outcome: str = "ok") -> float:
+        """End the current phase; returns its duration."""
+        now = time.monotonic()
+        duration = self.phases[name] = now - self._phase_started
+        self._phase_started = now
+        setup_phase_seconds.inc(duration, phase=name)
+        setup_phases.inc(phase=name, outcome=outcome)
+        return duration
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+class UserDataLoader:
+    """Reads learner state for a new session within a deadline.
+
+    The read runs on a worker thread. If it has not returned after
+    ``hedge_after`` a second, identical read is started and whichever
+    returns first wins. When neither returns before ``deadline`` the session
+    starts with the last state seen for the user (``CACHED``), or with no
+    state at all (``MINIMAL``); the read keeps going and its result is
+    handed back so the session can pick it up when it arrives.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Optional[Dict[str, Any]]],
+        deadline: float = USER_DATA_DEADLINE_SECONDS,
+        hedge_after: float = USER_DATA_HEDGE_AFTER_SECONDS,
+        cache_size: int = USER_DATA_CACHE_SIZE,
+    ) -> None:
+        self.fetch = fetch
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+
+    def remember(self, user_id: str, user_data: Optional[Dict[str, Any]]) -> None:
+        """Keep the latest known state of a user as the fallback for slow reads."""
+        self._cache[user_id] = user_data
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def load(
+        self, user_id: str
+    ) -> Tuple[Optional[Dict[str, Any]], str, Optional["asyncio.Future[Optional[Dict[str, Any]]]"]]:
+        """Return the user data, where it came from, and the read still in flight.
+
+        Returns:
+            ``(user_data, source, late)``; ``late`` is None unless the deadline
+            passed, in which case it resolves to the fresh user data
+        """
+        primary = asyncio.ensure_future(asyncio.to_thread(self.fetch, user_id))
+        reads = [primary]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        hedge = 0 < self.hedge_after < self.deadline
+        while True:
+            wake = self.hedge_after if hedge else self.deadline
+            timeout = max(0.0, started + wake - loop.time())
+            done, _ = await asyncio.wait(reads, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for read in done:
+                if read.exception() is None:
+                    user_data = read.result()
+                    self.remember(user_id, user_data)
+                    return user_data, FRESH if read is primary else HEDGED, None
+            # 失敗した読み取りは捨て、全部失敗したらそのエラーを返す
+            reads = [read for read in reads if not read.done()]
+            if not reads:
+                raise next(iter(done)).exception()
+            if loop.time() - started >= self.deadline:
+                break
+            if hedge and not done:
+                hedge = False
+                logging.info(f"User data read for {user_id} is slow, hedging")
+                reads.append(asyncio.ensure_future(asyncio.to_thread(self.fetch, user_id)))
+
+        late = self._first_success(reads)
+
+        def remember_late(read: asyncio.Future) -> None:
+            if not read.cancelled() and read.exception() is None:
+                self.remember(user_id, read.result())
+
+        late.add_done_callback(remember_late)
+        if user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            logging.warning(f"User data read for {user_id} missed the deadline, using the cached state")
+            return self._cache[user_id], CACHED, late
+        logging.warning(f"User data read for {user_id} missed the deadline, starting without state")
+        return None, MINIMAL, late
+
+    @staticmethod
+    def _first_success(reads: list) -> "asyncio.Future[Optional[Dict[str, Any]]]":
+        async def first() -> Optional[Dict[str, Any]]:
+            pending = set(reads)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for read in done:
+                    if read.exception() is None:
+                        return read.result()
+                    error = read.exception()
+            raise error
+
+        return asyncio.ensure_future(first())
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import random
+import signal
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from app.metrics import counter
+
+# 再接続までの待ち時間をこの幅（秒）でばらけさせ、子供たちが一斉に別のインスタンスへ来ないようにする
+DRAIN_RECONNECT_SPREAD_SECONDS = float(os.getenv("DRAIN_RECONNECT_SPREAD_SECONDS", "5"))
+# SIGTERM のあと、セッションを引き渡し終えるまで待つ最長の時間（秒）。Cloud Run は 10 秒後に強制終了する
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "8"))
+
+# ドレイン中のクライアントに送る状態。reconnectAfterMs だけ待って接続し直してもらう
+DRAIN_STATUS = "Server is restarting, please reconnect"
+# WebSocket の close code 1012 (Service Restart)
+DRAIN_CLOSE_CODE = 1012
+
+sessions_drained = counter("sessions_drained_total", "Sessions handed off to another instance on shutdown")
+drain_refused = counter("drain_refused_total", "Connections refused while draining, by endpoint")
+
+
+def reconnect_hint(reconnect_after: float) -> Dict[str, Any]:
+    """The status message telling a client to reconnect after ``reconnect_after`` seconds."""
+    return {"status": DRAIN_STATUS, "reconnectAfterMs": round(reconnect_after * 1000)}
+
+
+class Drain:
+    """Hands the sessions of a shutting-down process off to other instances.
+
+    On SIGTERM the process stops admitting sessions, then asks every open
+    session to ``drain(reconnect_after)``: stop relaying, flush its writes,
+    save a snapshot of the child's progress and tell the client when to
+    reconnect. The delays are spread over ``spread`` seconds, so the rest of
+    the fleet sees the reconnects arrive gradually instead of all at once.
+    Only then is the server's own shutdown (closing the listener and the
+    remaining connections) let through.
+    """
+
+    def __init__(
+        self,
+        spread: float = DRAIN_RECONNECT_SPREAD_SECONDS,
+        timeout: float = DRAIN_TIMEOUT_SECONDS,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.spread = spread
+        self.timeout = timeout
+        self.rng = rng or random.Random()
+        self.draining = False
+        self._task: Optional[asyncio.Task] = None
+        self._previous_handler: Any = None
+
+    def reconnect_after(self) -> float:
+        """Seconds a drained client should wait before reconnecting."""
+        return self.rng.uniform(0, self.spread)
+
+    async def run(self, sessions: Iterable[Any], flush: Callable[[], Awaitable[None]]) -> None:
+        """Stop admitting sessions and drain the given ones, within ``timeout`` seconds."""
+        self.draining = True
+        sessions = list(sessions)
+        logging.info(f"Draining {len(sessions)} sessions")
+
+        async def drain_all() -> None:
+            await asyncio.gather(
+                *(session.drain(self.reconnect_after()) for session in sessions), return_exceptions=True
+            )
+            # セッションの外で予約された書き込みも待つ
+            await flush()
+
+        try:
+            await asyncio.wait_for(drain_all(), self.timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Drain did not finish within {self.timeout}s")
+
+    def install(self, drain: Callable[[], Awaitable[None]]) -> None:
+        """Run ``drain`` on SIGTERM before handing the signal to the server.
+
+        Call from the running event loop after the server has installed its
+        own handler (the app's lifespan startup), in the main thread.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+
+        def on_sigterm(signum: int, frame: Any) -> None:
+            if self._task is None:
+                loop.call_soon_threadsafe(self._start, drain, signum, frame)
+
+        self._previous_handler = signal.signal(signal.SIGTERM, on_sigterm)
+
+    def uninstall(self) -> None:
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGTERM, self._previous_handler)
+            self._previous_handler = None
+
+    def _start(self, drain: Callable[[], Awaitable[None]], signum: int, frame: Any) -> None:
+        if self._task is not None:
+            return
+        previous = self._previous_handler
+
+        async def drain_then_exit() -> None:
+            try:
+                await drain()
+            except Exception as e:
+                logging.error(f"Error draining sessions: {e}")
+            # ここから先はサーバー自身の終了処理（待ち受けを閉じ、残りの接続を閉じる）
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.raise_signal(signum)
+
+        self._task = asyncio.create_task(drain_then_exit())
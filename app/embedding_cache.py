@@ -0,0 +1,288 @@
+import hashlib
+import logging
+import queue
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from app.metrics import counter
+
+EMBEDDING_CACHE_PATH = ".embedding_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 10.0
+# バッチで埋め込むのは検索クエリなので、文書とは別のタスク種別で埋め込む
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+
+embedding_cache_lookups = counter(
+    "embedding_cache_lookups_total", "Query embedding cache lookups by outcome (memory_hit, disk_hit, miss)"
+)
+embedding_calls = counter("embedding_calls_total", "Calls to the embedding model")
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache key.
+
+    NFKC folds full-width digits/letters (e.g. "３＋２") into their ASCII forms,
+    whitespace runs are collapsed and latin characters are lower-cased.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingBatcher:
+    """Merges concurrent embedding requests into batched backend calls.
+
+    Callers from any thread submit single texts; a worker thread waits up to
+    ``max_wait_ms`` for more requests to arrive and then embeds up to
+    ``max_batch_size`` distinct texts with one call. Texts are distinct when
+    their :func:`normalize_query` forms differ, as in the cache; requests
+    sharing a normalized form get the vector of the first one. The texts are search
+    queries, so they are embedded with the query task type
+    (``embed(texts, embeddings_task_type="RETRIEVAL_QUERY")``, as
+    ``VertexAIEmbeddings.embed_query`` does for a single text), not as
+    documents. Backends without a batched ``embed`` get one ``embed_query``
+    call per text.
+    """
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ) -> None:
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.embed_calls = 0
+        self.embedded_texts = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, str, Future]]]" = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="embedding-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for embedding and return a future for its vector."""
+        future: Future = Future()
+        self._queue.put((normalize_query(text), text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Embed a single text, blocking until its batch has been processed."""
+        return self.submit(text).result()
+
+    def close(self) -> None:
+        """Stop the worker thread once the queued requests are drained."""
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first: Tuple[str, str, Future]) -> Tuple[List[Tuple[str, str, Future]], bool]:
+        batch = [first]
+        distinct = {first[0]}
+        try:
+            while len(distinct) < self.max_batch_size:
+                item = self._queue.get(timeout=self.max_wait)
+                if item is None:
+                    return batch, True
+                batch.append(item)
+                distinct.add(item[0])
+        except queue.Empty:
+            pass
+        return batch, False
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        embed = getattr(self.backend, "embed", None)
+        if embed is None:
+            return [self.backend.embed_query(text) for text in texts]
+        return embed(texts, embeddings_task_type=QUERY_TASK_TYPE)
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+            # 正規化したキーごとに、最初に聞かれた文を埋め込む
+            texts_by_key: Dict[str, str] = {}
+            for key, text, _ in batch:
+                texts_by_key.setdefault(key, text)
+            texts = list(texts_by_key.values())
+            try:
+                vectors = self._embed_queries(texts)
+                self.embed_calls += 1
+                self.embedded_texts += len(texts)
+                embedding_calls.inc()
+                by_key = dict(zip(texts_by_key, vectors))
+                for key, _, future in batch:
+                    future.set_result(by_key[key])
+            except Exception as e:
+                logging.error(f"Error embedding batch of {len(texts)} texts: {e}")
+                for _, _, future in batch:
+                    future.set_exception(e)
+            if stop:
+                return
+
+
+class _DiskCache:
+    """SQLite backed store of float32 vectors keyed by a text digest."""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return array("f", row[0]).tolist()
+
+    def put(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                (key, array("f", vector).tobytes()),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an LRU and on-disk cache for query vectors.
+
+    Queries are keyed by their normalized text, so the repeated questions the
+    model asks are embedded once; the vector is that of the text as first
+    asked. Cache misses go through an optional
+    :class:`EmbeddingBatcher`. Document embeddings are passed straight through.
+    Lookups and model calls are also counted in ``/metrics``.
+    """
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        cache_path: Optional[str] = EMBEDDING_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        batcher: Optional[EmbeddingBatcher] = None,
+        namespace: str = "",
+    ) -> None:
+        """Initialize the cache.
+
+        Args:
+            backend: The embeddings model that computes vectors on a miss
+            cache_path: SQLite file for the persistent cache, or None to keep
+                the cache in memory only
+            max_entries: Number of vectors kept in the in-memory LRU
+            batcher: Optional batcher used for cache misses
+            namespace: Prefix mixed into keys, e.g. the embedding model name,
+                so vectors from different models never collide on disk
+        """
+        self.backend = backend
+        self.batcher = batcher
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskCache(cache_path) if cache_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.backend_calls = 0
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.namespace}\0{normalize_query(text)}".encode())
+        return digest.hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _count(self, outcome: str) -> None:
+        # 複数のスレッドから呼ばれるので、カウンタはロックの中で増やす
+        with self._lock:
+            if outcome == "memory_hit":
+                self.memory_hits += 1
+            elif outcome == "disk_hit":
+                self.disk_hits += 1
+            elif outcome == "miss":
+                self.misses += 1
+            else:
+                self.backend_calls += 1
+        if outcome == "backend_call":
+            embedding_calls.inc()
+        else:
+            embedding_cache_lookups.inc(outcome=outcome)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+        if vector is not None:
+            self._count("memory_hit")
+            return vector
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._count("disk_hit")
+                self._remember(key, vector)
+                return vector
+
+        self._count("miss")
+        if self.batcher is not None:
+            vector = self.batcher.embed(text)
+        else:
+            self._count("backend_call")
+            vector = self.backend.embed_query(text)
+        self._remember(key, vector)
+        if self._disk is not None:
+            self._disk.put(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._count("backend_call")
+        return self.backend.embed_documents(texts)
+
+    def stats(self) -> Dict[str, float]:
+        """Return cache hit rate and backend call counts."""
+        with self._lock:
+            memory_hits, disk_hits, misses, embed_calls = (
+                self.memory_hits, self.disk_hits, self.misses, self.backend_calls
+            )
+        if self.batcher is not None:
+            embed_calls += self.batcher.embed_calls
+        lookups = memory_hits + disk_hits + misses
+        return {
+            "lookups": lookups,
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (memory_hits + disk_hits) / lookups if lookups else 0.0,
+            "embed_calls": embed_calls,
+        }
+
+    def close(self) -> None:
+        """Release the disk cache and stop the batcher."""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self._disk is not None:
+            self._disk.close()
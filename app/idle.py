@@ -0,0 +1,51 @@
+import base64
+import binascii
+import os
+from typing import Any, Dict
+
+import numpy as np
+
+from app.metrics import counter, gauge
+
+# 子供の声もモデルの出力もない状態がこの秒数続いたら、上流の接続を閉じる
+IDLE_TIMEOUT_SECONDS = float(os.getenv("IDLE_TIMEOUT_SECONDS", "60"))
+IDLE_CHECK_INTERVAL_SECONDS = 1.0
+# 16-bit PCM の RMS がこれを超えたら話し声とみなす（無音・環境音は数十〜数百）
+VOICE_RMS_THRESHOLD = 500.0
+# 話し始める直前の無音フレームと、再接続までの間に届いたフレームを溜めておく数
+# （最初の言葉を落とさないため）
+RESUME_PREROLL_FRAMES = 5
+RESUME_BUFFER_FRAMES = 200
+
+sessions_suspended = counter(
+    "live_sessions_suspended_total", "Upstream Live API sessions closed because the child was idle"
+)
+sessions_resumed = counter(
+    "live_sessions_resumed_total", "Suspended sessions reconnected when the child spoke again"
+)
+connection_seconds_saved = counter(
+    "live_connection_seconds_saved_total", "Seconds without an upstream connection while suspended"
+)
+suspended_sessions = gauge("live_sessions_suspended", "Sessions currently suspended")
+
+
+def audio_rms(data: str) -> float:
+    """Return the RMS level of a base64 encoded 16-bit little-endian PCM chunk."""
+    try:
+        pcm = base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError):
+        return 0.0
+    samples = np.frombuffer(pcm[: len(pcm) // 2 * 2], dtype="<i2")
+    if samples.size == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(samples.astype(np.float32) ** 2)))
+
+
+def is_voiced(message: Dict[str, Any], threshold: float = VOICE_RMS_THRESHOLD) -> bool:
+    """Return True if a client message carries speech or typed content."""
+    if "clientContent" in message:
+        return True
+    for chunk in message.get("realtimeInput", {}).get("mediaChunks", []):
+        if chunk.get("mimeType", "").startswith("audio/") and audio_rms(chunk.get("data", "")) > threshold:
+            return True
+    return False
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain_community.vectorstores.sklearn import JsonSerializer
+from langchain_core.embeddings import Embeddings
+
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 50
+EMBED_BATCH_SIZE = 64
+EMBED_CONCURRENCY = 4
+LOCAL_PATTERNS = ("*.txt", "*.md", "*.html")
+
+
+def chunk_hash(text: str) -> str:
+    """Return the content hash that identifies a chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_text_splitter() -> CharacterTextSplitter:
+    """Return the splitter shared by full and incremental ingestion."""
+    return CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def iter_local_documents(
+    paths: Iterable[str], patterns: Tuple[str, ...] = LOCAL_PATTERNS
+) -> Iterator[Document]:
+    """Stream documents from local files and directories, one file at a time."""
+    for path in map(Path, paths):
+        files = (
+            sorted(f for pattern in patterns for f in path.rglob(pattern))
+            if path.is_dir()
+            else [path]
+        )
+        for file in files:
+            text = file.read_text(encoding="utf-8")
+            if file.suffix == ".html":
+                from bs4 import BeautifulSoup
+
+                text = BeautifulSoup(text, "html.parser").get_text("\n")
+            yield Document(page_content=text, metadata={"source": str(file)})
+
+
+def iter_url_documents(urls: Iterable[str]) -> Iterator[Document]:
+    """Stream documents from web pages."""
+    from langchain_community.document_loaders import WebBaseLoader
+
+    for url in urls:
+        yield from WebBaseLoader(url).lazy_load()
+
+
+@dataclass
+class IngestionReport:
+    """What a single ingestion run changed."""
+
+    chunks_seen: int = 0
+    chunks_added: int = 0
+    chunks_revived: int = 0
+    chunks_tombstoned: int = 0
+    chunks_embedded: int = 0
+    embed_calls: int = 0
+    sources: Set[str] = field(default_factory=set)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.chunks_added or self.chunks_revived or self.chunks_tombstoned)
+
+
+class IncrementalIngestor:
+    """Maintains the chunk manifest and vectors for the persisted store.
+
+    Every chunk is keyed by the SHA-256 of its text. Re-ingesting a corpus only
+    embeds chunks whose hash has never been seen. Chunks that disappear from a
+    source are tombstoned rather than deleted, so they come back for free if
+    the text reappears. The SKLearnVectorStore file is rebuilt from the stored
+    vectors without calling the embedding model again.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        manifest_path: str,
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+    ) -> None:
+        """Open (or create) the manifest.
+
+        Args:
+            embedding: Embeddings model used for new chunks
+            manifest_path: SQLite file holding chunk hashes, texts and vectors
+            batch_size: Number of chunks per embed_documents call
+            concurrency: Number of embedding batches in flight at once
+        """
+        self.embedding = embedding
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.splitter = get_text_splitter()
+        self._conn = sqlite3.connect(manifest_path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS vectors (
+                hash TEXT PRIMARY KEY, text TEXT NOT NULL, vector BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                source TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                metadata TEXT NOT NULL,
+                deleted_at REAL,
+                PRIMARY KEY (source, hash)
+            );
+            """
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _known_hashes(self, hashes: List[str]) -> Set[str]:
+        known: Set[str] = set()
+        for start in range(0, len(hashes), 500):
+            part = hashes[start : start + 500]
+            rows = self._conn.execute(
+                f"SELECT hash FROM vectors WHERE hash IN ({','.join('?' * len(part))})",
+                part,
+            )
+            known.update(row[0] for row in rows)
+        return known
+
+    def _embed(self, chunks: List[Tuple[str, str]]) -> List[Tuple[str, str, bytes]]:
+        vectors = self.embedding.embed_documents([text for _, text in chunks])
+        return [
+            (digest, text, array("f", vector).tobytes())
+            for (digest, text), vector in zip(chunks, vectors)
+        ]
+
+    def ingest(
+        self, documents: Iterable[Document], prune_missing_sources: bool = True
+    ) -> IngestionReport:
+        """Ingest a stream of documents, embedding only unseen chunks.
+
+        Args:
+            documents: Documents to ingest; consumed lazily
+            prune_missing_sources: Tombstone every chunk of sources that are
+                not part of this run, i.e. treat ``documents`` as the full corpus
+
+        Returns:
+            IngestionReport describing what changed
+        """
+        report = IngestionReport()
+        seen: Dict[str, Set[str]] = {}
+        pending: List[Tuple[str, str]] = []
+        queued: Set[str] = set()
+        in_flight: List[Future] = []
+        now = time.time()
+
+        def store(future: Future) -> None:
+            rows = future.result()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO vectors (hash, text, vector) VALUES (?, ?, ?)",
+                rows,
+            )
+            report.embed_calls += 1
+            report.chunks_embedded += len(rows)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+
+            def flush(force: bool = False) -> None:
+                while pending and (force or len(pending) >= self.batch_size):
+                    batch = pending[: self.batch_size]
+                    del pending[: self.batch_size]
+                    in_flight.append(pool.submit(self._embed, batch))
+                    while len(in_flight) > self.concurrency:
+                        store(in_flight.pop(0))
+
+            for doc in documents:
+                source = str(doc.metadata.get("source", ""))
+                report.sources.add(source)
+                source_seen = seen.setdefault(source, set())
+                chunks = self.splitter.split_documents([doc])
+                hashes = [chunk_hash(chunk.page_content) for chunk in chunks]
+                known = self._known_hashes(hashes)
+                for chunk, digest in zip(chunks, hashes):
+                    report.chunks_seen += 1
+                    if digest in source_seen:
+                        continue
+                    source_seen.add(digest)
+                    if digest not in known and digest not in queued:
+                        queued.add(digest)
+                        pending.append((digest, chunk.page_content))
+                    previous = self._conn.execute(
+                        "SELECT deleted_at FROM chunks WHERE source = ? AND hash = ?",
+                        (source, digest),
+                    ).fetchone()
+                    if previous is None:
+                        report.chunks_added += 1
+                    elif previous[0] is not None:
+                        report.chunks_revived += 1
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO chunks (source, hash, position, metadata, deleted_at) "
+                        "VALUES (?, ?, ?, ?, NULL)",
+                        (source, digest, len(source_seen), json.dumps(chunk.metadata)),
+                    )
+                flush()
+            flush(force=True)
+            for future in in_flight:
+                store(future)
+
+        report.chunks_tombstoned = self._tombstone(seen, now, prune_missing_sources)
+        self._conn.commit()
+        logging.info(
+            f"Ingested {report.chunks_seen} chunks from {len(report.sources)} sources: "
+            f"{report.chunks_added} added, {report.chunks_revived} revived, "
+            f"{report.chunks_tombstoned} tombstoned, {report.chunks_embedded} embedded "
+            f"in {report.embed_calls} calls"
+        )
+        return report
+
+    def _tombstone(
+        self, seen: Dict[str, Set[str]], now: float, prune_missing_sources: bool
+    ) -> int:
+        live = self._conn.execute(
+            "SELECT source, hash FROM chunks WHERE deleted_at IS NULL"
+        ).fetchall()
+        stale = [
+            (now, source, digest)
+            for source, digest in live
+            if (source in seen and digest not in seen[source])
+            or (source not in seen and prune_missing_sources)
+        ]
+        self._conn.executemany(
+            "UPDATE chunks SET deleted_at = ? WHERE source = ? AND hash = ?", stale
+        )
+        return len(stale)
+
+    def purge_tombstones(self, older_than: float) -> int:
+        """Permanently drop tombstones and vectors no live chunk references."""
+        cursor = self._conn.execute(
+            "DELETE FROM chunks WHERE deleted_at IS NOT NULL AND deleted_at < ?",
+            (older_than,),
+        )
+        self._conn.execute(
+            "DELETE FROM vectors WHERE hash NOT IN (SELECT hash FROM chunks)"
+        )
+        self._conn.commit()
+        return cursor.rowcount
+
+    def live_chunks(self) -> Iterator[Tuple[str, str, Dict, List[float]]]:
+        """Yield (chunk id, text, metadata, vector) for every live chunk."""
+        rows = self._conn.execute(
+            "SELECT c.source, c.hash, c.metadata, v.text, v.vector FROM chunks c "
+            "JOIN vectors v ON v.hash = c.hash WHERE c.deleted_at IS NULL "
+            "ORDER BY c.source, c.position"
+        )
+        for source, digest, metadata, text, vector in rows:
+            yield (
+                f"{source}#{digest[:16]}",
+                text,
+                json.loads(metadata),
+                array("f", vector).tolist(),
+            )
+
+    def write_vector_store(self, persist_path: str) -> int:
+        """Write live chunks in the SKLearnVectorStore JSON persist format."""
+        data: Dict[str, List] = {"ids": [], "texts": [], "metadatas": [], "embeddings": []}
+        for chunk_id, text, metadata, vector in self.live_chunks():
+            data["ids"].append(chunk_id)
+            data["texts"].append(text)
+            data["metadatas"].append(metadata)
+            data["embeddings"].append(vector)
+        JsonSerializer(persist_path).save(data)
+        return len(data["ids"])
+
+
+def manifest_path_for(persist_path: str) -> str:
+    """Return the manifest file that sits next to a persisted vector store."""
+    return f"{persist_path}.ingest.sqlite"
+
+
+def refresh_vector_store(
+    embedding: Embeddings,
+    documents: Iterable[Document],
+    persist_path: str,
+    prune_missing_sources: bool = True,
+) -> IngestionReport:
+    """Incrementally ingest ``documents`` and rewrite the store if needed."""
+    ingestor = IncrementalIngestor(embedding, manifest_path_for(persist_path))
+    try:
+        report = ingestor.ingest(documents, prune_missing_sources=prune_missing_sources)
+        if report.changed or not os.path.exists(persist_path):
+            ingestor.write_vector_store(persist_path)
+        return report
+    finally:
+        ingestor.close()
+
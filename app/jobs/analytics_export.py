@@ -0,0 +1,248 @@
+"""Export per-level, per-formula accuracy across all users' mathQuestions.
+
+Streams the ``mathQuestions`` collection group, then the ``levelStats``
+aggregates that question compaction folded old questions into, in pages
+ordered by document path. Each page is aggregated with pandas and the
+result is written as Parquet partitioned by level. A levelStats document
+keeps only its most practised formulas; the rest of its counts are
+exported under ``OTHER_FORMULAS``. Progress is checkpointed so an
+interrupted run resumes where it stopped. Run it outside the compaction
+job's window, or questions compacted mid-export are counted twice.
+
+Usage:
+    python -m app.jobs.analytics_export --output analytics/ --checkpoint-dir .export_checkpoint/
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.jobs.compact_questions import LEVEL_STATS
+from app.question_bank import QuestionBank, normalize_formula
+
+PAGE_SIZE = 5000
+CHECKPOINT_EVERY_PAGES = 10
+EXPORT_FIELDS = ["level", "formula", "correctCount", "wrongCount"]
+LEVEL_STATS_FIELDS = ["level", "questions", "correct", "wrong", "formulas"]
+GROUP_KEYS = ["level", "formula"]
+COUNT_COLUMNS = ["questions", "correct", "wrong"]
+# levelStats に代表として残っていない式の分をまとめる行
+OTHER_FORMULAS = "(other)"
+
+
+def iter_pages(
+    db: Any, collection_id: str, fields: List[str], page_size: int = PAGE_SIZE, start_after: Optional[Any] = None
+) -> Iterator[List[Any]]:
+    """Yield pages of snapshots of a collection group across every user, in path order."""
+    query = (
+        db.collection_group(collection_id)
+        .order_by("__name__")
+        .select(fields)
+        .limit(page_size)
+    )
+    cursor = start_after
+    while True:
+        page = list((query.start_after(cursor) if cursor is not None else query).stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+def iter_question_pages(
+    db: Any, page_size: int = PAGE_SIZE, start_after: Optional[Any] = None
+) -> Iterator[List[Any]]:
+    """Yield pages of mathQuestions snapshots from every user, in path order."""
+    return iter_pages(db, "mathQuestions", EXPORT_FIELDS, page_size, start_after)
+
+
+def iter_level_stats_pages(
+    db: Any, page_size: int = PAGE_SIZE, start_after: Optional[Any] = None
+) -> Iterator[List[Any]]:
+    """Yield pages of levelStats snapshots from every user, in path order."""
+    return iter_pages(db, LEVEL_STATS, LEVEL_STATS_FIELDS, page_size, start_after)
+
+
+def _aggregate(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Sum rows of level, formula, questions, correct and wrong by level and formula."""
+    frame = pd.DataFrame(
+        {
+            "level": np.fromiter((row["level"] for row in rows), dtype=np.int64, count=len(rows)),
+            "formula": [row["formula"] for row in rows],
+            **{
+                column: np.fromiter((row[column] for row in rows), dtype=np.int64, count=len(rows))
+                for column in COUNT_COLUMNS
+            },
+        }
+    )
+    # 「3 + 2 = ?」と「３＋２＝？」を同じ式として集計する。式の種類は少ないので、種類ごとに1回だけ正規化する
+    codes, formulas = pd.factorize(frame["formula"])
+    frame["formula"] = pd.Series([normalize_formula(formula) for formula in formulas], dtype="string").take(codes).values
+    return frame.groupby(GROUP_KEYS, sort=False)[COUNT_COLUMNS].sum()
+
+
+def aggregate_page(snapshots: List[Any], question_bank: Optional[QuestionBank] = None) -> pd.DataFrame:
+    """Aggregate one page of question snapshots by level and formula."""
+    rows = []
+    for snapshot in snapshots:
+        question = snapshot.to_dict()
+        formula = question.get("formula")
+        if formula is None and question_bank is not None:
+            # 問題バンクの問題は結果だけなので、式はバンクから
+            bank_item = question_bank.get(snapshot.id)
+            formula = bank_item["formula"] if bank_item is not None else None
+        rows.append({
+            "level": question.get("level") or 1,
+            "formula": formula or "",
+            "questions": 1,
+            "correct": question.get("correctCount") or 0,
+            "wrong": question.get("wrongCount") or 0,
+        })
+    return _aggregate(rows)
+
+
+def aggregate_level_stats_page(snapshots: List[Any], question_bank: Optional[QuestionBank] = None) -> pd.DataFrame:
+    """Aggregate one page of levelStats snapshots by level and formula; their formulas are already resolved."""
+    rows = []
+    for snapshot in snapshots:
+        stats = snapshot.to_dict()
+        level = stats.get("level") or int(snapshot.id)
+        rest = {column: stats.get(column) or 0 for column in COUNT_COLUMNS}
+        for entry in stats.get("formulas") or []:
+            rows.append({"level": level, "formula": entry["formula"], **{
+                column: entry.get(column) or 0 for column in COUNT_COLUMNS
+            }})
+            for column in COUNT_COLUMNS:
+                rest[column] -= entry.get(column) or 0
+        if any(rest.values()):
+            rows.append({"level": level, "formula": OTHER_FORMULAS, **rest})
+    return _aggregate(rows)
+
+
+def merge_aggregates(total: Optional[pd.DataFrame], page: pd.DataFrame) -> pd.DataFrame:
+    """Add a page aggregate into the running total."""
+    if total is None:
+        return page
+    return total.add(page, fill_value=0).astype(np.int64)
+
+
+class AnalyticsExport:
+    """Resumable export job; memory is bounded by page size and distinct formulas."""
+
+    def __init__(
+        self,
+        db: Any,
+        output_dir: str,
+        checkpoint_dir: str,
+        page_size: int = PAGE_SIZE,
+        checkpoint_every: int = CHECKPOINT_EVERY_PAGES,
+        question_bank: Optional[QuestionBank] = None,
+    ) -> None:
+        self.db = db
+        self.output_dir = output_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.page_size = page_size
+        self.checkpoint_every = checkpoint_every
+        self.question_bank = question_bank or QuestionBank.load()
+        self._checkpoint_file = os.path.join(checkpoint_dir, "checkpoint.json")
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if not os.path.exists(self._checkpoint_file):
+            return {}
+        with open(self._checkpoint_file) as fp:
+            return json.load(fp)
+
+    def _save_checkpoint(self, total: pd.DataFrame, state: Dict[str, Any]) -> None:
+        # 集計を新しいファイルに書いてから checkpoint.json を差し替えるので、
+        # どこで中断されても checkpoint とその集計は一致する
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        partial = f"partial-{state['pages']}.parquet"
+        total.reset_index().to_parquet(os.path.join(self.checkpoint_dir, partial), index=False)
+        previous = self._load_checkpoint().get("partial")
+        tmp = self._checkpoint_file + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump({**state, "partial": partial}, fp)
+        os.replace(tmp, self._checkpoint_file)
+        if previous and previous != partial:
+            os.remove(os.path.join(self.checkpoint_dir, previous))
+
+    def run(self) -> pd.DataFrame:
+        """Run (or resume) the export and return the final aggregate."""
+        state = self._load_checkpoint()
+        total: Optional[pd.DataFrame] = None
+        start_after = None
+        if state:
+            total = pd.read_parquet(os.path.join(self.checkpoint_dir, state["partial"])).set_index(GROUP_KEYS)
+            start_after = self.db.document(state["cursor"]).get()
+            logging.info(f"Resuming analytics export after {state['rows']} rows at {state['cursor']}")
+        state.setdefault("rows", 0)
+        state.setdefault("pages", 0)
+        state.setdefault("source", "mathQuestions")
+
+        # 問題を読み終えてから、集約済みの levelStats を読む
+        sources = [
+            ("mathQuestions", iter_question_pages, aggregate_page),
+            (LEVEL_STATS, iter_level_stats_pages, aggregate_level_stats_page),
+        ]
+        names = [name for name, _, _ in sources]
+        for name, iter_source, aggregate in sources[names.index(state["source"]):]:
+            if name != state["source"]:
+                state["source"] = name
+                start_after = None
+            for page in iter_source(self.db, self.page_size, start_after):
+                total = merge_aggregates(total, aggregate(page, self.question_bank))
+                state["rows"] += len(page)
+                state["pages"] += 1
+                state["cursor"] = page[-1].reference.path
+                if state["pages"] % self.checkpoint_every == 0:
+                    self._save_checkpoint(total, state)
+
+        result = self._finalize(total)
+        self._write(result)
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        logging.info(f"Exported {len(result)} level/formula rows from {state['rows']} documents")
+        return result
+
+    def _finalize(self, total: Optional[pd.DataFrame]) -> pd.DataFrame:
+        if total is None:
+            total = pd.DataFrame(
+                {column: pd.Series(dtype=np.int64) for column in COUNT_COLUMNS},
+                index=pd.MultiIndex.from_arrays([[], []], names=GROUP_KEYS),
+            )
+        result = total.reset_index()
+        answers = result["correct"] + result["wrong"]
+        result["accuracy"] = np.where(answers > 0, result["correct"] / answers.where(answers > 0, 1), np.nan)
+        return result.sort_values(GROUP_KEYS, ignore_index=True)
+
+    def _write(self, result: pd.DataFrame) -> None:
+        result.to_parquet(
+            self.output_dir,
+            partition_cols=["level"],
+            index=False,
+            existing_data_behavior="delete_matching",
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default="analytics")
+    parser.add_argument("--checkpoint-dir", default=".analytics_checkpoint")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    from app.tools.firestore import db
+
+    logging.basicConfig(level=logging.INFO)
+    AnalyticsExport(db, args.output, args.checkpoint_dir, page_size=args.page_size).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Generate the leveled question bank loaded by the server at startup.
+
+Builds every level's word problems from fixed templates and number ranges
+with a seeded random generator, so the same seed always writes the same
+file. Item ids are the question fingerprints, so answers recorded for a
+bank item land on the same ``mathQuestions`` document every time.
+
+Usage:
+    python -m app.jobs.build_question_bank --output app/question_bank.json
+"""
+
+import argparse
+import logging
+
+from app.question_bank import BANK_SEED, ITEMS_PER_LEVEL, QUESTION_BANK_PATH, QuestionBank, build_bank, save_bank
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=QUESTION_BANK_PATH)
+    parser.add_argument("--seed", type=int, default=BANK_SEED)
+    parser.add_argument("--items-per-level", type=int, default=ITEMS_PER_LEVEL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    bank = build_bank(args.seed, args.items_per_level)
+    save_bank(bank, args.output)
+    logging.info(f"Wrote {len(QuestionBank(bank))} questions in {len(bank['levels'])} levels to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Roll old mathQuestions up into per-level aggregates and delete them.
+
+For every user, questions not updated within the retention window are
+folded into ``users/{uid}/levelStats/{level}``: question and answer counts,
+accuracy and the most practised formulas. The originals and their entries
+in the user's ``questionIndex`` are deleted in the same batched write as
+the aggregate update, which also lists the level in ``compactedLevels``,
+so a run stopped at any point leaves every question counted exactly once.
+Progress (the last finished user) is checkpointed, and writes are paced to
+stay within Firestore's ramp-up guidance. After each batch the deleted
+question ids are dropped from the cached question indexes and the shared
+user cache (``forget_questions``), so they are not handed out again for a
+repeated formula.
+
+Usage:
+    python -m app.jobs.compact_questions --retention-days 30 --writes-per-second 500
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from app.question_bank import QuestionBank, normalize_formula
+from app.rate_limit import TokenBucket
+
+RETENTION_DAYS = 30
+# 1回のコミットは 500 書き込みまで。集計ドキュメントとユーザードキュメントの分を残す
+QUESTIONS_PER_BATCH = 400
+USERS_PER_PAGE = 200
+WRITES_PER_SECOND = 500
+# レベルごとに残す代表的な式の数
+REPRESENTATIVE_FORMULAS = 10
+LEVEL_STATS = "levelStats"
+
+
+def merge_level_stats(
+    stats: Optional[Dict[str, Any]], level: int, questions: List[Dict[str, Any]], compacted_at: datetime.datetime
+) -> Dict[str, Any]:
+    """Fold question documents into a levelStats document."""
+    stats = dict(stats or {})
+    formulas: Dict[str, Dict[str, Any]] = {
+        entry["formula"]: dict(entry) for entry in stats.get("formulas", [])
+    }
+    correct = wrong = 0
+    for question in questions:
+        question_correct = question.get("correctCount") or 0
+        question_wrong = question.get("wrongCount") or 0
+        correct += question_correct
+        wrong += question_wrong
+        formula = normalize_formula(question.get("formula") or "")
+        entry = formulas.setdefault(formula, {"formula": formula, "questions": 0, "correct": 0, "wrong": 0})
+        entry["questions"] += 1
+        entry["correct"] += question_correct
+        entry["wrong"] += question_wrong
+
+    stats["level"] = level
+    stats["questions"] = stats.get("questions", 0) + len(questions)
+    stats["correct"] = stats.get("correct", 0) + correct
+    stats["wrong"] = stats.get("wrong", 0) + wrong
+    answers = stats["correct"] + stats["wrong"]
+    stats["accuracy"] = stats["correct"] / answers if answers else None
+    # よく解いた式から残す（同数なら間違いの多い式を優先）
+    stats["formulas"] = sorted(
+        formulas.values(), key=lambda entry: (-entry["questions"], -entry["wrong"], entry["formula"])
+    )[:REPRESENTATIVE_FORMULAS]
+    stats["compactedAt"] = compacted_at
+    return stats
+
+
+class QuestionCompaction:
+    """Resumable, rate-limited compaction of every user's old questions."""
+
+    def __init__(
+        self,
+        db: Any,
+        checkpoint_path: str,
+        retention_days: float = RETENTION_DAYS,
+        writes_per_second: float = WRITES_PER_SECOND,
+        batch_size: int = QUESTIONS_PER_BATCH,
+        users_per_page: int = USERS_PER_PAGE,
+        now: Optional[datetime.datetime] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        question_bank: Optional[QuestionBank] = None,
+        on_compacted: Optional[Callable[[str, List[str]], None]] = None,
+    ) -> None:
+        self.db = db
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.users_per_page = users_per_page
+        self.now = now or datetime.datetime.now(datetime.timezone.utc)
+        self.cutoff = self.now - datetime.timedelta(days=retention_days)
+        self.writes = TokenBucket(writes_per_second, writes_per_second, clock)
+        self.sleep = sleep
+        self.question_bank = question_bank or QuestionBank.load()
+        self.on_compacted = on_compacted
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as fp:
+            return json.load(fp)
+
+    def _save_checkpoint(self, state: Dict[str, Any]) -> None:
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(state, fp)
+        os.replace(tmp, self.checkpoint_path)
+
+    def iter_users(self, start_after: Optional[str] = None) -> Iterator[Any]:
+        """Yield user snapshots (with their questionIndex) in id order."""
+        query = self.db.collection("users").order_by("__name__").select(["questionIndex"]).limit(self.users_per_page)
+        cursor = self.db.collection("users").document(start_after).get() if start_after else None
+        while True:
+            page = list((query.start_after(cursor) if cursor is not None else query).stream())
+            yield from page
+            if len(page) < self.users_per_page:
+                return
+            cursor = page[-1]
+
+    def _old_questions(self, user_ref: Any) -> List[Any]:
+        return list(
+            user_ref.collection("mathQuestions")
+            .where(filter=FieldFilter("updatedAt", "<", self.cutoff))
+            .order_by("updatedAt")
+            .limit(self.batch_size)
+            .stream()
+        )
+
+    def _pace(self, writes: int) -> None:
+        delay = self.writes.delay_for(writes)
+        if delay > 0:
+            self.sleep(delay)
+        self.writes.take(writes)
+
+    def compact_user(self, user: Any) -> int:
+        """Compact one user's old questions, one batch at a time; returns how many."""
+        user_ref = user.reference
+        question_index = (user.to_dict() or {}).get("questionIndex") or {}
+        index_by_id = {question_id: fingerprint for fingerprint, question_id in question_index.items()}
+        compacted = 0
+        while True:
+            questions = self._old_questions(user_ref)
+            if not questions:
+                return compacted
+            by_level: Dict[int, List[Dict[str, Any]]] = {}
+            for snapshot in questions:
+                question = snapshot.to_dict()
+                bank_item = self.question_bank.get(snapshot.id)
+                if bank_item is not None and "formula" not in question:
+                    # 問題バンクの問題は結果だけなので、式はバンクから
+                    question["formula"] = bank_item["formula"]
+                by_level.setdefault(question.get("level") or 1, []).append(question)
+
+            batch = self.db.batch()
+            stats_refs = {level: user_ref.collection(LEVEL_STATS).document(str(level)) for level in by_level}
+            existing = {
+                snapshot.reference.id: snapshot.to_dict()
+                for snapshot in self.db.get_all(list(stats_refs.values()))
+                if snapshot.exists
+            }
+            for level, level_questions in by_level.items():
+                stats_ref = stats_refs[level]
+                batch.set(stats_ref, merge_level_stats(existing.get(stats_ref.id), level, level_questions, self.now))
+            # get_user_data は、ここに載っているレベルだけ levelStats を読みに行く
+            user_update: Dict[str, Any] = {"compactedLevels": transforms.ArrayUnion(sorted(by_level))}
+            for snapshot in questions:
+                batch.delete(snapshot.reference)
+                fingerprint = index_by_id.pop(snapshot.id, None)
+                if fingerprint is not None:
+                    user_update[f"questionIndex.{fingerprint}"] = transforms.DELETE_FIELD
+            batch.update(user_ref, user_update)
+            self._pace(len(batch))
+            batch.commit()
+            if self.on_compacted is not None:
+                self.on_compacted(user_ref.id, [snapshot.id for snapshot in questions])
+            compacted += len(questions)
+            if len(questions) < self.batch_size:
+                return compacted
+
+    def run(self) -> Dict[str, int]:
+        """Run (or resume) the compaction; returns users visited and questions compacted."""
+        state = self._load_checkpoint()
+        if state:
+            logging.info(f"Resuming question compaction after user {state['user']}")
+        state.setdefault("users", 0)
+        state.setdefault("questions", 0)
+        for user in self.iter_users(state.get("user")):
+            state["questions"] += self.compact_user(user)
+            state["users"] += 1
+            state["user"] = user.id
+            self._save_checkpoint(state)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        logging.info(f"Compacted {state['questions']} questions of {state['users']} users")
+        return {"users": state["users"], "questions": state["questions"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--retention-days", type=float, default=RETENTION_DAYS)
+    parser.add_argument("--writes-per-second", type=float, default=WRITES_PER_SECOND)
+    parser.add_argument("--checkpoint", default=".compaction_checkpoint.json")
+    args = parser.parse_args()
+
+    from app.tools.firestore import db, forget_questions
+
+    logging.basicConfig(level=logging.INFO)
+    QuestionCompaction(
+        db, args.checkpoint, retention_days=args.retention_days, writes_per_second=args.writes_per_second,
+        on_compacted=forget_questions,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+from typing import Any, Dict, List, Optional
+
+LEVEL_UP_STREAK = 3
+DEFAULT_NAME = "ゲスト"
+
+
+class LearnerState:
+    """In-memory view of a child's progress during one live session.
+
+    Seeded once from ``get_user_data`` and updated from the results of tool
+    calls, so the session knows the current level and correct-answer streak
+    without reading Firestore again.
+    """
+
+    def __init__(
+        self,
+        user_id: str,
+        name: Optional[str] = None,
+        level: int = 1,
+        questions: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        self.user_id = user_id
+        self.name = name
+        self.level = level
+        self.streak = 0
+        self.correct = 0
+        self.wrong = 0
+        # 以前のセッションの問題（get_user_data で取得したもの）
+        self.previous_questions = questions or []
+        # このセッションで出題した問題: question_id -> {formula, level, results}
+        self.asked: Dict[str, Dict[str, Any]] = {}
+        # 締め切りまでに Firestore を読めず、仮の状態で始めたとき True
+        self.provisional = False
+        # インスタンスの停止で切れたセッションの続きのとき True
+        self.resumed = False
+
+    @classmethod
+    def from_user_data(cls, user_id: str, user_data: Optional[Dict[str, Any]]) -> "LearnerState":
+        """Create the state from the result of ``get_user_data`` (None for a new user)."""
+        if user_data is None:
+            return cls(user_id)
+        state = cls(
+            user_id,
+            name=user_data.get("name", DEFAULT_NAME),
+            level=user_data.get("current_level", 1),
+            questions=user_data.get("questions", []),
+        )
+        session = user_data.get("session")
+        if session:
+            state.streak = session.get("streak", 0)
+            state.correct = session.get("correct", 0)
+            state.wrong = session.get("wrong", 0)
+            state.resumed = True
+        return state
+
+    def refresh(self, user_data: Optional[Dict[str, Any]]) -> None:
+        """Replace a provisional state with the user data read late.
+
+        Progress made in this session is kept: the name set by the child and
+        a level reached here win over the stored ones.
+        """
+        self.provisional = False
+        if user_data is None:
+            return
+        self.name = self.name or user_data.get("name", DEFAULT_NAME)
+        self.level = max(self.level, user_data.get("current_level", 1))
+        self.previous_questions = user_data.get("questions", [])
+
+    @property
+    def is_new_user(self) -> bool:
+        return self.name is None
+
+    @property
+    def ready_for_level_up(self) -> bool:
+        return self.streak >= LEVEL_UP_STREAK
+
+    def to_user_data(self) -> Optional[Dict[str, Any]]:
+        """Return the state in the shape ``get_user_data`` returns."""
+        if self.is_new_user:
+            return None
+        questions = [
+            {"id": question_id, **question}
+            for question_id, question in list(self.asked.items())[-2:]
+        ] or self.previous_questions
+        return {"name": self.name, "current_level": self.level, "questions": questions}
+
+    def snapshot(self) -> Dict[str, int]:
+        """Return the progress that is not saved by the tools, for the next session to continue from."""
+        return {"streak": self.streak, "correct": self.correct, "wrong": self.wrong}
+
+    def summary(self) -> Dict[str, Any]:
+        """Return progress data to attach to tool responses."""
+        return {
+            "current_level": self.level,
+            "streak": self.streak,
+            "asked_this_session": len(self.asked),
+            "correct_this_session": self.correct,
+            "wrong_this_session": self.wrong,
+            "ready_for_level_up": self.ready_for_level_up,
+        }
+
+    def record_name(self, name: str) -> None:
+        self.name = name
+
+    def record_question(self, question_id: str, formula: str, level: int) -> None:
+        self.asked.setdefault(
+            question_id,
+            {"formula": formula, "level": level, "correctCount": 0, "wrongCount": 0},
+        )
+
+    def record_result(self, question_id: str, is_correct: bool) -> None:
+        question = self.asked.get(question_id)
+        if is_correct:
+            self.correct += 1
+            self.streak += 1
+        else:
+            self.wrong += 1
+            self.streak = 0
+        if question is not None:
+            question["correctCount" if is_correct else "wrongCount"] += 1
+
+    def level_up(self) -> int:
+        """Advance to the next level and start a new streak."""
+        self.level += 1
+        self.streak = 0
+        return self.level
+
+    def apply_tool_result(
+        self, name: str, args: Dict[str, Any], response: Optional[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """Update the state from a tool call and return the enriched response."""
+        if args.get("user_id", self.user_id) != self.user_id:
+            return response
+        if name == "set_user_name":
+            self.record_name(args["name"])
+            self.level = (response or {}).get("current_level", self.level)
+        elif name == "add_math_question" and response:
+            self.record_question(response["question_id"], args.get("formula", ""), args.get("level", self.level))
+        elif name == "get_next_question" and response:
+            self.record_question(response["question_id"], response["formula"], response["level"])
+        elif name == "upsert_math_question_result":
+            self.record_result(args["question_id"], bool(args.get("is_correct")))
+        else:
+            return response
+        return {**(response or {}), **self.summary()}
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import math
+import os
+import pickle
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores import SKLearnVectorStore
+from pydantic import ConfigDict
+
+from app.embedding_cache import normalize_query
+
+NGRAM_SIZES = (1, 2)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 数字と漢数字を同じ n-gram にする（"3" と "三" を一致させる）
+_DIGITS_TO_KANJI = str.maketrans("0123456789", "〇一二三四五六七八九")
+
+
+def _normalize(text: str) -> str:
+    text = normalize_query(text).translate(_DIGITS_TO_KANJI)
+    return "".join(ch for ch in text if ch.isalnum() or ch in "+-*/=×÷")
+
+
+def char_ngrams(text: str, sizes: Sequence[int] = NGRAM_SIZES) -> List[str]:
+    """Split text into character n-grams.
+
+    Japanese has no word boundaries, so overlapping character n-grams are used
+    as terms. Digits are mapped to kanji numerals so "3" and "三" share terms.
+    """
+    text = _normalize(text)
+    return [text[i : i + n] for n in sizes for i in range(len(text) - n + 1)]
+
+
+class NgramIndex:
+    """BM25-scored inverted index over character n-grams."""
+
+    def __init__(self, texts: Sequence[str], ids: Optional[Sequence[str]] = None) -> None:
+        """Build the index.
+
+        Args:
+            texts: Chunk texts, in the same order as the vector store
+            ids: Chunk ids, used to detect that the index is stale
+        """
+        postings: Dict[str, Tuple[array, array]] = defaultdict(
+            lambda: (array("I"), array("I"))
+        )
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            terms = Counter(char_ngrams(text))
+            lengths[doc_id] = sum(terms.values())
+            for term, tf in terms.items():
+                doc_ids, tfs = postings[term]
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+        self.num_docs = len(texts)
+        self.fingerprint = ids_fingerprint(ids or [])
+        self.avg_length = float(lengths.mean()) if len(texts) else 0.0
+        self.lengths = lengths
+        self.postings = {
+            term: (np.frombuffer(doc_ids, dtype=np.uint32), np.frombuffer(tfs, dtype=np.uint32))
+            for term, (doc_ids, tfs) in postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        """Return the BM25 score of every document for the query."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        if not self.num_docs:
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / self.avg_length)
+        for term, qtf in Counter(char_ngrams(query)).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            doc_ids, tfs = posting
+            idf = math.log(1 + (self.num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            tfs = tfs.astype(np.float32)
+            scores[doc_ids] += qtf * idf * tfs * (BM25_K1 + 1) / (tfs + norm[doc_ids])
+        return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return up to k (document index, score) pairs with a positive score."""
+        scores = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as fp:
+            pickle.dump(self, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> "NgramIndex":
+        with open(path, "rb") as fp:
+            return pickle.load(fp)
+
+
+def ids_fingerprint(ids: Sequence[str]) -> str:
+    """Return a digest identifying the set and order of chunks."""
+    return hashlib.sha256("\0".join(ids).encode("utf-8")).hexdigest()
+
+
+def index_path_for(persist_path: str) -> str:
+    """Return the lexical index file that sits next to a persisted vector store."""
+    return f"{persist_path}.ngram.pkl"
+
+
+def load_or_build_index(vector_store: SKLearnVectorStore, path: str) -> NgramIndex:
+    """Load the persisted index, rebuilding it if the vector store changed."""
+    ids = vector_store._ids
+    if os.path.exists(path):
+        index = NgramIndex.load(path)
+        if index.fingerprint == ids_fingerprint(ids):
+            return index
+    index = NgramIndex(vector_store._texts, ids)
+    index.save(path)
+    logging.info(f"Built n-gram index over {index.num_docs} chunks, {len(index.postings)} terms")
+    return index
+
+
+class HybridRetriever(BaseRetriever):
+    """Lexical prefilter followed by a vector rerank of the candidates.
+
+    The n-gram index picks ``prefilter_k`` candidates, which are then scored by
+    cosine similarity to the query embedding and blended with the normalized
+    BM25 score. Queries without any lexical match fall back to vector search.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: Any
+    index: Any
+    k: int = 4
+    prefilter_k: int = 50
+    vector_weight: float = 0.7
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.index.search(query, self.prefilter_k)
+        if not candidates:
+            return self.vector_store.similarity_search(query, k=self.k)
+
+        ids = np.fromiter((i for i, _ in candidates), dtype=np.intp, count=len(candidates))
+        lexical = np.fromiter((s for _, s in candidates), dtype=np.float32, count=len(candidates))
+        query_vector = np.asarray(
+            self.vector_store.embeddings.embed_query(query), dtype=np.float32
+        )
+        vectors = np.asarray(self.vector_store._embeddings_np[ids], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+        cosine = vectors @ query_vector / np.where(norms == 0, 1, norms)
+        scores = self.vector_weight * cosine + (1 - self.vector_weight) * lexical / lexical[0]
+
+        docs = []
+        for position in np.argsort(-scores)[: self.k]:
+            idx = int(ids[position])
+            docs.append(
+                Document(
+                    page_content=self.vector_store._texts[idx],
+                    metadata={"id": self.vector_store._ids[idx], **self.vector_store._metadatas[idx]},
+                )
+            )
+        return docs
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from app.metrics import counter, gauge
+
+# イベントループの遅れをこの間隔で測る
+LOOP_LAG_INTERVAL_SECONDS = 0.1
+# これより長くループが止まったら、止めているコードのスタックを取る
+LOOP_LAG_THRESHOLD_SECONDS = float(os.getenv("LOOP_LAG_THRESHOLD_SECONDS", "0.05"))
+# 集計する呼び出し元の数の上限（超えた分は "other" にまとめる）
+MAX_CALL_SITES = 50
+RECENT_LAGS = 600
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(APP_DIR)
+
+loop_lag = gauge("event_loop_lag_seconds", "Most recent event loop lag")
+loop_lag_total = counter("event_loop_lag_seconds_total", "Sum of measured event loop lag")
+loop_lag_checks = counter("event_loop_lag_checks_total", "Event loop lag measurements")
+blocked_episodes = counter(
+    "event_loop_blocked_total", "Times the event loop was blocked past the threshold, by call site"
+)
+blocked_seconds = counter(
+    "event_loop_blocked_seconds_total", "Time the event loop was blocked past the threshold, by call site"
+)
+
+
+def call_site(stack: List[traceback.FrameSummary]) -> str:
+    """Return the innermost frame in this app, or the innermost frame at all."""
+    for frame in reversed(stack):
+        if frame.filename.startswith(APP_DIR):
+            return f"{os.path.relpath(frame.filename, ROOT_DIR)}:{frame.lineno} {frame.name}"
+    if stack:
+        frame = stack[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return "unknown"
+
+
+class Offender:
+    """Blocking samples aggregated for one call site."""
+
+    __slots__ = ("site", "episodes", "samples", "seconds", "max_seconds", "stack")
+
+    def __init__(self, site: str) -> None:
+        self.site = site
+        self.episodes = 0
+        self.samples = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.stack: List[str] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "site": self.site,
+            "episodes": self.episodes,
+            "samples": self.samples,
+            "blocked_seconds": round(self.seconds, 3),
+            "max_blocked_seconds": round(self.max_seconds, 3),
+            "stack": self.stack,
+        }
+
+
+class LoopMonitor:
+    """Measures event loop lag and attributes long blocks to the code causing them.
+
+    A coroutine on the loop records a heartbeat every ``interval``. A watchdog
+    thread checks the heartbeat; while it is older than ``interval +
+    threshold`` the loop is blocked, so the thread samples the loop thread's
+    stack with ``sys._current_frames`` and charges the time to its call site.
+    """
+
+    def __init__(
+        self,
+        threshold: float = LOOP_LAG_THRESHOLD_SECONDS,
+        interval: float = LOOP_LAG_INTERVAL_SECONDS,
+        max_sites: int = MAX_CALL_SITES,
+    ) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_interval = threshold / 2
+        self.max_sites = max_sites
+        self.offenders: Dict[str, Offender] = {}
+        self.recent_lags: Deque[float] = deque(maxlen=RECENT_LAGS)
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start measuring the running event loop."""
+        if self._task is not None:
+            return
+        self._stopped.clear()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._heartbeat = time.monotonic()
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.recent_lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag.set(lag)
+            loop_lag_total.inc(lag)
+            loop_lag_checks.inc()
+
+    def _watch(self) -> None:
+        episode_sites: Set[str] = set()
+        while not self._stopped.wait(self.sample_interval):
+            stale = time.monotonic() - self._heartbeat - self.interval
+            if stale <= self.threshold:
+                episode_sites = set()
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self._charge(call_site(stack), stack, stale, episode_sites)
+
+    def _charge(self, site: str, stack: List[traceback.FrameSummary], stale: float, episode_sites: Set[str]) -> None:
+        with self._lock:
+            offender = self.offenders.get(site)
+            if offender is None:
+                if len(self.offenders) >= self.max_sites:
+                    site = "other"
+                    offender = self.offenders.get(site)
+                if offender is None:
+                    offender = self.offenders[site] = Offender(site)
+            if site not in episode_sites:
+                episode_sites.add(site)
+                offender.episodes += 1
+                blocked_episodes.inc(site=site)
+                logging.warning(f"Event loop blocked for {stale:.3f}s at {site}")
+            offender.samples += 1
+            offender.seconds += self.sample_interval
+            offender.max_seconds = max(offender.max_seconds, stale)
+            offender.stack = traceback.format_list(stack[-12:])
+            blocked_seconds.inc(self.sample_interval, site=site)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return lag statistics and offenders, worst first."""
+        lags = sorted(self.recent_lags)
+
+        def percentile(q: float) -> float:
+            return lags[min(len(lags) - 1, int(q * len(lags)))] if lags else 0.0
+
+        with self._lock:
+            offenders = sorted(self.offenders.values(), key=lambda o: -o.seconds)
+            return {
+                "threshold_seconds": self.threshold,
+                "lag_seconds": {
+                    "last": self.recent_lags[-1] if self.recent_lags else 0.0,
+                    "p50": percentile(0.5),
+                    "p99": percentile(0.99),
+                    "max": self.max_lag,
+                },
+                "offenders": [offender.to_dict() for offender in offenders],
+            }
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# 利用量の台帳（追記のみの JSONL）のパス。既定では記録しない（例: usage_ledger.jsonl）
+USAGE_LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", "")
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "60"))
+
+# 子供の声は 16kHz、モデルの声は 24kHz の 16-bit PCM
+INPUT_AUDIO_BYTES_PER_SECOND = 16000 * 2
+OUTPUT_AUDIO_BYTES_PER_SECOND = 24000 * 2
+# モデルの音声メッセージのうち、音声データ以外の JSON の大きさ（おおよそ）
+OUTPUT_AUDIO_ENVELOPE_BYTES = 110
+# "inlineData" は先頭付近にあるので、そこだけを探す
+_SNIFF_BYTES = 256
+
+USAGE_FIELDS = (
+    "sessions",
+    "up_frames",
+    "up_bytes",
+    "down_frames",
+    "down_bytes",
+    "audio_in_seconds",
+    "audio_out_seconds",
+    "video_frames",
+    "prompt_tokens",
+    "response_tokens",
+    "total_tokens",
+)
+
+
+class SessionMeter:
+    """Usage counters for one live session; cheap enough to update per frame."""
+
+    __slots__ = ("user_id", "closed") + USAGE_FIELDS
+
+    def __init__(self, user_id: str) -> None:
+        self.user_id = user_id
+        self.closed = False
+        for name in USAGE_FIELDS:
+            setattr(self, name, 0)
+        self.sessions = 1
+
+    def count_up(self, data: Dict[str, Any], size: int) -> None:
+        """Count a client frame forwarded to the model."""
+        self.up_frames += 1
+        self.up_bytes += size
+        realtime_input = data.get("realtimeInput")
+        if realtime_input is None:
+            return
+        for chunk in realtime_input.get("mediaChunks", ()):
+            mime_type = chunk.get("mimeType", "")
+            if mime_type.startswith("audio/"):
+                # base64 の4文字が3バイト
+                self.audio_in_seconds += len(chunk.get("data", "")) * 3 / 4 / INPUT_AUDIO_BYTES_PER_SECOND
+            elif mime_type.startswith("image/"):
+                self.video_frames += 1
+
+    def count_down(self, message: bytes) -> None:
+        """Count a model frame forwarded to the client."""
+        self.down_frames += 1
+        self.down_bytes += len(message)
+        if message.find(b'"inlineData"', 0, _SNIFF_BYTES) != -1:
+            audio_bytes = (len(message) - OUTPUT_AUDIO_ENVELOPE_BYTES) * 3 / 4
+            self.audio_out_seconds += max(0.0, audio_bytes) / OUTPUT_AUDIO_BYTES_PER_SECOND
+        # 最後の音声と同じメッセージで届くこともある
+        if b'"usageMetadata"' in message:
+            self.count_tokens(json.loads(message).get("usageMetadata", {}))
+
+    def count_tokens(self, usage: Dict[str, Any]) -> None:
+        self.prompt_tokens += usage.get("promptTokenCount", 0) or 0
+        self.response_tokens += usage.get("responseTokenCount", 0) or 0
+        self.total_tokens += usage.get("totalTokenCount", 0) or 0
+
+    def take(self) -> Dict[str, float]:
+        """Return the usage since the last call and reset the counters."""
+        usage = {name: getattr(self, name) for name in USAGE_FIELDS}
+        for name in USAGE_FIELDS:
+            setattr(self, name, 0)
+        return usage
+
+
+def hour_of(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:00Z", time.gmtime(timestamp))
+
+
+class UsageLedger:
+    """Rolls session meters up per uid and hour into an append-only JSONL file.
+
+    Every flush appends one line per (uid, hour) with the usage since the
+    previous flush; sum the lines (``read_ledger``) to get totals. Usage is
+    attributed to the hour of the flush, so up to ``flush_interval`` of it
+    can land in the following hour.
+    """
+
+    def __init__(self, path: str = USAGE_LEDGER_PATH,
+                 flush_interval: float = USAGE_FLUSH_INTERVAL_SECONDS) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.meters: Set[SessionMeter] = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def open_meter(self, user_id: str) -> Optional[SessionMeter]:
+        """Start metering a session; None when the ledger is disabled."""
+        if not self.path:
+            return None
+        meter = SessionMeter(user_id)
+        self.meters.add(meter)
+        return meter
+
+    def close_meter(self, meter: SessionMeter) -> None:
+        """Stop metering a session; its remaining usage goes into the next flush."""
+        meter.closed = True
+
+    def collect(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Take the usage of every meter, rolled up per uid and hour."""
+        hour = hour_of(time.time() if now is None else now)
+        rollup: Dict[str, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        for meter in list(self.meters):
+            usage = meter.take()
+            if meter.closed:
+                self.meters.discard(meter)
+            if not any(usage.values()):
+                continue
+            totals = rollup[meter.user_id]
+            for name, value in usage.items():
+                totals[name] += value
+        return [
+            {"uid": uid, "hour": hour, **{name: round(value, 3) for name, value in totals.items()}}
+            for uid, totals in rollup.items()
+        ]
+
+    def flush(self, now: Optional[float] = None) -> int:
+        """Append the usage since the last flush; returns the number of lines."""
+        entries = self.collect(now)
+        self._append(entries)
+        return len(entries)
+
+    def _append(self, entries: List[Dict[str, Any]]) -> None:
+        if entries:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries)
+
+    def start(self) -> None:
+        """Flush periodically on the running event loop."""
+        if self.path and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.path:
+            self.flush()
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # メーターはループ上で集計し、ファイルへの書き込みだけを別スレッドで行う
+            entries = self.collect()
+            try:
+                await asyncio.to_thread(self._append, entries)
+            except OSError as e:
+                logging.error(f"Error writing usage ledger: {e}")
+
+
+def read_ledger(lines: Iterable[str]) -> Dict[Tuple[str, str], Dict[str, float]]:
+    """Sum ledger lines into totals per (uid, hour)."""
+    totals: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        bucket = totals[(entry["uid"], entry["hour"])]
+        for name in USAGE_FIELDS:
+            bucket[name] += entry.get(name, 0)
+    return dict(totals)
+
+
+usage_ledger = UsageLedger()
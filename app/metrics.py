@@ -0,0 +1,74 @@
+import threading
+from typing import Dict, List, Tuple
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+class Metric:
+    """A named value per label set, rendered in the Prometheus text format."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for labels, value in sorted(self._values.items()):
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"{self.name}{{{label_text}}} {value:g}" if labels else f"{self.name} {value:g}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+_registry: Dict[str, Metric] = {}
+
+
+def counter(name: str, documentation: str) -> Counter:
+    """Get or create a counter."""
+    return _registry.setdefault(name, Counter(name, documentation))  # type: ignore[return-value]
+
+
+def gauge(name: str, documentation: str) -> Gauge:
+    """Get or create a gauge."""
+    return _registry.setdefault(name, Gauge(name, documentation))  # type: ignore[return-value]
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    lines: List[str] = []
+    for name in sorted(_registry):
+        lines.extend(_registry[name].render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,127 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from app.metrics import counter
+
+# チケットの有効期限（秒）。ようこそ画面から /ws を開くまでの時間より長く、短くしておく
+PREFETCH_TICKET_TTL_SECONDS = float(os.getenv("PREFETCH_TICKET_TTL_SECONDS", "30"))
+# チケットの署名鍵。未設定なら起動時に作る（gunicorn の preload で全ワーカーが同じ鍵を持つ）。
+# Cloud Run では別のインスタンスに届いたチケットも受け付けられるよう、設定を必須にする
+PREFETCH_TICKET_SECRET = os.getenv("PREFETCH_TICKET_SECRET", "")
+PREFETCH_CACHE_SIZE = 10000
+
+# チケットだけで /ws に来て、そのチケットが使えなかったときに送る状態。ID トークンか新しいチケットで接続し直してもらう
+TICKET_REJECTED_STATUS = "Ticket is invalid or expired, please reconnect with an ID token"
+
+prefetch_tickets_issued = counter("prefetch_tickets_issued_total", "Prefetch tickets issued")
+prefetch_tickets_redeemed = counter("prefetch_tickets_redeemed_total", "Prefetch tickets presented to /ws by outcome")
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class PrefetchedSession:
+    """What a prefetch prepared for one upcoming ``/ws`` connection."""
+
+    __slots__ = ("user_id", "user_data", "config", "expires")
+
+    def __init__(self, user_id: str, user_data: Optional[Dict[str, Any]], config: Any, expires: float) -> None:
+        self.user_id = user_id
+        self.user_data = user_data
+        self.config = config
+        self.expires = expires
+
+
+class PrefetchTickets:
+    """Short-lived tickets that let ``/ws`` skip token verification and the user data read.
+
+    A ticket is the uid and an expiry, signed with HMAC, so any worker that
+    shares the key can trust it without calling Firebase. The user data
+    and the Live API config built by the prefetch stay in the memory of
+    the worker that served it; a ticket presented to that worker uses
+    them once, and any other worker reads the user data as usual (from the
+    shared user cache when USER_CACHE_PATH is set). Without a ``secret``
+    the key is generated per process, which only works with a single
+    instance, so a secret is required when ``require_secret`` is set (by
+    default on Cloud Run).
+    """
+
+    def __init__(
+        self,
+        secret: str = PREFETCH_TICKET_SECRET,
+        ttl: float = PREFETCH_TICKET_TTL_SECONDS,
+        maxsize: int = PREFETCH_CACHE_SIZE,
+        clock: Callable[[], float] = time.time,
+        require_secret: bool = bool(os.getenv("K_SERVICE")),
+    ) -> None:
+        if not secret and require_secret:
+            raise RuntimeError(
+                "PREFETCH_TICKET_SECRET must be set on Cloud Run; "
+                "without it each instance signs tickets with its own key and rejects the others'"
+            )
+        self._key = secret.encode() if secret else secrets.token_bytes(32)
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._prepared: "OrderedDict[str, PrefetchedSession]" = OrderedDict()
+
+    def _sign(self, payload: str) -> str:
+        return _encode(hmac.new(self._key, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id: str, user_data: Optional[Dict[str, Any]], config: Any) -> str:
+        """Keep what was prepared for ``user_id`` and return the ticket for it.
+
+        With ``config`` None nothing is kept and the ticket only proves the uid.
+        """
+        now = self.clock()
+        # 発行順に並んでいるので、期限切れは先頭から捨てればよい
+        while self._prepared and (
+            len(self._prepared) >= self.maxsize or next(iter(self._prepared.values())).expires <= now
+        ):
+            self._prepared.popitem(last=False)
+        nonce = secrets.token_urlsafe(12)
+        expires = now + self.ttl
+        if config is not None:
+            self._prepared[nonce] = PrefetchedSession(user_id, user_data, config, expires)
+        payload = _encode(json.dumps({"uid": user_id, "exp": expires, "n": nonce}).encode())
+        prefetch_tickets_issued.inc()
+        return f"{payload}.{self._sign(payload)}"
+
+    def redeem(self, ticket: str) -> Optional[PrefetchedSession]:
+        """Return the prepared session of a valid ticket, or None.
+
+        The user data and config are handed out once; presenting the ticket
+        again (or to another worker) still proves the uid until it expires.
+        """
+        payload, _, signature = ticket.partition(".")
+        if not hmac.compare_digest(signature.encode(), self._sign(payload).encode()):
+            prefetch_tickets_redeemed.inc(outcome="invalid")
+            return None
+        try:
+            claims = json.loads(_decode(payload))
+        except ValueError:
+            prefetch_tickets_redeemed.inc(outcome="invalid")
+            return None
+        if claims["exp"] <= self.clock():
+            self._prepared.pop(claims["n"], None)
+            prefetch_tickets_redeemed.inc(outcome="expired")
+            return None
+        prepared = self._prepared.pop(claims["n"], None)
+        if prepared is None:
+            # 別のワーカーで発行されたか、2回目の利用。uid だけは信頼できる
+            prefetch_tickets_redeemed.inc(outcome="uid_only")
+            return PrefetchedSession(claims["uid"], None, None, claims["exp"])
+        prefetch_tickets_redeemed.inc(outcome="prepared")
+        return prepared
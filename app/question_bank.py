@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import unicodedata
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 事前に生成した問題バンク（python -m app.jobs.build_question_bank で作り直す）
+QUESTION_BANK_PATH = os.getenv(
+    "QUESTION_BANK_PATH", os.path.join(os.path.dirname(__file__), "question_bank.json")
+)
+BANK_VERSION = 1
+BANK_SEED = 20250101
+# 1レベルあたりの問題数の上限（組み合わせが多いレベルは決まった乱数で選ぶ）
+ITEMS_PER_LEVEL = 60
+
+# (もの, 助数詞, ある/いる, 増えるとき, 減るとき)
+THINGS = [
+    ("りんご", "個", "あります", "もらいました", "食べました"),
+    ("あめ", "個", "あります", "もらいました", "食べました"),
+    ("えんぴつ", "本", "あります", "買いました", "お友達にあげました"),
+    ("ふうせん", "個", "あります", "ふくらませました", "とんでいきました"),
+    ("ねこ", "匹", "います", "やってきました", "おうちに帰りました"),
+    ("ことり", "羽", "います", "とんできました", "とんでいきました"),
+    ("クッキー", "枚", "あります", "焼きました", "食べました"),
+    ("どんぐり", "個", "あります", "拾いました", "なくしました"),
+]
+# (入れもの, もの, 助数詞, 入り方)
+CONTAINERS = [
+    ("ふくろ", "あめ", "個", "入っています"),
+    ("はこ", "えんぴつ", "本", "入っています"),
+    ("かご", "りんご", "個", "入っています"),
+    ("おさら", "クッキー", "枚", "のっています"),
+]
+
+ADD_TEXT = "{thing}が{a}{unit}{be}。{b}{unit}{gain}。ぜんぶでいくつになるかな？"
+SUB_TEXT = "{thing}が{a}{unit}{be}。{b}{unit}{lose}。のこりはいくつかな？"
+ADD_SUB_TEXT = "{thing}が{a}{unit}{be}。{b}{unit}{gain}。そのあと{c}{unit}{lose}。いまはいくつかな？"
+MUL_TEXT = "{container}に{thing}が{a}{unit}ずつ{held}。{container}は{b}つあります。ぜんぶでいくつかな？"
+
+
+def normalize_formula(formula: str) -> str:
+    """Normalize a formula: width, spacing and operator variants and a trailing ``= ?`` are dropped."""
+    text = unicodedata.normalize("NFKC", formula)
+    text = text.translate(str.maketrans({"×": "*", "÷": "/", "−": "-", "ー": "-"}))
+    text = re.sub(r"\s+", "", text)
+    return re.sub(r"=[?□]*$", "", text)
+
+
+def question_fingerprint(formula: str, level: int) -> str:
+    """A field-name-safe fingerprint of a level and normalized formula.
+
+    ``add_math_question`` indexes a user's questions by it, and it is the id
+    of a bank item.
+    """
+    digest = hashlib.sha1(normalize_formula(formula).encode("utf-8")).hexdigest()[:12]
+    return f"l{level}_{digest}"
+
+
+def _addition(total_max: int, total_min: int = 2) -> Iterator[Tuple[int, ...]]:
+    for a in range(1, 10):
+        for b in range(1, 10):
+            if total_min <= a + b <= total_max:
+                yield a, b
+
+
+def _carry_addition() -> Iterator[Tuple[int, ...]]:
+    return ((a, b) for a in range(2, 10) for b in range(2, 10) if a + b > 10)
+
+
+def _subtraction(minuend_max: int) -> Iterator[Tuple[int, ...]]:
+    return ((a, b) for a in range(2, minuend_max + 1) for b in range(1, a))
+
+
+def _borrow_subtraction() -> Iterator[Tuple[int, ...]]:
+    return ((a, b) for a in range(11, 19) for b in range(2, 10) if a % 10 < b)
+
+
+def _add_then_subtract() -> Iterator[Tuple[int, ...]]:
+    return (
+        (a, b, c)
+        for a in range(1, 10) for b in range(1, 10) for c in range(1, 10)
+        if a + b <= 20 and c <= a + b
+    )
+
+
+def _two_digit_addition() -> Iterator[Tuple[int, ...]]:
+    return (
+        (a, b)
+        for a in range(10, 90) for b in range(10, 90)
+        if a % 10 + b % 10 < 10 and a + b < 100
+    )
+
+
+def _times_table(first: int, last: int) -> Iterator[Tuple[int, ...]]:
+    return ((a, b) for a in range(first, last + 1) for b in range(1, 10))
+
+
+# レベル -> (式の種類, 数の組み合わせ)
+LEVELS: Dict[int, Tuple[str, Callable[[], Iterator[Tuple[int, ...]]]]] = {
+    1: ("add", lambda: _addition(5)),
+    2: ("sub", lambda: _subtraction(5)),
+    3: ("add", lambda: _addition(10, 6)),
+    4: ("sub", lambda: _subtraction(10)),
+    5: ("add", _carry_addition),
+    6: ("sub", _borrow_subtraction),
+    7: ("add_sub", _add_then_subtract),
+    8: ("add", _two_digit_addition),
+    9: ("mul", lambda: _times_table(2, 5)),
+    10: ("mul", lambda: _times_table(6, 9)),
+}
+
+
+def _render(kind: str, numbers: Tuple[int, ...], rng: random.Random) -> Tuple[str, str, int]:
+    """Return (question text, formula, answer) for one combination."""
+    if kind == "mul":
+        a, b = numbers
+        container, thing, unit, held = rng.choice(CONTAINERS)
+        text = MUL_TEXT.format(container=container, thing=thing, unit=unit, held=held, a=a, b=b)
+        return text, f"{a} × {b} = ?", a * b
+    thing, unit, be, gain, lose = rng.choice(THINGS)
+    words = {"thing": thing, "unit": unit, "be": be, "gain": gain, "lose": lose}
+    if kind == "add_sub":
+        a, b, c = numbers
+        return ADD_SUB_TEXT.format(a=a, b=b, c=c, **words), f"{a} + {b} - {c} = ?", a + b - c
+    a, b = numbers
+    if kind == "add":
+        return ADD_TEXT.format(a=a, b=b, **words), f"{a} + {b} = ?", a + b
+    return SUB_TEXT.format(a=a, b=b, **words), f"{a} - {b} = ?", a - b
+
+
+def build_bank(seed: int = BANK_SEED, items_per_level: int = ITEMS_PER_LEVEL) -> Dict[str, Any]:
+    """Generate the leveled bank; the same seed always gives the same artifact."""
+    levels: Dict[str, Dict[str, List[Any]]] = {}
+    for level, (kind, combinations) in sorted(LEVELS.items()):
+        rng = random.Random(f"{seed}:{level}")
+        chosen = list(combinations())
+        if len(chosen) > items_per_level:
+            chosen = sorted(rng.sample(chosen, items_per_level))
+        columns: Dict[str, List[Any]] = {"ids": [], "texts": [], "formulas": [], "answers": []}
+        for numbers in chosen:
+            text, formula, answer = _render(kind, numbers, rng)
+            columns["ids"].append(question_fingerprint(formula, level))
+            columns["texts"].append(text)
+            columns["formulas"].append(formula)
+            columns["answers"].append(str(answer))
+        levels[str(level)] = columns
+    return {"version": BANK_VERSION, "seed": seed, "levels": levels}
+
+
+class QuestionBank:
+    """The precomputed bank of word problems, indexed by level and by item id.
+
+    Each child walks every level in their own fixed order (a permutation
+    seeded by the user id), so all a child needs to store is how far they
+    got in each level and the results of the items they answered.
+    """
+
+    def __init__(self, bank: Dict[str, Any]) -> None:
+        self.version = bank["version"]
+        self._levels = {int(level): columns for level, columns in bank["levels"].items()}
+        self._by_id = {
+            question_id: (level, position)
+            for level, columns in self._levels.items()
+            for position, question_id in enumerate(columns["ids"])
+        }
+        self.max_level = max(self._levels)
+
+    @classmethod
+    def load(cls, path: str = QUESTION_BANK_PATH) -> "QuestionBank":
+        """Load the artifact, or build the bank in memory if it is missing."""
+        if not os.path.exists(path):
+            logging.warning(f"Question bank {path} not found; building it in memory")
+            return cls(build_bank())
+        with open(path, encoding="utf-8") as fp:
+            return cls(json.load(fp))
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self._by_id
+
+    def level_size(self, level: int) -> int:
+        return len(self._levels[self._clamp(level)]["ids"])
+
+    def _clamp(self, level: int) -> int:
+        # 用意したレベルを超えたら一番上のレベルの問題を出す
+        return min(max(level, 1), self.max_level)
+
+    def _item(self, level: int, position: int) -> Dict[str, Any]:
+        columns = self._levels[level]
+        return {
+            "question_id": columns["ids"][position],
+            "question_text": columns["texts"][position],
+            "formula": columns["formulas"][position],
+            "answer": columns["answers"][position],
+            "level": level,
+        }
+
+    def get(self, question_id: str) -> Optional[Dict[str, Any]]:
+        """Look up an item by id; None for a question not from the bank."""
+        found = self._by_id.get(question_id)
+        return self._item(*found) if found is not None else None
+
+    def nth_for(self, user_id: str, level: int, n: int) -> Dict[str, Any]:
+        """The ``n``-th item of ``level`` in the user's order; wraps around once every item was seen."""
+        level = self._clamp(level)
+        order = list(range(len(self._levels[level]["ids"])))
+        random.Random(f"{user_id}:{level}").shuffle(order)
+        return self._item(level, order[n % len(order)])
+
+
+def save_bank(bank: Dict[str, Any], path: str) -> None:
+    # 1レベル1行にして、作り直したときの差分を読みやすくする
+    lines = [f'{{"version": {bank["version"]}, "seed": {bank["seed"]}, "levels": {{']
+    levels = list(bank["levels"].items())
+    for i, (level, columns) in enumerate(levels):
+        separator = "," if i < len(levels) - 1 else ""
+        lines.append(f'"{level}": {json.dumps(columns, ensure_ascii=False, separators=(",", ":"))}{separator}')
+    lines.append("}}")
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write("\n".join(lines) + "\n")
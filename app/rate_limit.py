@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.metrics import counter
+
+# (1秒あたりのフレーム数, バースト) — フロントエンドは音声を約8フレーム/秒、
+# 映像を0.5フレーム/秒で送るので、その数倍を上限にする
+CONNECTION_BUDGETS: Dict[str, Tuple[float, float]] = {
+    "audio": (float(os.getenv("AUDIO_FRAMES_PER_SECOND", "20")), 40),
+    "video": (float(os.getenv("VIDEO_FRAMES_PER_SECOND", "2")), 4),
+    "clientContent": (float(os.getenv("CLIENT_CONTENT_PER_SECOND", "1")), 5),
+}
+# 同じ uid の接続（複数タブなど）で共有する上限
+USER_BUDGETS: Dict[str, Tuple[float, float]] = {
+    kind: (rate * 1.5, burst * 1.5) for kind, (rate, burst) in CONNECTION_BUDGETS.items()
+}
+# clientContent は落とさずに、この秒数までは待たせる
+MAX_CONTENT_DELAY_SECONDS = 1.0
+
+inbound_frames = counter(
+    "inbound_frames_total", "Client frames by kind and outcome (forwarded, delayed, dropped)"
+)
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second with bursts of up to ``burst``."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "clock")
+
+    def __init__(
+        self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, amount: float = 1.0) -> bool:
+        self._refill()
+        return self.tokens >= amount
+
+    def take(self, amount: float = 1.0) -> None:
+        self.tokens -= amount
+
+    def delay_for(self, amount: float = 1.0) -> float:
+        """Return the seconds until ``amount`` tokens are available."""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class _UserBudget:
+    __slots__ = ("buckets", "__weakref__")
+
+    def __init__(self, clock: Callable[[], float]) -> None:
+        self.buckets = {
+            kind: TokenBucket(rate, burst, clock) for kind, (rate, burst) in USER_BUDGETS.items()
+        }
+
+
+# 接続が残っている uid の分だけ保持する
+_user_budgets: "weakref.WeakValueDictionary[str, _UserBudget]" = weakref.WeakValueDictionary()
+
+
+def frame_kind(message: Dict[str, Any]) -> Optional[str]:
+    """Return the budget a client message is charged to."""
+    if "clientContent" in message:
+        return "clientContent"
+    chunks = message.get("realtimeInput", {}).get("mediaChunks", [])
+    if any(chunk.get("mimeType", "").startswith("image/") for chunk in chunks):
+        return "video"
+    if chunks:
+        return "audio"
+    return None
+
+
+class InboundLimiter:
+    """Per-connection and per-uid budgets for frames sent upstream.
+
+    Audio and video frames over budget are dropped, since the next frame
+    supersedes them. clientContent (typed turns) is delayed up to
+    ``MAX_CONTENT_DELAY_SECONDS`` and only dropped after that.
+    """
+
+    __slots__ = ("buckets", "user_budget")
+
+    def __init__(self, user_id: str, clock: Callable[[], float] = time.monotonic) -> None:
+        self.buckets = {
+            kind: TokenBucket(rate, burst, clock)
+            for kind, (rate, burst) in CONNECTION_BUDGETS.items()
+        }
+        user_budget = _user_budgets.get(user_id)
+        if user_budget is None:
+            user_budget = _user_budgets[user_id] = _UserBudget(clock)
+        self.user_budget = user_budget
+
+    def _try_take(self, kind: str) -> bool:
+        connection = self.buckets[kind]
+        user = self.user_budget.buckets[kind]
+        if connection.available() and user.available():
+            connection.take()
+            user.take()
+            return True
+        return False
+
+    async def admit(self, message: Dict[str, Any]) -> bool:
+        """Return True if the message may be forwarded, waiting if it is worth it."""
+        kind = frame_kind(message)
+        if kind is None:
+            return True
+        if self._try_take(kind):
+            inbound_frames.inc(kind=kind, outcome="forwarded")
+            return True
+        if kind == "clientContent":
+            delay = max(self.buckets[kind].delay_for(), self.user_budget.buckets[kind].delay_for())
+            if delay <= MAX_CONTENT_DELAY_SECONDS:
+                await asyncio.sleep(delay)
+                if self._try_take(kind):
+                    inbound_frames.inc(kind=kind, outcome="delayed")
+                    return True
+        inbound_frames.inc(kind=kind, outcome="dropped")
+        # 送り続けるクライアントがイベントループを占有しないよう、他のセッションに譲る
+        await asyncio.sleep(0)
+        return False
@@ -14,22 +14,99 @@
 # pylint: disable=W0212,W0718,W0621
 
 import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import functools
+import hmac
 import json
 import logging
-from typing import Any, Callable, Dict, Literal, Optional, Union
-
-from app.agent import MODEL_ID, genai_client, get_live_connect_config, tool_functions
+import math
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Literal, Optional, Union
+
+from app.agent import MODEL_ID, get_live_connect_config, live_pool, tool_functions
+from app.clients import LazyClient
+from app.config import OPS_TOKEN
+from app.compression import CompressionPolicy, negotiate
+from app.connection_setup import (
+    FRESH,
+    HEDGED,
+    LIVE_CONNECT_DEADLINE_SECONDS,
+    MINIMAL,
+    PREFETCHED,
+    SetupTimer,
+    UserDataLoader,
+)
+from app.drain import DRAIN_CLOSE_CODE, DRAIN_STATUS, Drain, drain_refused, reconnect_hint, sessions_drained
+from app.idle import (
+    IDLE_CHECK_INTERVAL_SECONDS,
+    IDLE_TIMEOUT_SECONDS,
+    RESUME_BUFFER_FRAMES,
+    RESUME_PREROLL_FRAMES,
+    connection_seconds_saved,
+    is_voiced,
+    sessions_resumed,
+    sessions_suspended,
+    suspended_sessions,
+)
+from app.learner_state import LearnerState
+from app.loop_monitor import loop_monitor
+from app.metering import SessionMeter, usage_ledger
+from app.metrics import render as render_metrics
+from app.prefetch import TICKET_REJECTED_STATUS, PrefetchedSession, PrefetchTickets
+from app.rate_limit import InboundLimiter, frame_kind
+from app.session_registry import (
+    FirestoreLeaseBackend,
+    InMemoryLeaseBackend,
+    LeaseBackend,
+    SessionRegistry,
+)
+from app.stats import StatsCache, etag_matches
+from app.tools.firestore import db as firestore_db
+from app.tools.firestore import firebase_app
+from app.tools.firestore import (
+    add_write_listener,
+    clear_session_snapshot,
+    flush_pending_writes,
+    get_user_data,
+    get_user_stats,
+    save_session_snapshot,
+    save_user_level,
+)
+from app.tap import MODEL as TAP_MODEL
+from app.tap import TOOL as TAP_TOOL
+from app.tap import SessionTap, tap_registry
+from app.templates import USER_DATA_ARRIVED_INSTRUCTION
+from app.trace import DOWN, TOOL, UP, TraceRecorder, open_recorder, upstream_kind
 from firebase_admin import auth
 import backoff
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, Header, HTTPException, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from google.cloud import logging as google_cloud_logging
 from google.genai import types
 from google.genai.types import LiveServerToolCall
 from pydantic import BaseModel
 from websockets.exceptions import ConnectionClosedError
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Run the event loop monitor and the usage ledger for the lifetime of the server.
+
+    Also drains the sessions on SIGTERM before the server shuts down.
+    """
+    loop_monitor.start()
+    usage_ledger.start()
+    drain.install(drain_sessions)
+    yield
+    drain.uninstall()
+    await usage_ledger.stop()
+    await loop_monitor.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -41,16 +118,78 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-logging_client = google_cloud_logging.Client()
-logger = logging_client.logger(__name__)
+# Cloud Logging のクライアントも、ワーカープロセスごとに最初に使うときに作る
+logger = LazyClient(lambda: google_cloud_logging.Client().logger(__name__), "Cloud Logging")
 logging.basicConfig(level=logging.INFO)
 
 
+def get_lease_backend() -> LeaseBackend:
+    """Return the lease backend enforcing one live session per user.
+
+    Cloud Run runs several instances, so leases are kept in Firestore there;
+    locally an in-memory backend is enough.
+    """
+    default = "firestore" if os.getenv("K_SERVICE") else "memory"
+    if os.getenv("SESSION_LEASE_BACKEND", default) == "firestore":
+        return FirestoreLeaseBackend(firestore_db)
+    return InMemoryLeaseBackend()
+
+
+def verify_id_token(id_token: Optional[str]) -> Dict[str, Any]:
+    """Verify a Firebase ID token with this worker's Firebase app."""
+    return auth.verify_id_token(id_token, app=firebase_app.instance())
+
+
+session_registry = SessionRegistry(get_lease_backend())
+user_data_loader = UserDataLoader(get_user_data)
+stats_cache = StatsCache(get_user_stats)
+add_write_listener(stats_cache.invalidate)
+prefetch_tickets = PrefetchTickets()
+drain = Drain()
+
+
 class GeminiSession:
     """Manages bidirectional communication between a client and the Gemini model."""
 
+    # 同時接続数を増やせるよう、セッションごとのメモリを小さく保つ
+    __slots__ = (
+        "session",
+        "websocket",
+        "run_id",
+        "user_id",
+        "tool_functions",
+        "learner_state",
+        "reconnect",
+        "limiter",
+        "trace",
+        "meter",
+        "tap",
+        "late_user_data",
+        "compression",
+        "idle_timeout",
+        "connection_seconds_saved",
+        "_is_running",
+        "_last_activity",
+        "_suspended_at",
+        "_resume",
+        "_resume_buffer",
+        "_drained",
+    )
+
     def __init__(
-        self, session: Any, websocket: WebSocket, tool_functions: Dict[str, Callable]
+        self,
+        session: Any,
+        websocket: WebSocket,
+        tool_functions: Dict[str, Callable],
+        learner_state: Optional[LearnerState] = None,
+        reconnect: Optional[Callable[[], Any]] = None,
+        limiter: Optional[InboundLimiter] = None,
+        trace: Optional[TraceRecorder] = None,
+        meter: Optional[SessionMeter] = None,
+        tap: Optional[SessionTap] = None,
+        late_user_data: Optional["asyncio.Future[Optional[Dict]]"] = None,
+        compression: Optional[CompressionPolicy] = None,
+        idle_timeout: float = IDLE_TIMEOUT_SECONDS,
     ) -> None:
         """Initialize the Gemini session.
 
@@ -59,22 +198,177 @@ class GeminiSession:
             websocket: The client websocket connection
             user_id: Unique identifier for this client
             tool_functions: Dictionary of available tool functions
+            learner_state: Progress of the child, seeded from get_user_data
+            reconnect: Returns an async context manager for a new Gemini
+                session; enables suspending the upstream connection when idle
+            limiter: Drops or delays client frames over the connection's and
+                the user's budgets
+            trace: Records frame timing for replay, when tracing is enabled
+            meter: Counts bytes, frames, audio seconds and tokens for the
+                usage ledger
+            tap: Hands model messages and tool calls to secondary consumers
+                (analytics, moderation) without waiting on them
+            late_user_data: The user data read still in flight when the
+                session started without it; applied when it arrives
+            compression: Which model messages to compress for the client,
+                when the client asked for compression
+            idle_timeout: Seconds without speech or model output before the
+                upstream connection is suspended
         """
         self.session = session
         self.websocket = websocket
         self.run_id = "n/a"
         self.user_id = "n/a"
         self.tool_functions = tool_functions
+        self.learner_state = learner_state
+        self.reconnect = reconnect
+        self.limiter = limiter
+        self.trace = trace
+        self.meter = meter
+        self.tap = tap
+        self.late_user_data = late_user_data
+        self.compression = compression
+        self.idle_timeout = idle_timeout
+        self.connection_seconds_saved = 0.0
         self._is_running = True
+        self._last_activity = time.monotonic()
+        self._suspended_at: Optional[float] = None
+        # 休止したときだけ作る
+        self._resume: Optional[asyncio.Event] = None
+        self._resume_buffer: Optional[Deque[str]] = None
+        # ドレインを始めたときだけ作る。終わるまで run() から戻らない
+        self._drained: Optional[asyncio.Event] = None
+
+    @property
+    def suspended(self) -> bool:
+        """Whether the upstream connection is closed while the client stays connected."""
+        return self._suspended_at is not None
 
     async def stop(self):
         """Stop the session."""
         self._is_running = False
+        if self._resume is not None:
+            self._resume.set()
+        if self.suspended:
+            self._end_suspension()
         try:
             await self.session._ws.close()
         except Exception as e:
             logging.error(f"Error closing session: {e}")
 
+    async def takeover(self) -> None:
+        """Close this session because the same user connected again elsewhere.
+
+        Pending Firestore writes are flushed before the client is told, so
+        the new session reads up-to-date progress.
+        """
+        if not self._is_running:
+            return
+        await self.stop()
+        user_id = self.learner_state.user_id if self.learner_state else self.user_id
+        await flush_pending_writes(user_id)
+        logging.info(f"Session of {user_id} taken over by a newer connection")
+        try:
+            await self.websocket.send_json({"status": "Session taken over by another connection"})
+            await self.websocket.close(code=4000, reason="taken over")
+        except Exception as e:
+            logging.error(f"Error closing taken over session: {e}")
+
+    async def drain(self, reconnect_after: float) -> None:
+        """Close this session because the instance is shutting down.
+
+        Pending Firestore writes are flushed and a snapshot of the session's
+        progress is saved before the client is told to reconnect after
+        ``reconnect_after`` seconds, so the next session, on another
+        instance, continues where this one stopped.
+        """
+        if not self._is_running:
+            return
+        # stop() で relay が終わっても、クライアントに伝えて閉じるまでは run() から戻らない
+        # （戻るとエンドポイントが先に接続を閉じてしまう）
+        self._drained = asyncio.Event()
+        try:
+            await self.stop()
+            state = self.learner_state
+            user_id = state.user_id if state else self.user_id
+            await flush_pending_writes(user_id)
+            if state is not None and not state.provisional and not state.is_new_user:
+                try:
+                    await asyncio.to_thread(save_session_snapshot, user_id, state.snapshot())
+                except Exception as e:
+                    logging.error(f"Error saving session snapshot of {user_id}: {e}")
+            sessions_drained.inc()
+            try:
+                await self.websocket.send_json(reconnect_hint(reconnect_after))
+                await self.websocket.close(code=DRAIN_CLOSE_CODE, reason="server restarting")
+            except Exception as e:
+                logging.error(f"Error closing drained session: {e}")
+        finally:
+            self._drained.set()
+
+    async def suspend(self) -> None:
+        """Close the upstream connection, keeping the client websocket open."""
+        if self.suspended or self.reconnect is None or not self._is_running:
+            return
+        self._suspended_at = time.monotonic()
+        self._resume = asyncio.Event()
+        self._resume_buffer = deque(maxlen=RESUME_BUFFER_FRAMES)
+        sessions_suspended.inc()
+        suspended_sessions.inc()
+        logging.info(f"Suspending idle session for client {self.user_id}")
+        try:
+            await self.session._ws.close()
+        except Exception as e:
+            logging.error(f"Error closing idle session: {e}")
+
+    def _end_suspension(self) -> None:
+        saved = time.monotonic() - self._suspended_at
+        self.connection_seconds_saved += saved
+        connection_seconds_saved.inc(saved)
+        suspended_sessions.dec()
+        self._suspended_at = None
+
+    async def _resume_session(self, session: Any) -> None:
+        self.session = session
+        while self._resume_buffer:
+            await session._ws.send(self._resume_buffer.popleft())
+        self._end_suspension()
+        self._resume = None
+        self._resume_buffer = None
+        self._last_activity = time.monotonic()
+        sessions_resumed.inc()
+        logging.info(f"Resumed session for client {self.user_id}")
+
+    async def watch_idle(self) -> None:
+        """Suspend the upstream connection when neither side has been active."""
+        while self._is_running:
+            await asyncio.sleep(min(IDLE_CHECK_INTERVAL_SECONDS, self.idle_timeout))
+            idle_for = time.monotonic() - self._last_activity
+            if not self.suspended and idle_for > self.idle_timeout:
+                await self.suspend()
+
+    async def apply_late_user_data(self) -> None:
+        """Wait for the user data read that missed the deadline and pass it on."""
+        try:
+            user_data = await self.late_user_data
+        except Exception as e:
+            logging.error(f"Error reading user data for client {self.user_id}: {e}")
+            return
+        finally:
+            self.late_user_data = None
+        if self.learner_state is not None:
+            self.learner_state.refresh(user_data)
+            user_data = self.learner_state.to_user_data()
+        if not self._is_running or self.suspended:
+            # 休止中なら、再接続のときに学習状況から設定が作られる
+            return
+        text = f"{USER_DATA_ARRIVED_INSTRUCTION}\nユーザー情報 {user_data}"
+        message = {"clientContent": {"turns": [{"role": "user", "parts": [{"text": text}]}], "turnComplete": False}}
+        try:
+            await self.session._ws.send(json.dumps(message))
+        except Exception as e:
+            logging.error(f"Error sending user data to Gemini: {e}")
+
     async def receive_from_client(self) -> None:
         """Listen for and process messages from the client.
 
@@ -86,10 +380,34 @@ class GeminiSession:
                 data = await self.websocket.receive_json()
                 if not self._is_running:
                     break
+                received = self.trace.now() if self.trace is not None else 0.0
                 if isinstance(data, dict) and (
                     "realtimeInput" in data or "clientContent" in data
                 ):
-                    await self.session._ws.send(json.dumps(data))
+                    if self.limiter is not None and not await self.limiter.admit(data):
+                        if self.trace is not None:
+                            self._trace_up(data, None, received, x="dropped")
+                        continue
+                    message = json.dumps(data)
+                    voiced = is_voiced(data)
+                    if voiced:
+                        self._last_activity = time.monotonic()
+                    if self.suspended:
+                        # 再接続するまで溜めておき、話し始めたら再接続する
+                        self._resume_buffer.append(message)
+                        if voiced:
+                            self._resume.set()
+                        elif not self._resume.is_set():
+                            while len(self._resume_buffer) > RESUME_PREROLL_FRAMES:
+                                self._resume_buffer.popleft()
+                        if self.trace is not None:
+                            self._trace_up(data, message, received, x="buffered")
+                    else:
+                        await self.session._ws.send(message)
+                        if self.meter is not None:
+                            self.meter.count_up(data, len(message))
+                        if self.trace is not None:
+                            self._trace_up(data, message, received, self.trace.now())
                 elif "setup" in data:
                     self.run_id = data["setup"]["run_id"]
                     self.user_id = data["setup"]["user_id"]
@@ -105,10 +423,37 @@ class GeminiSession:
                 await self.stop()
                 break
 
+    def _trace_up(
+        self, data: Dict[str, Any], message: Optional[str], received: float,
+        forwarded: Optional[float] = None, **extra: Any
+    ) -> None:
+        size = len(message) if message is not None else len(json.dumps(data))
+        self.trace.record(
+            UP, frame_kind(data) or "other", size, received, forwarded,
+            payload=data, **extra
+        )
+
     def _get_func(self, action_label: str) -> Optional[Callable]:
         """Get the tool function for a given action label."""
         return None if action_label == "" else self.tool_functions.get(action_label)
 
+    def _call_tool(self, name: str, args: Dict[str, Any]) -> Any:
+        """Run a tool function, keeping the learner state in sync.
+
+        Level-ups are computed from the in-memory state and saved with a
+        single write instead of reading the user document first.
+        """
+        state = self.learner_state
+        # 仮の状態で始めたときは、ユーザー情報が届くまで Firestore のツールをそのまま使う
+        if state is None or state.provisional or args.get("user_id", state.user_id) != state.user_id:
+            return self._get_func(name)(**args)
+        if name == "increment_user_level":
+            level = state.level_up()
+            save_user_level(state.user_id, level)
+            return {"name": state.name or "ゲスト", "current_level": level, **state.summary()}
+        response = self._get_func(name)(**args)
+        return state.apply_tool_result(name, args, response)
+
     async def _handle_tool_call(
         self, session: Any, tool_call: LiveServerToolCall
     ) -> None:
@@ -120,15 +465,26 @@ class GeminiSession:
         """
         for fc in tool_call.function_calls:
             logging.debug(f"Calling tool function: {fc.name} with args: {fc.args}")
-            response = self._get_func(fc.name)(**fc.args)
-            tool_response = types.LiveClientToolResponse(
-                function_responses=[
-                    types.FunctionResponse(name=fc.name, id=fc.id, response=response)
-                ]
+            started = self.trace.now() if self.trace is not None else 0.0
+            response = self._call_tool(fc.name, fc.args)
+            if self.trace is not None:
+                self.trace.record(TOOL, fc.name, 0, started, self.trace.now(), payload=fc.args)
+            if self.tap is not None:
+                self.tap.publish(TAP_TOOL, {"name": fc.name, "args": fc.args, "response": response})
+            # 結果はモデルに返さないと使われない（出題する問題文や、レベルアップしてよいかの判断）。
+            # Live API の response はオブジェクトなので、それ以外は output に入れる
+            function_response = {
+                "id": fc.id,
+                "name": fc.name,
+                "response": response if isinstance(response, dict) else {"output": response},
+            }
+            message = json.dumps(
+                {"toolResponse": {"functionResponses": [function_response]}}, ensure_ascii=False, default=str
             )
-            logging.debug(f"Tool response: {tool_response}")
-            # なぜかエラー。GETで tool functions 現在はないので、一旦コメントアウト
-            # await session.send(tool_response)
+            logging.debug(f"Tool response: {message}")
+            await session._ws.send(message)
+            if self.meter is not None:
+                self.meter.count_up({}, len(message))
 
     async def receive_from_gemini(self) -> None:
         """Listen for and process messages from Gemini.
@@ -140,73 +496,341 @@ class GeminiSession:
             try:
                 result = await self.session._ws.recv(decode=False)
                 if not result or not self._is_running:
+                    # watch_idle が閉じたときだけ休止扱いにし、モデル側から閉じられたら終わる
+                    if not self.suspended:
+                        await self.stop()
                     break
-                await self.websocket.send_bytes(result)
-                message = types.LiveServerMessage.model_validate(json.loads(result))
-                if message.tool_call:
-                    tool_call = LiveServerToolCall.model_validate(message.tool_call)
+                self._last_activity = time.monotonic()
+                received = self.trace.now() if self.trace is not None else 0.0
+                kind = upstream_kind(result) if self.trace is not None or self.compression is not None else None
+                if self.compression is not None:
+                    await self.websocket.send_bytes(self.compression.encode(result, kind))
+                else:
+                    await self.websocket.send_bytes(result)
+                if self.meter is not None:
+                    self.meter.count_down(result)
+                if self.tap is not None:
+                    self.tap.publish(TAP_MODEL, result)
+                if self.trace is not None:
+                    self.trace.record(
+                        DOWN, kind, len(result), received,
+                        self.trace.now(), payload=result
+                    )
+                # 大半は音声なので、ツール呼び出しを含むメッセージだけを parse する
+                if b'"toolCall"' in result:
+                    tool_call = LiveServerToolCall.model_validate(
+                        json.loads(result)["toolCall"]
+                    )
                     await self._handle_tool_call(self.session, tool_call)
             except Exception as e:
+                if self.suspended:
+                    break
                 logging.error(f"Error receiving from Gemini: {e}")
                 await self.stop()
                 break
 
+    async def relay_from_gemini(self) -> None:
+        """Relay model output, reconnecting whenever a suspended child speaks."""
+        await self.receive_from_gemini()
+        while self._is_running and self.suspended:
+            await self._resume.wait()
+            if not self._is_running:
+                break
+            try:
+                async with self.reconnect() as session:
+                    await self._resume_session(session)
+                    await self.receive_from_gemini()
+            except Exception as e:
+                logging.error(f"Error resuming session for client {self.user_id}: {e}")
+                await self.stop()
 
-def get_connect_and_run_callable(websocket: WebSocket, user_id: str) -> Callable:
-    """Create a callable that handles Gemini connection with retry logic.
+    async def run(self) -> None:
+        """Relay in both directions until the client or the model disconnects."""
+        relays = [self.receive_from_client(), self.relay_from_gemini()]
+        if self.reconnect is not None:
+            relays.append(self.watch_idle())
+        if self.late_user_data is not None:
+            relays.append(self.apply_late_user_data())
+        try:
+            await asyncio.gather(*relays)
+            if self._drained is not None:
+                await self._drained.wait()
+        finally:
+            if self.meter is not None:
+                usage_ledger.close_meter(self.meter)
+            if self.tap is not None:
+                self.tap.close()
+            if self.trace is not None:
+                try:
+                    self.trace.dump()
+                except OSError as e:
+                    logging.error(f"Error writing session trace: {e}")
+
+
+def connect_live(
+    user_id: str,
+    user_data: Optional[Dict],
+    resumed: bool = False,
+    provisional: bool = False,
+    config: Optional[types.LiveConnectConfig] = None,
+) -> Any:
+    """Open a Live API session configured for the child.
 
     Args:
-        websocket: The client websocket connection
+        user_id: The user's ID
+        user_data: The user's data, as returned by get_user_data
+        resumed: Whether the conversation is resuming after a suspension
+        provisional: Whether the user data is still being read
+        config: A config already built for this user and data, e.g. by a prefetch
 
     Returns:
-        Callable: An async function that establishes and manages the Gemini connection
+        An async context manager yielding the Gemini session, opened in the
+        best available region
     """
+    if config is None:
+        config = get_live_connect_config(user_id, user_data, resumed=resumed, provisional=provisional)
+    return live_pool.connect(model=MODEL_ID, config=config, deadline=LIVE_CONNECT_DEADLINE_SECONDS)
 
-    async def on_backoff(details: backoff._typing.Details) -> None:
-        await websocket.send_json({
-            "status": f"Model connection error, retrying in {details['wait']} seconds..."
-        })
-
-    @backoff.on_exception(
-        backoff.expo,
-        ConnectionClosedError,
-        max_tries=1,
-        max_time=30,
-        on_backoff=on_backoff
-    )
-    async def connect_and_run() -> None:
-        config = get_live_connect_config(user_id)
-        async with genai_client.aio.live.connect(
-            model=MODEL_ID, config=config
+
+def _resume_live(learner_state: LearnerState) -> Any:
+    # 再開時は Firestore を読まず、セッション内の学習状況から設定を作る
+    return connect_live(learner_state.user_id, learner_state.to_user_data(), resumed=True)
+
+
+def resume_callable(learner_state: LearnerState) -> Callable[[], Any]:
+    """Return the reconnect callable for a session, without a per-connection closure."""
+    return functools.partial(_resume_live, learner_state)
+
+
+async def _notify_backoff(details: backoff._typing.Details) -> None:
+    websocket = details["args"][0]
+    await websocket.send_json({
+        "status": f"Model connection error, retrying in {details['wait']} seconds..."
+    })
+
+
+@backoff.on_exception(
+    backoff.expo,
+    ConnectionClosedError,
+    max_tries=1,
+    max_time=30,
+    on_backoff=_notify_backoff
+)
+async def connect_and_run(
+    websocket: WebSocket,
+    user_id: str,
+    prefetched: Optional[PrefetchedSession] = None,
+    compression: Optional[CompressionPolicy] = None,
+) -> None:
+    """Establish the Gemini connection and relay until either side disconnects.
+
+    Args:
+        websocket: The client websocket connection
+        user_id: The authenticated user's ID
+        prefetched: User data and config prepared by /session/prefetch, if any
+        compression: The compression policy negotiated with the client, if any
+    """
+    timer = SetupTimer()
+    lease = None
+    learner_state = None
+    config = None
+    try:
+        # 同じユーザーの古いセッションは、上流に接続する前に閉じる
+        lease = await session_registry.register(user_id)
+        timer.phase("lease")
+        if prefetched is not None and prefetched.config is not None:
+            # 先読み済みなら Firestore を読まず、作っておいた設定でそのまま上流に接続する
+            user_data, source, late_user_data = prefetched.user_data, PREFETCHED, None
+            config = prefetched.config
+        else:
+            # 締め切りまでに読めなければ、キャッシュか仮の状態で始めて後から反映する
+            user_data, source, late_user_data = await user_data_loader.load(user_id)
+        timer.phase("user_data", source)
+        learner_state = LearnerState.from_user_data(user_id, user_data)
+        learner_state.provisional = source == MINIMAL
+        if learner_state.resumed:
+            # 停止したインスタンスから引き継いだセッション。スナップショットは1回だけ使う
+            clear_session_snapshot(user_id)
+        async with connect_live(
+            user_id,
+            user_data,
+            resumed=learner_state.resumed,
+            provisional=learner_state.provisional,
+            config=config,
         ) as session:
-            await websocket.send_json({"status": "Backend is ready for conversation"})
+            timer.phase("live_connect")
             gemini_session = GeminiSession(
-                session=session, websocket=websocket, tool_functions=tool_functions
-            )
-            logging.info("Starting bidirectional communication")
-            await asyncio.gather(
-                gemini_session.receive_from_client(),
-                gemini_session.receive_from_gemini(),
+                session=session,
+                websocket=websocket,
+                tool_functions=tool_functions,
+                learner_state=learner_state,
+                reconnect=resume_callable(learner_state),
+                limiter=InboundLimiter(user_id),
+                trace=open_recorder(user_id),
+                meter=usage_ledger.open_meter(user_id),
+                tap=tap_registry.open_tap(user_id),
+                late_user_data=late_user_data,
+                compression=compression,
             )
-
-    return connect_and_run
+            if not session_registry.attach(lease, gemini_session):
+                await gemini_session.takeover()
+                return
+            if drain.draining:
+                # 接続している間にドレインが始まった
+                await gemini_session.drain(drain.reconnect_after())
+                return
+            await websocket.send_json({"status": "Backend is ready for conversation"})
+            timer.phase("ready")
+            logging.info(f"Session of {user_id} ready in {timer.elapsed:.3f}s {timer.phases}")
+            await gemini_session.run()
+    finally:
+        if learner_state is not None and not learner_state.provisional:
+            user_data_loader.remember(user_id, learner_state.to_user_data())
+        if lease is not None:
+            await session_registry.release(lease)
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, id_token: str = None) -> None:
-    """Handle new websocket connections."""
+async def websocket_endpoint(
+    websocket: WebSocket, id_token: str = None, ticket: str = None, compression: str = None
+) -> None:
+    """Handle new websocket connections.
+
+    Authenticates with a ticket from /session/prefetch, or with a Firebase ID
+    token when there is no valid ticket; a client that sent only a ticket
+    that is no longer valid is told to reconnect with its ID token. A client sending
+    ``compression=deflate`` receives some model messages zlib-compressed
+    (see CompressionPolicy).
+    """
     gemini_session = None
     try:
         await websocket.accept()
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token['uid']
-        connect_and_run = get_connect_and_run_callable(websocket, uid)
-        await connect_and_run()
+        if drain.draining:
+            drain_refused.inc(endpoint="ws")
+            await websocket.send_json(reconnect_hint(drain.reconnect_after()))
+            await websocket.close(code=DRAIN_CLOSE_CODE, reason="server restarting")
+            return
+        prefetched = prefetch_tickets.redeem(ticket) if ticket else None
+        if prefetched is not None:
+            uid = prefetched.user_id
+        elif ticket and not id_token:
+            # 認証の手段がほかにないので、ID トークンで接続し直すよう伝えてから閉じる
+            await websocket.send_json({"status": TICKET_REJECTED_STATUS})
+            await websocket.close(code=1008, reason="Invalid or expired ticket")
+            return
+        else:
+            decoded_token = verify_id_token(id_token)
+            uid = decoded_token['uid']
+        await connect_and_run(websocket, uid, prefetched, negotiate(compression))
     finally:
         if gemini_session:
             await gemini_session.stop()
 
 
+async def drain_sessions() -> None:
+    """Stop admitting sessions and hand the open ones off to other instances."""
+    sessions = [lease.session for lease in session_registry.leases.values() if lease.session is not None]
+    await drain.run(sessions, flush_pending_writes)
+
+
+def _authorize_ops(authorization: Optional[str]) -> None:
+    """Allow the operational endpoints only with ``Authorization: Bearer $OPS_TOKEN``.
+
+    Without OPS_TOKEN they do not exist, so nothing about the deployment
+    (regions, call sites, per-user counters) is public by default.
+    """
+    if not OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest((authorization or "").encode(), f"Bearer {OPS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid ops token")
+
+
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(None)) -> PlainTextResponse:
+    """Expose server metrics in the Prometheus text format."""
+    _authorize_ops(authorization)
+    return PlainTextResponse(render_metrics())
+
+
+@app.get("/debug/regions")
+async def debug_regions(authorization: Optional[str] = Header(None)) -> List[Dict[str, Any]]:
+    """Show Live API regions, best first, with their connect latency and failure rate."""
+    _authorize_ops(authorization)
+    return live_pool.snapshot()
+
+
+@app.get("/debug/loop")
+async def debug_loop(authorization: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """Show event loop lag and the call sites that blocked the loop the longest."""
+    _authorize_ops(authorization)
+    return loop_monitor.snapshot()
+
+
+def _verify_bearer(authorization: Optional[str]) -> Dict[str, Any]:
+    """Verify the Firebase ID token of an ``Authorization: Bearer`` header."""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    try:
+        return verify_id_token(authorization.removeprefix("Bearer "))
+    except Exception as e:
+        raise HTTPException(status_code=401, detail="Invalid token") from e
+
+
+@app.post("/session/prefetch")
+async def prefetch_session(authorization: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """Prepare a conversation before the websocket opens.
+
+    Verifies the token, reads the user data and builds the Live API config
+    while the welcome screen is still showing, and returns a ticket for
+    ``/ws?ticket=...`` that is good for PREFETCH_TICKET_TTL_SECONDS. With the
+    ticket, ``/ws`` goes straight to the Live API connect.
+    """
+    if drain.draining:
+        drain_refused.inc(endpoint="prefetch")
+        retry_after = max(1, math.ceil(drain.reconnect_after()))
+        raise HTTPException(status_code=503, detail=DRAIN_STATUS, headers={"Retry-After": str(retry_after)})
+    uid = _verify_bearer(authorization)["uid"]
+    user_data, source, _ = await user_data_loader.load(uid)
+    config = None
+    if source in (FRESH, HEDGED):
+        # 読み取りが締め切りに間に合わなかったときは何も用意せず、/ws で読み直す
+        resumed = LearnerState.from_user_data(uid, user_data).resumed
+        config = get_live_connect_config(uid, user_data, resumed=resumed)
+    return {"ticket": prefetch_tickets.issue(uid, user_data, config), "expires_in": prefetch_tickets.ttl}
+
+
+def _authorize_stats(authorization: Optional[str], user_id: str) -> None:
+    """Allow the child's own token, or a parent/teacher token listing the child in its ``children`` claim."""
+    decoded_token = _verify_bearer(authorization)
+    if decoded_token.get("uid") != user_id and user_id not in (decoded_token.get("children") or []):
+        raise HTTPException(status_code=403, detail="Not allowed to read this user's stats")
+
+
+@app.get("/stats/{user_id}")
+async def user_stats(
+    user_id: str,
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """Per-level accuracy, totals and recently practised questions of a child, for parent and teacher dashboards.
+
+    Served from a server-side cache for STATS_CACHE_TTL_SECONDS, with an ETag;
+    a poll sending the current ETag in If-None-Match gets an empty 304.
+    """
+    _authorize_stats(authorization, user_id)
+    entry, outcome = await stats_cache.get(user_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown user")
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"private, max-age={entry.max_age(stats_cache.clock())}",
+        "X-Stats-Cache": outcome,
+    }
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
 class Feedback(BaseModel):
     """Represents feedback for a conversation."""
 
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Protocol, Set, Tuple
+
+from firebase_admin import firestore
+
+from app.metrics import counter
+
+LEASE_TTL_SECONDS = 30.0
+# 他のインスタンスに乗っ取られたことには、最大でこの間隔で気づく
+LEASE_RENEW_INTERVAL_SECONDS = 10.0
+# 1回のトランザクションで延長するリースの数（Firestore の1トランザクションの書き込み上限は500）
+LEASE_RENEW_BATCH_SIZE = 500
+
+session_takeovers = counter(
+    "session_takeovers_total", "Live sessions closed because the same user connected again"
+)
+
+
+class LeaseBackend(Protocol):
+    """Stores which connection holds the single live session of each user.
+
+    The newest connection always wins: ``acquire`` never fails, and older
+    holders find out when they are missing from what ``renew`` returns.
+    """
+
+    async def acquire(self, user_id: str, holder: str, ttl: float) -> Optional[str]:
+        """Take the lease and return the previous holder if it had not expired."""
+
+    async def renew(self, holders: Dict[str, str], ttl: float) -> Set[str]:
+        """Extend the leases of ``{user_id: holder}``; return the users whose lease is still held."""
+
+    async def release(self, user_id: str, holder: str) -> None:
+        """Give the lease up if ``holder`` still holds it."""
+
+
+class InMemoryLeaseBackend:
+    """Lease backend for a single process, and for tests."""
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self.clock = clock
+        self.leases: Dict[str, Tuple[str, float]] = {}
+
+    async def acquire(self, user_id: str, holder: str, ttl: float) -> Optional[str]:
+        previous = self.leases.get(user_id)
+        self.leases[user_id] = (holder, self.clock() + ttl)
+        if previous and previous[1] > self.clock():
+            return previous[0]
+        return None
+
+    async def renew(self, holders: Dict[str, str], ttl: float) -> Set[str]:
+        renewed = set()
+        for user_id, holder in holders.items():
+            current = self.leases.get(user_id)
+            if current is not None and current[0] == holder:
+                self.leases[user_id] = (holder, self.clock() + ttl)
+                renewed.add(user_id)
+        return renewed
+
+    async def release(self, user_id: str, holder: str) -> None:
+        current = self.leases.get(user_id)
+        if current is not None and current[0] == holder:
+            del self.leases[user_id]
+
+
+class FirestoreLeaseBackend:
+    """Lease backend shared by every instance, in ``sessionLeases/{uid}``.
+
+    The client is synchronous, so each transaction runs in a worker thread
+    instead of blocking the event loop. Renewals read and extend up to
+    ``batch_size`` leases in one transaction.
+    """
+
+    def __init__(self, db: Any, collection: str = "sessionLeases",
+                 clock: Callable[[], float] = time.time,
+                 batch_size: int = LEASE_RENEW_BATCH_SIZE) -> None:
+        self.db = db
+        self.collection = collection
+        self.clock = clock
+        self.batch_size = batch_size
+
+    async def acquire(self, user_id: str, holder: str, ttl: float) -> Optional[str]:
+        return await asyncio.to_thread(self._acquire, user_id, holder, ttl)
+
+    async def renew(self, holders: Dict[str, str], ttl: float) -> Set[str]:
+        renewed: Set[str] = set()
+        user_ids = list(holders)
+        for start in range(0, len(user_ids), self.batch_size):
+            batch = {user_id: holders[user_id] for user_id in user_ids[start:start + self.batch_size]}
+            renewed |= await asyncio.to_thread(self._renew, batch, ttl)
+        return renewed
+
+    async def release(self, user_id: str, holder: str) -> None:
+        await asyncio.to_thread(self._release, user_id, holder)
+
+    def _acquire(self, user_id: str, holder: str, ttl: float) -> Optional[str]:
+        doc_ref = self.db.collection(self.collection).document(user_id)
+        now = self.clock()
+
+        @firestore.transactional
+        def acquire_transaction(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            previous = doc.to_dict() if doc.exists else None
+            transaction.set(doc_ref, {"holder": holder, "expiresAt": now + ttl})
+            if previous and previous.get("expiresAt", 0) > now:
+                return previous.get("holder")
+            return None
+
+        return acquire_transaction(self.db.transaction())
+
+    def _renew(self, holders: Dict[str, str], ttl: float) -> Set[str]:
+        collection = self.db.collection(self.collection)
+        doc_refs = [collection.document(user_id) for user_id in holders]
+
+        @firestore.transactional
+        def renew_transaction(transaction):
+            renewed = set()
+            expires_at = self.clock() + ttl
+            for doc in self.db.get_all(doc_refs, transaction=transaction):
+                if doc.exists and doc.to_dict().get("holder") == holders[doc.id]:
+                    transaction.update(doc.reference, {"expiresAt": expires_at})
+                    renewed.add(doc.id)
+            return renewed
+
+        return renew_transaction(self.db.transaction())
+
+    def _release(self, user_id: str, holder: str) -> None:
+        doc_ref = self.db.collection(self.collection).document(user_id)
+
+        @firestore.transactional
+        def release_transaction(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if doc.exists and doc.to_dict().get("holder") == holder:
+                transaction.delete(doc_ref)
+
+        release_transaction(self.db.transaction())
+
+
+class Lease:
+    """One connection's claim to be the user's active session."""
+
+    __slots__ = ("user_id", "holder", "session", "revoked")
+
+    def __init__(self, user_id: str, holder: str) -> None:
+        self.user_id = user_id
+        self.holder = holder
+        # takeover() を持つ GeminiSession。上流への接続が終わるまでは None
+        self.session: Any = None
+        self.revoked = False
+
+
+class SessionRegistry:
+    """Keeps one active live session per user; the newest connection takes over.
+
+    Sessions on this process are taken over immediately. Sessions on other
+    instances are closed when their next lease renewal fails.
+    """
+
+    def __init__(
+        self,
+        backend: LeaseBackend,
+        instance_id: Optional[str] = None,
+        lease_ttl: float = LEASE_TTL_SECONDS,
+        renew_interval: float = LEASE_RENEW_INTERVAL_SECONDS,
+    ) -> None:
+        self.backend = backend
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self.renew_interval = renew_interval
+        self.leases: Dict[str, Lease] = {}
+        self._renewer: Optional[asyncio.Task] = None
+
+    async def register(self, user_id: str) -> Lease:
+        """Claim the user's session, closing the one it replaces."""
+        lease = Lease(user_id, f"{self.instance_id}/{uuid.uuid4().hex}")
+        previous = self.leases.get(user_id)
+        self.leases[user_id] = lease
+        if previous is not None:
+            session_takeovers.inc(scope="local")
+            await self._revoke(previous)
+        try:
+            remote = await self.backend.acquire(user_id, lease.holder, self.lease_ttl)
+        except BaseException:
+            # 呼び出し側には lease が渡らず release されないので、ここで外す
+            if self.leases.get(user_id) is lease:
+                del self.leases[user_id]
+            if not self.leases:
+                self.close()
+            raise
+        if remote is not None and previous is None:
+            # 数えるのは、閉じられる側のインスタンス
+            logging.info(f"Taking over session of {user_id} from {remote}")
+        if self._renewer is None or self._renewer.done():
+            self._renewer = asyncio.create_task(self._renew_forever())
+        return lease
+
+    def attach(self, lease: Lease, session: Any) -> bool:
+        """Attach the relay to its lease; False if it was taken over while connecting."""
+        if lease.revoked:
+            return False
+        lease.session = session
+        return True
+
+    async def release(self, lease: Lease) -> None:
+        """Give up the lease when the connection ends."""
+        if self.leases.get(lease.user_id) is lease:
+            del self.leases[lease.user_id]
+            await self.backend.release(lease.user_id, lease.holder)
+        if not self.leases:
+            self.close()
+
+    def close(self) -> None:
+        """Stop renewing leases."""
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+
+    async def _revoke(self, lease: Lease) -> None:
+        lease.revoked = True
+        if lease.session is not None:
+            await lease.session.takeover()
+
+    async def renew(self) -> None:
+        """Renew every local lease, closing sessions taken over elsewhere."""
+        leases = list(self.leases.values())
+        if not leases:
+            return
+        try:
+            renewed = await self.backend.renew(
+                {lease.user_id: lease.holder for lease in leases}, self.lease_ttl
+            )
+        except Exception as e:
+            logging.error(f"Error renewing {len(leases)} session leases: {e}")
+            return
+        for lease in leases:
+            if lease.user_id not in renewed and self.leases.get(lease.user_id) is lease:
+                del self.leases[lease.user_id]
+                session_takeovers.inc(scope="remote")
+                await self._revoke(lease)
+
+    async def _renew_forever(self) -> None:
+        while self.leases:
+            await asyncio.sleep(self.renew_interval)
+            await self.renew()
@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.metrics import counter
+
+# 保護者向けの統計をサーバー側で持つ秒数。ダッシュボードのポーリングはこの間 Firestore を読まない
+STATS_CACHE_TTL_SECONDS = float(os.getenv("STATS_CACHE_TTL_SECONDS", "60"))
+STATS_CACHE_SIZE = 10000
+
+stats_cache_lookups = counter("stats_cache_lookups_total", "User stats cache lookups by outcome")
+
+
+class StatsEntry:
+    """A rendered stats response and its ETag."""
+
+    __slots__ = ("body", "etag", "expires")
+
+    def __init__(self, body: bytes, expires: float) -> None:
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.expires = expires
+
+    def max_age(self, now: float) -> int:
+        return max(0, int(self.expires - now))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches ``etag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class StatsCache:
+    """Caches the stats of each user for ``ttl`` seconds.
+
+    The fetch runs on a worker thread, driven by a task the cache owns.
+    Requests for a user whose stats are being fetched wait for that fetch
+    instead of starting another, and a cancelled request (a dashboard that
+    disconnected) stops waiting without cancelling the fetch, so a
+    dashboard fleet polling the same child costs one set of aggregation
+    queries per ``ttl``. The body is serialized once per fetch and its hash
+    is the ETag, so an unchanged result keeps the same ETag across fetches.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Optional[Dict[str, Any]]],
+        ttl: float = STATS_CACHE_TTL_SECONDS,
+        maxsize: int = STATS_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.fetch = fetch
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries: "OrderedDict[str, StatsEntry]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Task[Optional[StatsEntry]]"] = {}
+
+    async def get(self, user_id: str) -> Tuple[Optional[StatsEntry], str]:
+        """Return ``(entry, outcome)``; the entry is None for an unknown user."""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.expires > self.clock():
+            self._entries.move_to_end(user_id)
+            stats_cache_lookups.inc(outcome="hit")
+            return entry, "hit"
+        inflight = self._inflight.get(user_id)
+        if inflight is not None:
+            stats_cache_lookups.inc(outcome="coalesced")
+            return await asyncio.shield(inflight), "coalesced"
+
+        # 取得はどのリクエストのものでもないタスクで行う。最初に来たリクエストが
+        # 切断されて取り消されても、待っている他のリクエストの取得は続く
+        task = asyncio.create_task(self._fetch(user_id))
+        self._inflight[user_id] = task
+        task.add_done_callback(lambda done: self._fetched(user_id, done))
+        entry = await asyncio.shield(task)
+        stats_cache_lookups.inc(outcome="miss")
+        return entry, "miss"
+
+    async def _fetch(self, user_id: str) -> Optional[StatsEntry]:
+        stats = await asyncio.to_thread(self.fetch, user_id)
+        entry = None
+        if stats is not None:
+            body = json.dumps(stats, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+            entry = StatsEntry(body, self.clock() + self.ttl)
+        if self._inflight.get(user_id) is asyncio.current_task():
+            # invalidate された取得の結果は、書き込み前のものかもしれないので覚えない
+            self._store(user_id, entry)
+        return entry
+
+    def _fetched(self, user_id: str, task: "asyncio.Task[Optional[StatsEntry]]") -> None:
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+        if not task.cancelled():
+            # 待っている人がいなくても「例外が取り出されていない」警告を出さない
+            task.exception()
+
+    def _store(self, user_id: str, entry: Optional[StatsEntry]) -> None:
+        if entry is None:
+            # 存在しないユーザーは覚えない（作成直後に取り直せるように）
+            self._entries.pop(user_id, None)
+            return
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        """Forget the user's stats, including a fetch that may have read them before a write."""
+        self._entries.pop(user_id, None)
+        self._inflight.pop(user_id, None)
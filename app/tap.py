@@ -0,0 +1,162 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Union
+
+from app.metrics import counter
+
+# 購読者ごとのキューの長さ。あふれたら古いものから捨てる
+TAP_QUEUE_SIZE = int(os.getenv("SESSION_TAP_QUEUE_SIZE", "256"))
+
+# トピック
+MODEL = "model"  # モデルからのメッセージ（bytes のまま）
+TOOL = "tool"  # ツール呼び出しと結果
+CLOSED = "closed"  # セッションの終了
+
+tap_delivered = counter("session_tap_delivered_total", "Session events handled by tap subscribers")
+tap_dropped = counter("session_tap_dropped_total", "Session events dropped because a tap subscriber fell behind")
+tap_errors = counter("session_tap_errors_total", "Errors raised by tap subscribers")
+
+# (トピック, 内容, 発生時刻)
+TapEvent = Tuple[str, Any, float]
+Handler = Callable[[str, TapEvent], Union[Awaitable[None], None]]
+
+
+class Subscription:
+    """One subscriber's bounded queue of events from one session.
+
+    ``offer`` never waits: when the queue is full the oldest event is
+    dropped and counted. A task of its own feeds the queue to the handler;
+    a plain function handler runs on a worker thread.
+    """
+
+    __slots__ = ("name", "user_id", "handler", "topics", "queue", "dropped", "delivered", "_ready", "_closed", "_task")
+
+    def __init__(
+        self, name: str, user_id: str, handler: Handler, topics: Optional[FrozenSet[str]], maxsize: int
+    ) -> None:
+        self.name = name
+        self.user_id = user_id
+        self.handler = handler
+        self.topics = topics
+        self.queue: Deque[TapEvent] = deque(maxlen=maxsize)
+        self.dropped = 0
+        self.delivered = 0
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.get_running_loop().create_task(self._consume())
+
+    def wants(self, topic: str) -> bool:
+        return self.topics is None or topic in self.topics
+
+    def offer(self, event: TapEvent) -> None:
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+            tap_dropped.inc(subscriber=self.name)
+        self.queue.append(event)
+        self._ready.set()
+
+    def close(self) -> "asyncio.Task[None]":
+        """Stop after the queued events are handled."""
+        self._closed = True
+        self._ready.set()
+        return self._task
+
+    async def _consume(self) -> None:
+        run_in_thread = not inspect.iscoroutinefunction(self.handler)
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.queue:
+                event = self.queue.popleft()
+                try:
+                    if run_in_thread:
+                        await asyncio.to_thread(self.handler, self.user_id, event)
+                    else:
+                        await self.handler(self.user_id, event)
+                except Exception as e:
+                    tap_errors.inc(subscriber=self.name)
+                    logging.error(f"Tap subscriber {self.name} failed on {event[0]}: {e}")
+                else:
+                    self.delivered += 1
+                    tap_delivered.inc(subscriber=self.name)
+            if self._closed:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {"subscriber": self.name, "queued": len(self.queue), "delivered": self.delivered, "dropped": self.dropped}
+
+
+class SessionTap:
+    """Publishes a session's events to subscribers without ever waiting on them.
+
+    ``publish`` only appends to each subscriber's queue, so the relay costs
+    the same whether subscribers are fast, slow or stuck.
+    """
+
+    __slots__ = ("subscriptions",)
+
+    def __init__(self, subscriptions: List[Subscription]) -> None:
+        self.subscriptions = subscriptions
+
+    def publish(self, topic: str, payload: Any) -> None:
+        event = (topic, payload, time.time())
+        for subscription in self.subscriptions:
+            if subscription.wants(topic):
+                subscription.offer(event)
+
+    def close(self) -> None:
+        """Publish the end of the session; subscribers finish in the background."""
+        self.publish(CLOSED, None)
+        for subscription in self.subscriptions:
+            task = subscription.close()
+            _draining.add(task)
+            task.add_done_callback(_draining.discard)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [subscription.stats() for subscription in self.subscriptions]
+
+
+# 終了したセッションの購読者のタスク（GC で消えないように参照を持つ）
+_draining: Set["asyncio.Task[None]"] = set()
+
+
+class TapRegistry:
+    """The subscribers every new session is tapped for."""
+
+    def __init__(self, maxsize: int = TAP_QUEUE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._subscribers: Dict[str, Tuple[Handler, Optional[FrozenSet[str]], int]] = {}
+
+    def subscribe(
+        self, name: str, handler: Handler, topics: Optional[Iterable[str]] = None, maxsize: Optional[int] = None
+    ) -> None:
+        """Register a subscriber for sessions started from now on.
+
+        Args:
+            name: Names the subscriber in metrics and logs
+            handler: Called with (user_id, (topic, payload, timestamp)) for
+                each event; a coroutine function runs on the event loop and
+                anything else on a worker thread
+            topics: The topics to receive; all topics when omitted
+            maxsize: Events queued per session before the oldest are dropped
+        """
+        self._subscribers[name] = (handler, None if topics is None else frozenset(topics), maxsize or self.maxsize)
+
+    def unsubscribe(self, name: str) -> None:
+        self._subscribers.pop(name, None)
+
+    def open_tap(self, user_id: str) -> Optional[SessionTap]:
+        """Tap a new session; None when nobody subscribes."""
+        if not self._subscribers:
+            return None
+        return SessionTap([
+            Subscription(name, user_id, handler, topics, maxsize)
+            for name, (handler, topics, maxsize) in self._subscribers.items()
+        ])
+
+
+tap_registry = TapRegistry()
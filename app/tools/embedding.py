@@ -1,21 +1,33 @@
 from typing import Dict
-from app.config import LOCATION, PROJECT_ID
-from app.vector_store import get_vector_store
+from app.config import DOCS_PATHS, DOCS_URLS, LOCATION, PROJECT_ID
+from app.embedding_cache import CachedEmbeddings, EmbeddingBatcher
+from app.lexical_index import HybridRetriever, index_path_for, load_or_build_index
+from app.vector_store import PERSIST_PATH, get_vector_store
 from app.templates import FORMAT_DOCS
 from langchain_google_vertexai import VertexAIEmbeddings
 
 EMBEDDING_MODEL = "text-embedding-004"
-URLS = [
-    "https://cloud.google.com/architecture/deploy-operate-generative-ai-applications"
-]
 # Initialize vector store and retriever
-embedding = VertexAIEmbeddings(
+vertex_embedding = VertexAIEmbeddings(
     model_name=EMBEDDING_MODEL,
     project=PROJECT_ID,  # プロジェクトIDを指定
     location=LOCATION    # ロケーションを指定
 )
-vector_store = get_vector_store(embedding=embedding, urls=URLS)
-retriever = vector_store.as_retriever()
+# 同じような質問が繰り返されるので、クエリの埋め込みはキャッシュし、
+# 複数セッションからの同時リクエストは1回のバッチ呼び出しにまとめる
+embedding = CachedEmbeddings(
+    vertex_embedding,
+    batcher=EmbeddingBatcher(vertex_embedding),
+    namespace=EMBEDDING_MODEL,
+)
+vector_store = get_vector_store(
+    embedding=embedding, urls=DOCS_URLS, paths=DOCS_PATHS, refresh=bool(DOCS_PATHS)
+)
+# 短い式や数字の質問に強いように、n-gram 索引で候補を絞ってからベクトルで並べ替える
+retriever = HybridRetriever(
+    vector_store=vector_store,
+    index=load_or_build_index(vector_store, index_path_for(PERSIST_PATH)),
+)
 
 def retrieve_docs(query: str) -> Dict[str, str]:
     """
@@ -31,3 +43,8 @@ def retrieve_docs(query: str) -> Dict[str, str]:
     docs = retriever.invoke(query)
     formatted_docs = FORMAT_DOCS.format(docs=docs)
     return {"output": formatted_docs}
+
+
+def get_embedding_stats() -> Dict[str, float]:
+    """Return the query embedding cache hit rate and embed call counts."""
+    return embedding.stats()
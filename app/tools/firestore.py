@@ -1,19 +1,175 @@
 import asyncio
-from typing import Dict
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Coroutine, Dict, Iterable, List, Optional, Set, Tuple
 import os
 import firebase_admin
 from firebase_admin import credentials, firestore
-
-# Firebase Admin SDKの初期化
-if os.getenv('K_SERVICE'):
-    # Cloud Run 環境では、デフォルトの認証情報を使用
-    firebase_admin.initialize_app()
-else:
+from google.api_core.exceptions import NotFound
+
+from app.clients import LazyClient
+from app.question_bank import QuestionBank, question_fingerprint
+from app.user_cache import open_user_cache
+
+def _initialize_firebase() -> firebase_admin.App:
+    # fork する前の親プロセスで初期化されていたら、そのクライアントは使わずに作り直す
+    try:
+        firebase_admin.delete_app(firebase_admin.get_app())
+    except ValueError:
+        pass
+    # Firebase Admin SDKの初期化
+    if os.getenv('K_SERVICE'):
+        # Cloud Run 環境では、デフォルトの認証情報を使用
+        return firebase_admin.initialize_app()
     # ローカル開発環境では、credentials.json を使用
     cred = credentials.Certificate('firebase-credentials.json')
-    firebase_admin.initialize_app(cred)
+    return firebase_admin.initialize_app(cred)
+
+# Firebase と Firestore のクライアントは、ワーカープロセスごとに最初に使うときに作る
+firebase_app = LazyClient(_initialize_firebase, "Firebase")
+db = LazyClient(lambda: firestore.client(firebase_app.instance()), "Firestore")
+
+# 同じホストのワーカーで共有する get_user_data のキャッシュ（USER_CACHE_PATH を設定したときだけ）。
+# 書き込みのツールが書き込んだあとに無効化する
+user_cache = open_user_cache()
+
+# ユーザーごとの問題の指紋インデックス（指紋 -> 問題ID）のキャッシュ。
+# users/{uid}.questionIndex に永続化し、同じ問題の重複書き込みを防ぐ
+QUESTION_INDEX_CACHE_SIZE = 1000
+_question_indexes: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+# ユーザーごとの問題バンクの進み具合（レベル -> 出題済みの数）のキャッシュ。users/{uid}.bankCursor に永続化する
+_bank_cursors: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+# get_user_data はワーカースレッドで（ヘッジすると2本同時に）動き、ツールはイベントループで動くので、
+# 2つのキャッシュの読み書きはこのロックの中で行う
+_user_indexes_lock = threading.Lock()
+
+# 事前に生成した問題バンク。子供ごとに保存するのは問題IDと結果だけになる
+question_bank = QuestionBank.load()
+
+# ユーザーのデータを書き換えたあとに呼ぶ関数（サーバーはここで /stats のキャッシュを消す）
+_write_listeners: List[Callable[[str], None]] = []
+
+# ユーザーごとの書き込み中のタスク。参照を持っておかないと GC で消えることがあり、
+# セッションを閉じる前に flush_pending_writes で待てるようにする
+_pending_writes: Dict[str, Set[asyncio.Task]] = {}
+
+# 保護者向けの統計で「最近」とみなす日数
+RECENT_STATS_DAYS = 7
+# ドレインで保存したセッションのスナップショットを、続きとして使う期間（秒）
+SESSION_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SESSION_SNAPSHOT_MAX_AGE_SECONDS", "300"))
+
+def _schedule_write(user_id: str, write: Coroutine) -> asyncio.Task:
+    tasks = _pending_writes.setdefault(user_id, set())
+    task = asyncio.create_task(write)
+    tasks.add(task)
+
+    def done(finished: asyncio.Task) -> None:
+        tasks.discard(finished)
+        if not tasks and _pending_writes.get(user_id) is tasks:
+            del _pending_writes[user_id]
+    task.add_done_callback(done)
+    return task
+
+async def flush_pending_writes(user_id: Optional[str] = None) -> None:
+    """
+    書き込み中のタスクが終わるまで待ちます。
+
+    Args:
+        user_id: ユーザーの識別子。省略した場合はすべてのユーザー
+    """
+    if user_id is None:
+        tasks = [task for user_tasks in _pending_writes.values() for task in user_tasks]
+    else:
+        tasks = list(_pending_writes.get(user_id, ()))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def _merge_question_index(cached: Dict[str, str], read: Dict[str, str]) -> None:
+    # キャッシュにある指紋は、まだ書き込んでいない問題のものかもしれないので、そちらを使う
+    for fingerprint, question_id in read.items():
+        cached.setdefault(fingerprint, question_id)
+
+def _merge_bank_cursors(cached: Dict[str, int], read: Dict[str, int]) -> None:
+    # 書き込み中の出題があれば、キャッシュのほうが進んでいる
+    for level, seen in read.items():
+        cached[level] = max(cached.get(level, 0), seen)
+
+def _remember(cache: OrderedDict, user_id: str, value: Dict, merge: Callable[[Dict, Dict], None]) -> Dict:
+    """読んだ値をキャッシュに足し込み、キャッシュにある（呼び出し側と共有する）辞書を返します。"""
+    with _user_indexes_lock:
+        cached = cache.get(user_id)
+        if cached is None:
+            cached = cache[user_id] = dict(value)
+        else:
+            merge(cached, value)
+        cache.move_to_end(user_id)
+        while len(cache) > QUESTION_INDEX_CACHE_SIZE:
+            cache.popitem(last=False)
+        return cached
+
+def _cache_question_index(user_id: str, index: Dict[str, str]) -> Dict[str, str]:
+    return _remember(_question_indexes, user_id, index, _merge_question_index)
+
+def _cache_bank_cursors(user_id: str, cursors: Dict[str, int]) -> Dict[str, int]:
+    return _remember(_bank_cursors, user_id, cursors, _merge_bank_cursors)
+
+def _cached(cache: OrderedDict, user_id: str) -> Optional[Dict]:
+    with _user_indexes_lock:
+        value = cache.get(user_id)
+        if value is not None:
+            cache.move_to_end(user_id)
+        return value
+
+def _load_user_indexes(user_id: str) -> Tuple[Dict[str, str], Dict[str, int]]:
+    # 指紋インデックスと問題バンクの進み具合は同じユーザードキュメントにあるので、1回の読み取りで両方持つ
+    user_doc = db.collection('users').document(user_id).get()
+    user_data = user_doc.to_dict() if user_doc.exists else {}
+    return (
+        _cache_question_index(user_id, user_data.get('questionIndex', {})),
+        _cache_bank_cursors(user_id, user_data.get('bankCursor', {})),
+    )
+
+def _get_question_index(user_id: str) -> Dict[str, str]:
+    index = _cached(_question_indexes, user_id)
+    return index if index is not None else _load_user_indexes(user_id)[0]
+
+def _get_bank_cursors(user_id: str) -> Dict[str, int]:
+    cursors = _cached(_bank_cursors, user_id)
+    return cursors if cursors is not None else _load_user_indexes(user_id)[1]
+
+def add_write_listener(listener: Callable[[str], None]) -> None:
+    """
+    ユーザーのデータを書き換えるたびに呼ぶ関数を登録します。
+
+    Args:
+        listener: 書き換えたユーザーの識別子を受け取る関数
+    """
+    _write_listeners.append(listener)
 
-db = firestore.client()
+def _invalidate_cached_user(user_id: str) -> None:
+    if user_cache is not None:
+        user_cache.invalidate(user_id)
+    for listener in _write_listeners:
+        listener(user_id)
+
+def forget_questions(user_id: str, question_ids: Iterable[str]) -> None:
+    """
+    集約して削除された問題を、指紋インデックスのキャッシュと共有のユーザーキャッシュから外します。
+    同じ計算式の問題が来たら、削除された問題IDを使い回さずに新しく作るようになります。
+
+    Args:
+        user_id: ユーザーの識別子
+        question_ids: 削除された問題のID
+    """
+    removed = set(question_ids)
+    with _user_indexes_lock:
+        index = _question_indexes.get(user_id)
+        if index is not None:
+            for fingerprint in [fingerprint for fingerprint, question_id in index.items() if question_id in removed]:
+                del index[fingerprint]
+    _invalidate_cached_user(user_id)
 
 def get_user_data(user_id: str) -> Dict[str, any]:
     """
@@ -25,48 +181,88 @@ def get_user_data(user_id: str) -> Dict[str, any]:
     Returns:
         Dict with user's name and current level information and math questions
     """
-    # ユーザー情報と問題を一度のクエリで取得
+    if user_cache is None:
+        return _read_user_data(user_id)
+    hit, cached, generation = user_cache.lookup(user_id)
+    if hit:
+        _cache_question_index(user_id, cached["questionIndex"])
+        _cache_bank_cursors(user_id, cached.get("bankCursor", {}))
+        return cached["userData"]
+    user_data = _read_user_data(user_id)
+    # イベントループのツールが書き換えている最中でも壊れないよう、コピーを保存する
+    with _user_indexes_lock:
+        question_index = dict(_question_indexes.get(user_id, {}))
+        bank_cursors = dict(_bank_cursors.get(user_id, {}))
+    user_cache.store(user_id, {
+        "userData": user_data,
+        "questionIndex": question_index,
+        "bankCursor": bank_cursors,
+    }, generation)
+    return user_data
+
+def _read_user_data(user_id: str) -> Dict[str, any]:
+    # 読み取りだけなのでトランザクションは使わない（開始とコミットの往復を省く）
     user_ref = db.collection('users').document(user_id)
     questions_ref = user_ref.collection('mathQuestions')
 
-    # トランザクションで一括取得
-    @firestore.transactional
-    def get_user_data_transaction(transaction):
-        user_doc = user_ref.get(transaction=transaction)
-
-        if not user_doc.exists:
-            return None
-
-        user_data = user_doc.to_dict()
-        current_level = user_data.get('current_level', 1)
-
-        # 現在のレベルの問題を取得
-        questions = []
-        # 現在のレベルと1つ前のレベルの問題を取得
-        current_level_docs = questions_ref.where('level', '==', current_level).limit(1).get(transaction=transaction)
-        previous_level_docs = questions_ref.where('level', '==', max(1, current_level - 1)).limit(1).get(transaction=transaction)
-        question_docs = list(current_level_docs) + list(previous_level_docs)
-        for doc in question_docs:
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        # 新しいユーザーには問題がないので、指紋インデックスを読みに行かなくてよい
+        _cache_question_index(user_id, {})
+        _cache_bank_cursors(user_id, {})
+        return None
+
+    user_data = user_doc.to_dict()
+    current_level = user_data.get('current_level', 1)
+    _cache_question_index(user_id, user_data.get('questionIndex', {}))
+    _cache_bank_cursors(user_id, user_data.get('bankCursor', {}))
+
+    # 現在のレベルと1つ前のレベルの問題を取得（レベル1では同じクエリになるので1回だけ）
+    questions = []
+    levels = [current_level] if current_level <= 1 else [current_level, current_level - 1]
+    for level in levels:
+        docs = questions_ref.where('level', '==', level).limit(1).get()
+        for doc in docs:
             question_data = doc.to_dict()
             question_data['id'] = doc.id
+            bank_item = question_bank.get(doc.id)
+            if bank_item is not None and 'formula' not in question_data:
+                # 問題バンクの問題は結果だけを保存しているので、式はバンクから補う
+                question_data['formula'] = bank_item['formula']
             # Remove timestamp fields
-            if 'createdAt' in question_data:
-                del question_data['createdAt']
-            if 'updatedAt' in question_data:
-                del question_data['updatedAt']
+            question_data.pop('createdAt', None)
+            question_data.pop('updatedAt', None)
             questions.append(question_data)
+        if not docs and level in user_data.get('compactedLevels', []):
+            # 古い問題は levelStats に集約されているので、代表的な式を使う
+            questions.extend(_compacted_questions(user_ref, level))
 
-        return {
-            "name": user_data.get("name", "ゲスト"),
-            "current_level": current_level,
-            "questions": questions
-        }
-
-    # トランザクションを実行
-    transaction = db.transaction()
-    result = get_user_data_transaction(transaction)
+    result = {
+        "name": user_data.get("name", "ゲスト"),
+        "current_level": current_level,
+        "questions": questions
+    }
+    snapshot = user_data.get('sessionSnapshot')
+    if snapshot and time.time() - snapshot.get('savedAt', 0) <= SESSION_SNAPSHOT_MAX_AGE_SECONDS:
+        # インスタンスの停止で切れたセッションの続き
+        result["session"] = {key: value for key, value in snapshot.items() if key != 'savedAt'}
     return result
 
+def _compacted_questions(user_ref, level: int) -> List[Dict[str, any]]:
+    stats_doc = user_ref.collection('levelStats').document(str(level)).get()
+    if not stats_doc.exists:
+        return []
+    return [
+        {
+            'level': level,
+            'formula': entry['formula'],
+            'correctCount': entry.get('correct', 0),
+            'wrongCount': entry.get('wrong', 0),
+            'compacted': True,
+        }
+        for entry in (stats_doc.to_dict().get('formulas') or [])[:1]
+    ]
+
 def set_user_name(user_id: str, name: str) -> Dict[str, str]:
     """
     ユーザーの名前とレベルを設定保存します。
@@ -83,15 +279,16 @@ def set_user_name(user_id: str, name: str) -> Dict[str, str]:
         'name': name,
         'current_level': 1,
     }, merge=True)
+    _invalidate_cached_user(user_id)
 
     return {
         "name": name,
         "current_level": 1,
     }
 
-def add_math_question(user_id: str, question_text: str, formula: str, answer: str, level: int) -> bool:
+def add_math_question(user_id: str, question_text: str, formula: str, answer: str, level: int) -> Dict[str, str]:
     """
-    新しい問題を追加します。
+    新しい問題を追加します。同じレベルで同じ計算式の問題がすでにある場合は、その問題を使います。
 
     Args:
         user_id: ユーザーの識別子
@@ -101,12 +298,22 @@ def add_math_question(user_id: str, question_text: str, formula: str, answer: st
         level: 問題のレベル
 
     Returns:
-        text: 何も返しません。
+        Dict with the question_id to use when recording the answer
     """
+    fingerprint = question_fingerprint(formula, level)
+    question_index = _get_question_index(user_id)
+    user_ref = db.collection('users').document(user_id)
+    # ドキュメントIDはクライアント側で採番されるので、書き込みを待たずに返せる
+    doc_ref = user_ref.collection('mathQuestions').document()
+    with _user_indexes_lock:
+        if fingerprint in question_index:
+            return {"question_id": question_index[fingerprint]}
+        question_index[fingerprint] = doc_ref.id
+
     async def add_question():
-        # 新しい問題のドキュメントを作成
-        doc_ref = db.collection('users').document(user_id).collection('mathQuestions').document()
-        data = {
+        # 問題と指紋インデックスを1回のコミットで書き込む
+        batch = db.batch()
+        batch.set(doc_ref, {
             'questionText': question_text,
             'answer': answer,
             'level': level,
@@ -115,10 +322,44 @@ def add_math_question(user_id: str, question_text: str, formula: str, answer: st
             'wrongCount': 0,
             'createdAt': firestore.SERVER_TIMESTAMP,
             'updatedAt': firestore.SERVER_TIMESTAMP,
-        }
-        doc_ref.set(data)
-    asyncio.create_task(add_question())
-    return
+        })
+        batch.set(user_ref, {'questionIndex': {fingerprint: doc_ref.id}}, merge=True)
+        batch.commit()
+        _invalidate_cached_user(user_id)
+    _schedule_write(user_id, add_question())
+    return {"question_id": doc_ref.id}
+
+def get_next_question(user_id: str, level: int) -> Dict[str, str]:
+    """
+    問題バンクから、子供がまだ解いていない今のレベルの問題を取得します。
+
+    Args:
+        user_id: ユーザーの識別子
+        level: 問題のレベル
+
+    Returns:
+        Dict with the question_id to use when recording the answer, the question text, formula and answer
+    """
+    cursors = _get_bank_cursors(user_id)
+    key = str(level)
+    with _user_indexes_lock:
+        seen = cursors.get(key, 0)
+        cursors[key] = seen + 1
+    item = question_bank.nth_for(user_id, level, seen)
+
+    async def record_question():
+        # 問題文や式は保存せず、レベルと結果の入れ物と、どこまで出題したかだけを書く
+        user_ref = db.collection('users').document(user_id)
+        question = {'level': item['level'], 'updatedAt': firestore.SERVER_TIMESTAMP}
+        if seen < question_bank.level_size(level):
+            question.update({'correctCount': 0, 'wrongCount': 0, 'createdAt': firestore.SERVER_TIMESTAMP})
+        batch = db.batch()
+        batch.set(user_ref.collection('mathQuestions').document(item['question_id']), question, merge=True)
+        batch.set(user_ref, {'bankCursor': {key: seen + 1}}, merge=True)
+        batch.commit()
+        _invalidate_cached_user(user_id)
+    _schedule_write(user_id, record_question())
+    return item
 
 def upsert_math_question_result(user_id: str, question_id: str, is_correct: bool):
     """
@@ -132,22 +373,21 @@ def upsert_math_question_result(user_id: str, question_id: str, is_correct: bool
     Returns:
         void: 何も返しません。
     """
-    # 非同期で更新を実行し、レスポンスは先に返す
+    # 読み込まずに Increment で1回の書き込みにし、レスポンスは先に返す
     async def update_question():
         doc_ref = db.collection('users').document(user_id).collection('mathQuestions').document(question_id)
-        doc = doc_ref.get()
-        if not doc.exists:
+        try:
+            doc_ref.update({
+                'correctCount' if is_correct else 'wrongCount': firestore.Increment(1),
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        except NotFound:
+            # 別のプロセスの集約ジョブが消した問題。次は同じ式でも新しい問題を作る
+            forget_questions(user_id, [question_id])
             return
-        data = doc.to_dict()
-        if is_correct:
-            data['correctCount'] = data.get('correctCount', 0) + 1
-        else:
-            data['wrongCount'] = data.get('wrongCount', 0) + 1
-        data['updatedAt'] = firestore.SERVER_TIMESTAMP
+        _invalidate_cached_user(user_id)
 
-        doc_ref.update(data)
-
-    asyncio.create_task(update_question())
+    _schedule_write(user_id, update_question())
     return
 
 
@@ -183,6 +423,76 @@ def get_math_question_stats(user_id: str, question_id: str) -> Dict[str, any]:
         'wrongCount': data.get('wrongCount', 0),
     }
 
+def _answer_stats(query) -> Dict[str, any]:
+    # 問題ドキュメントを読まずに、件数と回答数の合計を1回の集計クエリで取る
+    result = query.count(alias='questions').sum('correctCount', alias='correct').sum('wrongCount', alias='wrong').get()
+    values = {aggregation.alias: aggregation.value for aggregation in result[0]}
+    return _with_accuracy({
+        'questions': int(values.get('questions') or 0),
+        'correct': int(values.get('correct') or 0),
+        'wrong': int(values.get('wrong') or 0),
+    })
+
+def _with_accuracy(stats: Dict[str, any]) -> Dict[str, any]:
+    answers = stats['correct'] + stats['wrong']
+    stats['accuracy'] = stats['correct'] / answers if answers else None
+    return stats
+
+def get_user_stats(user_id: str, recent_days: int = RECENT_STATS_DAYS) -> Optional[Dict[str, any]]:
+    """
+    保護者・先生向けに、レベルごとの正答率と合計、最近取り組んだ問題を集計します。
+
+    問題ドキュメントは読まず、レベルごとの集計クエリと、
+    compact_questions が集約した levelStats だけを読みます。
+
+    Args:
+        user_id: ユーザーの識別子
+        recent_days: 最近とみなす日数
+
+    Returns:
+        Dict with per-level and total statistics, and the questions practised in the last
+        ``recent_days`` with their all-time answer counts, or None for an unknown user
+    """
+    user_ref = db.collection('users').document(user_id)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        return None
+    user_data = user_doc.to_dict()
+    current_level = user_data.get('current_level', 1)
+    questions_ref = user_ref.collection('mathQuestions')
+
+    levels = {
+        level: _answer_stats(questions_ref.where('level', '==', level))
+        for level in range(1, current_level + 1)
+    }
+    compacted_levels = user_data.get('compactedLevels') or []
+    if compacted_levels:
+        stats_refs = [user_ref.collection('levelStats').document(str(level)) for level in compacted_levels]
+        for stats_doc in db.get_all(stats_refs):
+            if not stats_doc.exists:
+                continue
+            compacted = stats_doc.to_dict()
+            level_stats = levels.setdefault(int(stats_doc.id), {'questions': 0, 'correct': 0, 'wrong': 0})
+            for key in ('questions', 'correct', 'wrong'):
+                level_stats[key] += compacted.get(key, 0)
+            _with_accuracy(level_stats)
+
+    totals = _with_accuracy({
+        key: sum(level_stats[key] for level_stats in levels.values()) for key in ('questions', 'correct', 'wrong')
+    })
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=recent_days)
+    # 最近取り組んだ問題の数。回答数はその問題のこれまでの合計で、期間内の回答数ではない
+    recently_practised = _answer_stats(questions_ref.where('updatedAt', '>=', since))
+    recently_practised['days'] = recent_days
+
+    return {
+        'name': user_data.get('name', 'ゲスト'),
+        'current_level': current_level,
+        'levels': [dict(level_stats, level=level) for level, level_stats in sorted(levels.items())],
+        'totals': totals,
+        'recently_practised': recently_practised,
+    }
+
 def increment_user_level(user_id: str) -> Dict[str, any]:
     """
     ユーザーのレベルアップを保存
@@ -203,6 +513,7 @@ def increment_user_level(user_id: str) -> Dict[str, any]:
             "current_level": 2,
         }
         doc_ref.set(data)
+        _invalidate_cached_user(user_id)
         return data
 
     user_data = doc.to_dict()
@@ -212,8 +523,45 @@ def increment_user_level(user_id: str) -> Dict[str, any]:
         "current_level": new_level
     }
     doc_ref.update(update_data)
+    _invalidate_cached_user(user_id)
 
     return {
         "name": user_data.get("name", "ゲスト"),
         "current_level": new_level,
     }
+
+def save_user_level(user_id: str, level: int) -> None:
+    """
+    セッション内で計算したレベルを、読み込みなしの1回の書き込みで保存します。
+
+    Args:
+        user_id: ユーザーの識別子
+        level: 新しいレベル
+    """
+    db.collection('users').document(user_id).set({'current_level': level}, merge=True)
+    _invalidate_cached_user(user_id)
+
+def save_session_snapshot(user_id: str, snapshot: Dict[str, int]) -> None:
+    """
+    インスタンスの停止で切るセッションの学習状況を、次のセッションが続きから始められるように保存します。
+
+    Args:
+        user_id: ユーザーの識別子
+        snapshot: LearnerState.snapshot() の結果
+    """
+    db.collection('users').document(user_id).set(
+        {'sessionSnapshot': {**snapshot, 'savedAt': time.time()}}, merge=True
+    )
+    _invalidate_cached_user(user_id)
+
+def clear_session_snapshot(user_id: str) -> None:
+    """
+    続きとして使ったスナップショットを消します。書き込みは待たずに返ります。
+
+    Args:
+        user_id: ユーザーの識別子
+    """
+    async def clear():
+        db.collection('users').document(user_id).update({'sessionSnapshot': firestore.DELETE_FIELD})
+        _invalidate_cached_user(user_id)
+    _schedule_write(user_id, clear())
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+# 指定したときだけ、セッションごとのフレームの記録をこのディレクトリに書き出す
+TRACE_DIR = os.getenv("SESSION_TRACE_DIR", "")
+# セッションごとに保持する最新のフレーム数
+TRACE_MAX_FRAMES = int(os.getenv("SESSION_TRACE_FRAMES", "5000"))
+# 中身（音声など）も保存するか。既定では大きさと種類だけ
+TRACE_PAYLOADS = os.getenv("SESSION_TRACE_PAYLOADS", "") == "1"
+
+# Directions: "up" is client -> model, "down" is model -> client, "tool" is a tool call
+UP = "up"
+DOWN = "down"
+TOOL = "tool"
+
+
+def upstream_kind(message: bytes) -> str:
+    """Classify a Live API server message without parsing it."""
+    if b'"toolCall"' in message:
+        return "toolCall"
+    if b'"turnComplete"' in message:
+        return "turnComplete"
+    if b'"interrupted"' in message:
+        return "interrupted"
+    if b'"inlineData"' in message:
+        return "audio"
+    if b'"setupComplete"' in message:
+        return "setupComplete"
+    if b'"text"' in message:
+        return "text"
+    return "other"
+
+
+class TraceRecorder:
+    """Bounded ring buffer of frame metadata for one session.
+
+    Each frame is kept as a compact dict: ``t`` (ms since the session
+    started), ``d`` (direction), ``k`` (kind), ``n`` (size in bytes) and
+    ``w`` (ms the relay held it, or the tool call's duration). Frames that
+    were not forwarded have ``x`` ("dropped" or "buffered") instead of ``w``,
+    and payloads, when kept, are in ``p``.
+    """
+
+    __slots__ = (
+        "session_id", "directory", "keep_payloads", "frames", "evicted", "started", "started_at", "clock"
+    )
+
+    def __init__(
+        self,
+        session_id: str,
+        directory: str = TRACE_DIR,
+        max_frames: int = TRACE_MAX_FRAMES,
+        keep_payloads: bool = TRACE_PAYLOADS,
+        clock: Any = time.monotonic,
+    ) -> None:
+        self.session_id = session_id
+        self.directory = directory
+        self.keep_payloads = keep_payloads
+        self.frames: Deque[Dict[str, Any]] = deque(maxlen=max_frames)
+        self.evicted = 0
+        self.clock = clock
+        self.started = clock()
+        self.started_at = time.time()
+
+    def now(self) -> float:
+        return self.clock()
+
+    def record(
+        self,
+        direction: str,
+        kind: str,
+        size: int,
+        received: float,
+        forwarded: Optional[float] = None,
+        payload: Any = None,
+        **extra: Any,
+    ) -> None:
+        """Record a frame received at ``received`` and forwarded at ``forwarded``."""
+        if len(self.frames) == self.frames.maxlen:
+            self.evicted += 1
+        frame: Dict[str, Any] = {
+            "t": round((received - self.started) * 1000, 2),
+            "d": direction,
+            "k": kind,
+            "n": size,
+        }
+        if forwarded is not None:
+            frame["w"] = round((forwarded - received) * 1000, 3)
+        if self.keep_payloads and payload is not None:
+            frame["p"] = payload.decode() if isinstance(payload, bytes) else payload
+        frame.update(extra)
+        self.frames.append(frame)
+
+    def lines(self) -> Iterator[str]:
+        header = {
+            "session": self.session_id,
+            "started_at": self.started_at,
+            "frames": len(self.frames),
+            "evicted": self.evicted,
+            "payloads": self.keep_payloads,
+        }
+        yield json.dumps(header, separators=(",", ":"))
+        for frame in self.frames:
+            yield json.dumps(frame, separators=(",", ":"), ensure_ascii=False)
+
+    def dump(self) -> str:
+        """Write the trace as JSONL (a header line, then one frame per line)."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"{self.session_id}-{time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.started_at))}.jsonl"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            for line in self.lines():
+                f.write(line + "\n")
+        logging.info(f"Wrote session trace to {path}")
+        return path
+
+
+def open_recorder(session_id: str) -> Optional[TraceRecorder]:
+    """Return a recorder if tracing is enabled with SESSION_TRACE_DIR."""
+    return TraceRecorder(session_id, directory=TRACE_DIR) if TRACE_DIR else None
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    """Read a trace written by ``TraceRecorder.dump``: the header, then the frames."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.metrics import counter
+
+# 同じホストのワーカーで共有するキャッシュ（SQLite の WAL モード）。空にすると使わない
+USER_CACHE_PATH = os.getenv("USER_CACHE_PATH", "")
+# 別のホストで書き込まれた変更は届かないので、長くは持たない
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+# 他のワーカーが書き込み中のときに待つ時間（ミリ秒）
+BUSY_TIMEOUT_MS = 1000
+
+user_cache_lookups = counter("user_cache_lookups_total", "Shared user cache lookups by outcome")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    data TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+class UserCache:
+    """The user data of ``get_user_data``, shared by the worker processes of a host.
+
+    Entries live in one SQLite database in WAL mode, so readers in any
+    process never block on a writer. Every write tool bumps the user's
+    generation and clears the entry; a read that started before the write
+    stores its result only if the generation it saw is still current, so
+    a stale read never lands after an invalidation.
+    """
+
+    def __init__(self, path: str = USER_CACHE_PATH, ttl: float = USER_CACHE_TTL_SECONDS) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        # ツールはワーカースレッドからも呼ばれるので、接続はスレッドごとに持つ
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, user_id: str) -> Tuple[bool, Any, int]:
+        """Return ``(hit, value, generation)``; pass the generation to ``store``."""
+        try:
+            row = self._connection().execute(
+                "SELECT generation, data, updated FROM users WHERE uid = ?", (user_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"User cache lookup failed: {e}")
+            user_cache_lookups.inc(outcome="error")
+            return False, None, -1
+        if row is None:
+            user_cache_lookups.inc(outcome="miss")
+            return False, None, 0
+        generation, data, updated = row
+        if data is None or time.time() - updated > self.ttl:
+            user_cache_lookups.inc(outcome="miss")
+            return False, None, generation
+        user_cache_lookups.inc(outcome="hit")
+        return True, json.loads(data), generation
+
+    def store(self, user_id: str, value: Any, generation: int) -> bool:
+        """Cache a value read at ``generation``; False if the user was written since."""
+        if generation < 0:
+            return False
+        try:
+            cursor = self._connection().execute(
+                """
+                INSERT INTO users (uid, generation, data, updated) VALUES (?, ?, ?, ?)
+                ON CONFLICT (uid) DO UPDATE SET data = excluded.data, updated = excluded.updated
+                WHERE users.generation = excluded.generation
+                """,
+                (user_id, generation, json.dumps(value, ensure_ascii=False, default=str), time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.warning(f"User cache store failed: {e}")
+            return False
+        return cursor.rowcount > 0
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop the user's entry in every worker, and reject reads still in flight."""
+        try:
+            self._connection().execute(
+                """
+                INSERT INTO users (uid, generation, data, updated) VALUES (?, 1, NULL, ?)
+                ON CONFLICT (uid) DO UPDATE SET generation = users.generation + 1, data = NULL
+                """,
+                (user_id, time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.error(f"User cache invalidation failed: {e}")
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM users")
+
+
+def open_user_cache() -> Optional[UserCache]:
+    """Return the shared cache if enabled with USER_CACHE_PATH."""
+    return UserCache() if USER_CACHE_PATH else None
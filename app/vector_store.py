@@ -12,45 +12,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import logging
+import itertools
 import os
-from typing import List
+from typing import List, Optional
 
-from langchain.schema import Document
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_loaders import WebBaseLoader
+from app.ingestion import (
+    iter_local_documents,
+    iter_url_documents,
+    refresh_vector_store,
+)
 from langchain_community.vectorstores import SKLearnVectorStore
 from langchain_core.embeddings import Embeddings
 
 PERSIST_PATH = ".persist_vector_store"
 
 
-def load_and_split_documents(urls: List[str]) -> List[Document]:
-    """Load and split documents from a list of URLs."""
-    docs = [WebBaseLoader(url).load() for url in urls]
-    docs_list = [item for sublist in docs for item in sublist]
-    logging.info(f"# of documents loaded (pre-chunking) = {len(docs_list)}")
-
-    text_splitter = CharacterTextSplitter(chunk_size=2000, chunk_overlap=50)
-    doc_splits = text_splitter.split_documents(docs_list)
-    logging.info(f"# of documents after split = {len(doc_splits)}")
-
-    return doc_splits
-
-
 def get_vector_store(
-    embedding: Embeddings, urls: List[str], persist_path: str = PERSIST_PATH
+    embedding: Embeddings,
+    urls: Optional[List[str]] = None,
+    persist_path: str = PERSIST_PATH,
+    paths: Optional[List[str]] = None,
+    refresh: bool = False,
 ) -> SKLearnVectorStore:
-    """Get or create a vector store."""
+    """Get or create a vector store.
 
-    if os.path.exists(persist_path):
-        vector_store = SKLearnVectorStore(
-            embedding=embedding, persist_path=persist_path
-        )
-    else:
-        doc_splits = load_and_split_documents(urls=urls)
-        vector_store = SKLearnVectorStore.from_documents(
-            documents=doc_splits, embedding=embedding, persist_path=persist_path
+    When the store is missing, or ``refresh`` is set, the ``urls`` and local
+    ``paths`` (either may be omitted) are streamed through the incremental
+    ingestion pipeline, so only new or changed chunks are embedded.
+    """
+
+    if refresh or not os.path.exists(persist_path):
+        documents = itertools.chain(
+            iter_url_documents(urls or []), iter_local_documents(paths or [])
         )
-        vector_store.persist()
-    return vector_store
+        refresh_vector_store(embedding, documents, persist_path)
+    return SKLearnVectorStore(embedding=embedding, persist_path=persist_path)
@@ -86,7 +86,7 @@ function App() {
         />
         <CurrentQuestion isStarted={isStarted} />
         {!isStarted && (
-          <WelcomeOverlay className="fixed inset-0">
+          <WelcomeOverlay className="fixed inset-0" userId={user?.uid} getIdToken={getIdToken}>
             <div className="space-y-2">
               <button
                 disabled={userDataLoading || !isRecording}
@@ -117,7 +117,7 @@ function App() {
 
 function AppProvider() {
   const { wsUrl } = useConfig();
-  const { user, signInAnonymousUser } = useAuth();
+  const { user, signInAnonymousUser, getIdToken } = useAuth();
 
   useEffect(() => {
     // 初回マウント時に匿名ログインを実行
@@ -125,7 +125,7 @@ function AppProvider() {
   }, [signInAnonymousUser]);
 
   return (
-    <LiveAPIProvider url={wsUrl} userId={user?.uid}>
+    <LiveAPIProvider url={wsUrl} userId={user?.uid} getIdToken={getIdToken}>
       <ExpressionProvider>
         <StreamingProvider>
           <AudioProvider>
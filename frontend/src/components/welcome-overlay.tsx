@@ -1,14 +1,44 @@
 import c from "classnames";
-import type { ReactNode } from "react";
+import { type ReactNode, useEffect } from "react";
 import { useAudio } from "../contexts/AudioContext";
+import { useLiveAPIContext } from "../contexts/LiveAPIContext";
 import AudioPulse from "./audio-pulse/AudioPulse";
 import { WebCamera } from "./web-camera";
 
 export function WelcomeOverlay({
   children,
   className,
-}: { children: ReactNode; className?: string }) {
+  userId,
+  getIdToken,
+}: {
+  children: ReactNode;
+  className?: string;
+  userId?: string;
+  getIdToken: () => Promise<string>;
+}) {
   const { isRecording, startRecording, stopRecording, volume } = useAudio();
+  const { prefetch } = useLiveAPIContext();
+
+  // この画面を見ているあいだに会話の準備を済ませておき、チケットが切れる前に取り直す
+  useEffect(() => {
+    if (!userId) return;
+    let cancelled = false;
+    let timeoutId: ReturnType<typeof setTimeout> | undefined;
+    const prepare = async () => {
+      const expiresIn = await getIdToken()
+        .then(prefetch)
+        .catch(() => null);
+      if (!cancelled && expiresIn) {
+        timeoutId = setTimeout(prepare, expiresIn * 800);
+      }
+    };
+    prepare();
+    return () => {
+      cancelled = true;
+      clearTimeout(timeoutId);
+    };
+  }, [userId, prefetch, getIdToken]);
+
   return (
     <div className={c("inset-0 bg-black/50 flex items-center justify-center", className)}>
       <div className="bg-white rounded-lg p-8 max-w-2xl w-full mx-4">
@@ -23,10 +23,11 @@ export type LiveAPIProviderProps = {
   children: ReactNode;
   url?: string;
   userId?: string;
+  getIdToken?: () => Promise<string>;
 };
 
-export const LiveAPIProvider: FC<LiveAPIProviderProps> = ({ url, userId, children }) => {
-  const liveAPI = useLiveAPI({ url, userId });
+export const LiveAPIProvider: FC<LiveAPIProviderProps> = ({ url, userId, getIdToken, children }) => {
+  const liveAPI = useLiveAPI({ url, userId, getIdToken });
 
   return (
     <LiveAPIContext.Provider value={liveAPI}>
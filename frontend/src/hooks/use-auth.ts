@@ -28,13 +28,13 @@ export const useAuth = () => {
     }
   }, []);
 
-  const getIdToken = async () => {
+  const getIdToken = useCallback(async () => {
     const currentUser = auth.currentUser;
     if (!currentUser) {
       throw new Error("No authenticated user found");
     }
     return await currentUser.getIdToken();
-  };
+  }, []);
 
   return {
     user,
@@ -25,13 +25,14 @@ import {
 } from "react";
 import { AudioStreamer } from "../utils/audio-streamer";
 import { MultimodalLiveClient } from "../utils/multimodal-live-client";
-import { audioContext } from "../utils/utils";
+import { audioContext, jitteredBackoff } from "../utils/utils";
 import VolMeterWorket from "../utils/worklets/vol-meter";
 
 export type UseLiveAPIResults = {
   client: MultimodalLiveClient;
   connected: boolean;
   connect: (idToken?: string) => Promise<void>;
+  prefetch: (idToken: string) => Promise<number | null>;
   disconnect: () => Promise<void>;
   volume: number;
   getConnectionDuration: () => number;
@@ -42,11 +43,19 @@ export type UseLiveAPIProps = {
   url?: string;
   userId?: string;
   onRunIdChange?: Dispatch<SetStateAction<string>>;
+  getIdToken?: () => Promise<string>;
 };
 
-export function useLiveAPI({ url, userId }: UseLiveAPIProps): UseLiveAPIResults {
+// サーバーの再起動 (WebSocket の close code 1012 Service Restart)
+const SERVICE_RESTART = 1012;
+// 再接続をあきらめるまでの回数
+const MAX_RECONNECT_ATTEMPTS = 6;
+
+export function useLiveAPI({ url, userId, getIdToken }: UseLiveAPIProps): UseLiveAPIResults {
   const client = useMemo(() => new MultimodalLiveClient({ url, userId }), [url, userId]);
   const audioStreamerRef = useRef<AudioStreamer | null>(null);
+  const idTokenRef = useRef<string | undefined>(undefined);
+  const reconnectTimerRef = useRef<ReturnType<typeof setTimeout> | undefined>(undefined);
 
   const [connected, setConnected] = useState(false);
   const [volume, setVolume] = useState(0);
@@ -70,9 +79,33 @@ export function useLiveAPI({ url, userId }: UseLiveAPIProps): UseLiveAPIResults
   }, [audioStreamerRef]);
 
   useEffect(() => {
-    const onClose = () => {
+    // サーバーが再起動するときは、知らせてきた時間だけ待ってから別のインスタンスへつなぎ直す。
+    // 失敗したら、ばらけさせた指数バックオフで繰り返す
+    const reconnect = (attempt: number, delayMs: number) => {
+      reconnectTimerRef.current = setTimeout(async () => {
+        try {
+          const idToken = getIdToken ? await getIdToken() : idTokenRef.current;
+          idTokenRef.current = idToken;
+          await client.connect(idToken);
+          setConnected(true);
+          setConnectionStartTime(Date.now());
+          setDisconnectionTime(null);
+        } catch (error) {
+          console.error("Error reconnecting:", error);
+          if (attempt + 1 < MAX_RECONNECT_ATTEMPTS) {
+            reconnect(attempt + 1, jitteredBackoff(attempt + 1));
+          }
+        }
+      }, delayMs);
+    };
+
+    const onClose = (ev: CloseEvent) => {
       setConnected(false);
       setDisconnectionTime(Date.now());
+      if (ev.code === SERVICE_RESTART) {
+        // 知らせがなければ、同じ時に切られた他の子と重ならないよう自分でばらけさせる
+        reconnect(0, client.reconnectAfterMs ?? jitteredBackoff(2));
+      }
     };
 
     const stopAudioStreamer = () => audioStreamerRef.current?.stop();
@@ -82,12 +115,15 @@ export function useLiveAPI({ url, userId }: UseLiveAPIProps): UseLiveAPIResults
     client.on("close", onClose).on("interrupted", stopAudioStreamer).on("audio", onAudio);
 
     return () => {
+      clearTimeout(reconnectTimerRef.current);
       client.off("close", onClose).off("interrupted", stopAudioStreamer).off("audio", onAudio);
     };
-  }, [client]);
+  }, [client, getIdToken]);
 
   const connect = useCallback(
     async (idToken?: string) => {
+      clearTimeout(reconnectTimerRef.current);
+      idTokenRef.current = idToken;
       client.disconnect();
       await client.connect(idToken);
       setConnected(true);
@@ -97,7 +133,10 @@ export function useLiveAPI({ url, userId }: UseLiveAPIProps): UseLiveAPIResults
     [client, setConnected]
   );
 
+  const prefetch = useCallback((idToken: string) => client.prefetch(idToken), [client]);
+
   const disconnect = useCallback(async () => {
+    clearTimeout(reconnectTimerRef.current);
     client.disconnect();
     setConnected(false);
     setConnectionStartTime(null);
@@ -119,6 +158,7 @@ export function useLiveAPI({ url, userId }: UseLiveAPIProps): UseLiveAPIResults
     client,
     connected,
     connect,
+    prefetch,
     disconnect,
     volume,
     /**
@@ -36,7 +36,7 @@ import {
   isToolCallMessage,
   isTurnComplete,
 } from "../multimodal-live-types";
-import { base64ToArrayBuffer, blobToJSON } from "./utils";
+import { base64ToArrayBuffer, blobToJSON, inflateIfCompressed } from "./utils";
 
 /**
  * the events that this client will emit
@@ -72,6 +72,10 @@ export class MultimodalLiveClient extends EventEmitter<MultimodalLiveClientEvent
   public url = "";
   private runId: string;
   private userId?: string;
+  // /session/prefetch で受け取ったチケットと、その期限 (Date.now() の値)
+  private ticket: { value: string; expiresAt: number } | null = null;
+  // サーバーが再起動する前に知らせてきた、再接続までの待ち時間 (ms)
+  public reconnectAfterMs: number | null = null;
   constructor({ url, userId, runId }: MultimodalLiveAPIClientConnection) {
     super();
     url = url || "ws://localhost:8000/ws";
@@ -90,30 +94,59 @@ export class MultimodalLiveClient extends EventEmitter<MultimodalLiveClientEvent
     this.emit("log", log);
   }
 
+  /**
+   * ようこそ画面のあいだに、ユーザーデータの読み込みと Live API の設定をサーバーに済ませてもらう。
+   * 受け取ったチケットは次の connect で使う。チケットの有効秒数を返す（取れなければ null）
+   */
+  async prefetch(idToken: string): Promise<number | null> {
+    const endpoint = new URL("session/prefetch", this.url.replace(/^ws/, "http"));
+    try {
+      const response = await fetch(endpoint, {
+        method: "POST",
+        headers: { Authorization: `Bearer ${idToken}` },
+      });
+      if (!response.ok) {
+        return null;
+      }
+      const { ticket, expires_in } = (await response.json()) as { ticket: string; expires_in: number };
+      this.ticket = { value: ticket, expiresAt: Date.now() + expires_in * 1000 };
+      return expires_in;
+    } catch (error) {
+      console.error("Error prefetching session:", error);
+      return null;
+    }
+  }
+
   connect(newRunId?: string): Promise<boolean> {
-    const ws = new WebSocket(`${this.url}?id_token=${newRunId}`);
+    const params = new URLSearchParams();
+    // チケットは1回だけ使う。ID トークンも送るので、チケットが使えなくてもサーバーはトークンで認証する
+    const ticket = this.ticket;
+    this.ticket = null;
+    if (ticket && ticket.expiresAt > Date.now()) {
+      params.set("ticket", ticket.value);
+    }
+    if (newRunId) {
+      params.set("id_token", newRunId);
+    }
+    // 展開できるブラウザなら、サーバーに一部のメッセージを圧縮して送ってもらう
+    if ("DecompressionStream" in window) {
+      params.set("compression", "deflate");
+    }
+    const ws = new WebSocket(`${this.url}?${params}`);
+    this.reconnectAfterMs = null;
 
     // Update runId if provided
     if (newRunId) {
       this.runId = newRunId;
     }
 
-    ws.addEventListener("message", async (evt: MessageEvent) => {
-      if (evt.data instanceof Blob) {
-        this.receive(evt.data);
-      } else if (typeof evt.data === "string") {
-        try {
-          const jsonData = JSON.parse(evt.data);
-          if (jsonData.status) {
-            this.log("server.status", jsonData.status);
-            console.log("Status:", jsonData.status); // This will show in console
-          }
-        } catch (error) {
-          console.error("Error parsing message:", error);
-        }
-      } else {
-        console.log("Unhandled message type:", evt);
-      }
+    // 圧縮されたメッセージは展開を待つので、届いた順に1つずつ処理する
+    // （音声の断片が入れ替わったり、turnComplete が前の音声より先に処理されたりしないように）
+    let receiving: Promise<void> = Promise.resolve();
+    ws.addEventListener("message", (evt: MessageEvent) => {
+      receiving = receiving
+        .then(() => this.handleMessage(evt))
+        .catch((error) => console.error("Error handling message:", error));
     });
 
     return new Promise((resolve, reject) => {
@@ -138,19 +171,22 @@ export class MultimodalLiveClient extends EventEmitter<MultimodalLiveClientEvent
         };
         this._sendDirect(setupMessage);
         ws.removeEventListener("error", onError);
+        // 閉じる前に届いたメッセージ（再接続までの待ち時間など）を処理し終えてから知らせる
         ws.addEventListener("close", (ev: CloseEvent) => {
-          console.log(ev);
-          this.disconnect(ws);
-          let reason = ev.reason || "";
-          if (reason.toLowerCase().includes("error")) {
-            const prelude = "ERROR]";
-            const preludeIndex = reason.indexOf(prelude);
-            if (preludeIndex > 0) {
-              reason = reason.slice(preludeIndex + prelude.length + 1, Number.POSITIVE_INFINITY);
+          receiving = receiving.then(() => {
+            console.log(ev);
+            this.disconnect(ws);
+            let reason = ev.reason || "";
+            if (reason.toLowerCase().includes("error")) {
+              const prelude = "ERROR]";
+              const preludeIndex = reason.indexOf(prelude);
+              if (preludeIndex > 0) {
+                reason = reason.slice(preludeIndex + prelude.length + 1, Number.POSITIVE_INFINITY);
+              }
             }
-          }
-          this.log(`server.${ev.type}`, `disconnected ${reason ? `with reason: ${reason}` : ``}`);
-          this.emit("close", ev);
+            this.log(`server.${ev.type}`, `disconnected ${reason ? `with reason: ${reason}` : ``}`);
+            this.emit("close", ev);
+          });
         });
         resolve(true);
       });
@@ -168,8 +204,30 @@ export class MultimodalLiveClient extends EventEmitter<MultimodalLiveClientEvent
     }
     return false;
   }
+
+  private async handleMessage(evt: MessageEvent) {
+    if (evt.data instanceof Blob) {
+      await this.receive(evt.data);
+    } else if (typeof evt.data === "string") {
+      try {
+        const jsonData = JSON.parse(evt.data);
+        if (jsonData.status) {
+          this.log("server.status", jsonData.status);
+          console.log("Status:", jsonData.status); // This will show in console
+        }
+        if (typeof jsonData.reconnectAfterMs === "number") {
+          this.reconnectAfterMs = jsonData.reconnectAfterMs;
+        }
+      } catch (error) {
+        console.error("Error parsing message:", error);
+      }
+    } else {
+      console.log("Unhandled message type:", evt);
+    }
+  }
+
   protected async receive(blob: Blob) {
-    const response = (await blobToJSON(blob)) as LiveIncomingMessage;
+    const response = (await blobToJSON(await inflateIfCompressed(blob))) as LiveIncomingMessage;
     console.log("Parsed response:", response);
 
     if (isToolCallMessage(response)) {
@@ -74,6 +74,18 @@ export const blobToJSON = (blob: Blob) =>
     reader.readAsText(blob);
   });
 
+/**
+ * Inflates a message the server sent zlib-compressed. Compressed messages
+ * start with the zlib header (0x78); plain ones are JSON and start with "{".
+ */
+export const inflateIfCompressed = async (blob: Blob): Promise<Blob> => {
+  const first = new Uint8Array(await blob.slice(0, 1).arrayBuffer())[0];
+  if (first !== 0x78) {
+    return blob;
+  }
+  return new Response(blob.stream().pipeThrough(new DecompressionStream("deflate"))).blob();
+};
+
 export function base64ToArrayBuffer(base64: string) {
   var binaryString = atob(base64);
   var bytes = new Uint8Array(binaryString.length);
@@ -82,3 +94,11 @@ export function base64ToArrayBuffer(base64: string) {
   }
   return bytes.buffer;
 }
+
+/**
+ * Milliseconds to wait before reconnect attempt ``attempt`` (0 for the first):
+ * exponential backoff from ``baseMs`` up to ``capMs``, with full jitter so
+ * that clients dropped at the same moment do not come back at the same moment.
+ */
+export const jitteredBackoff = (attempt: number, baseMs = 1000, capMs = 30000) =>
+  Math.random() * Math.min(capMs, baseMs * 2 ** attempt);
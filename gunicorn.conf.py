@@ -0,0 +1,31 @@
+"""Gunicorn settings for serving ``app.server`` with several worker processes.
+
+The app is imported once in the master (``preload_app``): templates, tool
+declarations, the question bank and the rest of the static state are built
+before forking and shared copy-on-write. Firebase, Firestore, Cloud Logging
+and genai clients are not created at import; each worker creates its own
+after the fork, in ``post_fork``.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app.server:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# Cloud Run の vCPU 数だけワーカーを起動する（WEB_CONCURRENCY で上書き）
+workers = int(os.getenv("WEB_CONCURRENCY", str(len(os.sched_getaffinity(0)))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# WebSocket のセッションは長く続くので、リクエストのタイムアウトでワーカーを止めない
+timeout = 0
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    from app.clients import initialize_clients  # pylint: disable=import-outside-toplevel
+
+    # 最初のセッションを待たせないよう、クライアントはワーカーの起動時に作っておく
+    initialize_clients()
+    server.log.info(f"Worker {worker.pid} initialized its clients")
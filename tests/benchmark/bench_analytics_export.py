@@ -0,0 +1,50 @@
+"""Run the learner-analytics export over millions of synthetic questions.
+
+Usage:
+    python -m tests.benchmark.bench_analytics_export --rows 1000000
+"""
+
+import argparse
+import random
+import resource
+import tempfile
+import time
+
+from app.jobs.analytics_export import AnalyticsExport
+from tests.fake_firestore import FakeFirestore
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--questions-per-user", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    db = FakeFirestore()
+    start = time.perf_counter()
+    for row in range(args.rows):
+        a, b = rng.randint(1, 9), rng.randint(1, 9)
+        user, question = divmod(row, args.questions_per_user)
+        db.seed(
+            f"users/u{user:07d}/mathQuestions/q{question:05d}",
+            {"level": min(a, b), "formula": f"{a} + {b} = ?", "correctCount": rng.randint(0, 5), "wrongCount": rng.randint(0, 3)},
+        )
+    print(f"seeded {args.rows} questions in {time.perf_counter() - start:.1f}s")
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        result = AnalyticsExport(db, f"{tmp}/out", f"{tmp}/ckpt", page_size=args.page_size).run()
+        elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"exported {int(result['questions'].sum())} questions into {len(result)} rows "
+        f"in {elapsed:.1f}s ({args.rows / elapsed:,.0f} rows/s), "
+        f"peak RSS growth during export {(rss_after - rss_before) / 1024:.0f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Measure CPU spent against bytes saved by websocket compression policies.
+
+Runs the messages of a session through each policy and reports, per
+direction and frame kind, the bytes on the wire and the time spent
+compressing them. Frame kinds are classified the way the relay classifies
+them (``frame_kind`` for client messages, ``upstream_kind`` for model
+messages). The policies are:
+
+* off: nothing is compressed
+* wholesale: every message in both directions goes through one deflate
+  stream per direction, as permessage-deflate with context takeover does
+* per message: every message is compressed on its own
+* selective: ``CompressionPolicy``, only model messages of the kinds that
+  benefit
+* selective + huffman audio: as selective, with the model's audio entropy
+  coded (``WS_COMPRESS_HUFFMAN_KINDS=audio``)
+
+The messages come from session traces recorded with
+``SESSION_TRACE_PAYLOADS=1`` (``--trace``), or from a synthetic session:
+the child's 16 kHz microphone audio and camera JPEGs, and the model's
+24 kHz speech with transcriptions, tool calls and usage metadata.
+
+Usage:
+    python -m tests.benchmark.bench_compression --minutes 10
+    python -m tests.benchmark.bench_compression --trace traces/*.jsonl
+"""
+
+import argparse
+import base64
+import json
+import math
+import random
+import time
+import zlib
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from app.compression import CompressionPolicy
+from app.rate_limit import frame_kind
+from app.trace import DOWN, UP, load_trace, upstream_kind
+
+# (direction, message)
+Message = Tuple[str, bytes]
+
+TRANSCRIPTS = ["すごいね！", "じゃあ、つぎのもんだいだよ。", "りんごが3こあって、2こもらったら", "ぜんぶでなんこになるかな？", "せいかい！"]
+
+
+def speech(rng: random.Random, rate: int, seconds: float) -> bytes:
+    """16-bit PCM that sounds roughly like a voice: a few harmonics with a syllable envelope and noise."""
+    samples = []
+    pitch = rng.uniform(180, 260)
+    for i in range(int(rate * seconds)):
+        t = i / rate
+        envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * t)
+        voice = sum(math.sin(2 * math.pi * pitch * h * t) / h for h in (1, 2, 3))
+        samples.append(int(max(-1.0, min(1.0, 0.3 * envelope * voice + rng.gauss(0, 0.02))) * 32767))
+    return b"".join(sample.to_bytes(2, "little", signed=True) for sample in samples)
+
+
+def synthetic_session(minutes: float, video_fps: float, seed: int = 3) -> Iterator[Message]:
+    rng = random.Random(seed)
+    # 音声は使い回す（圧縮はメッセージごとなので結果は変わらない）
+    mic = [base64.b64encode(speech(rng, 16000, 0.1)).decode() for _ in range(20)]
+    voice = [base64.b64encode(speech(rng, 24000, 0.2)).decode() for _ in range(20)]
+    frame = base64.b64encode(b"\xff\xd8" + rng.randbytes(30000)).decode()
+    elapsed = 0.0
+    turn = 0
+    while elapsed < minutes * 60:
+        # 子供が話す（100ms ごとに音声、ときどきカメラの画像）
+        for i in range(rng.randint(15, 40)):
+            chunks = [{"mimeType": "audio/pcm;rate=16000", "data": mic[i % len(mic)]}]
+            yield UP, json.dumps({"realtimeInput": {"mediaChunks": chunks}}).encode()
+            if video_fps and rng.random() < video_fps / 10:
+                chunks = [{"mimeType": "image/jpeg", "data": frame}]
+                yield UP, json.dumps({"realtimeInput": {"mediaChunks": chunks}}).encode()
+            elapsed += 0.1
+        if rng.random() < 0.4:
+            call = {
+                "id": f"function-call-{rng.getrandbits(64)}",
+                "name": "upsert_math_question_result",
+                "args": {"user_id": "Xb3kq9TzL1hQ2mV7", "question_id": f"l3_{rng.getrandbits(48):012x}",
+                         "is_correct": rng.random() < 0.7},
+            }
+            yield DOWN, json.dumps({"toolCall": {"functionCalls": [call]}}).encode()
+        # モデルが話す（200ms ごとの音声と、その書き起こし）
+        for i in range(rng.randint(10, 30)):
+            part = {"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": voice[i % len(voice)]}}
+            yield DOWN, json.dumps({"serverContent": {"modelTurn": {"parts": [part]}}}).encode()
+            text = rng.choice(TRANSCRIPTS)
+            yield DOWN, json.dumps(
+                {"serverContent": {"outputTranscription": {"text": text}}}, ensure_ascii=False
+            ).encode()
+            elapsed += 0.2
+        turn += 1
+        yield DOWN, json.dumps({"serverContent": {"turnComplete": True}}).encode()
+        yield DOWN, json.dumps({"usageMetadata": {
+            "promptTokenCount": 900 + 300 * turn, "responseTokenCount": rng.randint(80, 300),
+            "totalTokenCount": 1200 + 300 * turn,
+            "promptTokensDetails": [{"modality": "TEXT", "tokenCount": 800}, {"modality": "AUDIO", "tokenCount": 300 * turn}],
+            "responseTokensDetails": [{"modality": "AUDIO", "tokenCount": rng.randint(80, 300)}],
+        }}).encode()
+
+
+def traced_session(paths: List[str]) -> Iterator[Message]:
+    for path in paths:
+        header, *frames = load_trace(path)
+        if not header.get("payloads"):
+            raise SystemExit(f"{path} has no payloads; record with SESSION_TRACE_PAYLOADS=1")
+        for frame in frames:
+            if "p" not in frame or frame["d"] not in (UP, DOWN):
+                continue
+            payload = frame["p"]
+            message = payload.encode() if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False).encode()
+            yield frame["d"], message
+
+
+def classify(direction: str, message: bytes) -> str:
+    if direction == DOWN:
+        return upstream_kind(message)
+    return frame_kind(json.loads(message)) or "other"
+
+
+def timed(compress: Callable[[bytes], bytes], message: bytes) -> Tuple[int, float]:
+    started = time.perf_counter()
+    sent = compress(message)
+    return len(sent), time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", nargs="*", default=[], help="session traces recorded with payloads")
+    parser.add_argument("--minutes", type=float, default=10.0, help="length of the synthetic session")
+    parser.add_argument("--video-fps", type=float, default=0.5, help="camera frames per second in the synthetic session")
+    parser.add_argument("--level", type=int, default=6)
+    args = parser.parse_args()
+
+    messages = [
+        (direction, classify(direction, message), message)
+        for direction, message in (traced_session(args.trace) if args.trace else synthetic_session(args.minutes, args.video_fps))
+    ]
+    selective = CompressionPolicy(huffman_kinds=frozenset(), level=args.level)
+    huffman_audio = CompressionPolicy(huffman_kinds=frozenset({"audio"}), level=args.level)
+    streams = {direction: zlib.compressobj(args.level, zlib.DEFLATED, -zlib.MAX_WBITS) for direction in (UP, DOWN)}
+
+    def wholesale(direction: str) -> Callable[[bytes], bytes]:
+        stream = streams[direction]
+        return lambda message: stream.compress(message) + stream.flush(zlib.Z_SYNC_FLUSH)[:-4]
+
+    policies: Dict[str, Callable[[str, str], Callable[[bytes], bytes]]] = {
+        "off": lambda direction, kind: lambda message: message,
+        "wholesale": lambda direction, kind: wholesale(direction),
+        "per message": lambda direction, kind: lambda message: zlib.compress(message, args.level),
+        "selective": lambda direction, kind: (
+            (lambda message: selective.encode(message, kind)) if direction == DOWN else (lambda message: message)
+        ),
+        "selective + huffman audio": lambda direction, kind: (
+            (lambda message: huffman_audio.encode(message, kind)) if direction == DOWN else (lambda message: message)
+        ),
+    }
+
+    # (policy, direction, kind) -> [messages, original bytes, sent bytes, seconds]
+    totals: Dict[Tuple[str, str, str], List[float]] = defaultdict(lambda: [0, 0, 0, 0.0])
+    for name, policy in policies.items():
+        for direction, kind, message in messages:
+            sent, seconds = timed(policy(direction, kind), message)
+            row = totals[name, direction, kind]
+            row[0] += 1
+            row[1] += len(message)
+            row[2] += sent
+            row[3] += seconds
+
+    source = f"{len(args.trace)} traces" if args.trace else f"a synthetic {args.minutes:.0f} minute session"
+    print(f"{len(messages)} messages from {source}, zlib level {args.level}")
+    print("per message, by kind: bytes saved and compression time")
+    for direction, kind in sorted({(d, k) for _, d, k in totals}):
+        count, original, sent, seconds = totals["per message", direction, kind]
+        print(
+            f"  {direction:>4} {kind:<14} n={count:<6.0f} {original / count:9.0f} B/msg"
+            f"  saves {1 - sent / original:6.1%}  {seconds / count * 1e6:8.1f} us/msg"
+        )
+    print("per policy: bytes on the wire and CPU per session")
+    for name in policies:
+        rows = [row for (policy, _, _), row in totals.items() if policy == name]
+        original = sum(row[1] for row in rows)
+        sent = sum(row[2] for row in rows)
+        seconds = sum(row[3] for row in rows)
+        print(
+            f"  {name:<26} {sent / 1e6:8.2f} MB  saves {1 - sent / original:6.1%}"
+            f"  {seconds * 1000:8.1f} ms CPU  ({(original - sent) / max(seconds, 1e-9) / 1e6:7.1f} MB saved per CPU second)"
+        )
+
+
+if __name__ == "__main__":
+    main()
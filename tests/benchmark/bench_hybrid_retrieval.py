@@ -0,0 +1,132 @@
+"""Compare vector-only and hybrid (n-gram prefilter + vector rerank) retrieval.
+
+Builds a synthetic corpus of Japanese children's math chunks and measures
+latency and recall@k for short formula and number-word queries.
+
+Usage:
+    python -m tests.benchmark.bench_hybrid_retrieval --chunks 5000
+"""
+
+import argparse
+import hashlib
+import random
+import statistics
+import time
+import unicodedata
+from typing import Callable, List, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import SKLearnVectorStore
+from langchain_core.embeddings import Embeddings
+
+from app.lexical_index import HybridRetriever, NgramIndex
+
+NAMES = ["はなこ", "たろう", "ゆい", "そうた", "めい", "はると", "あおい", "れん"]
+PLACES = ["こうえん", "がっこう", "おみせ", "おうち", "うみ", "やま"]
+OBJECTS = ["りんご", "みかん", "いちご", "あめ", "えんぴつ", "ボール", "くるま", "ほん"]
+KANJI = "〇一二三四五六七八九十"
+
+
+class HashedBigramEmbeddings(Embeddings):
+    """Stand-in embedding model: random projection of character bigrams."""
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        text = unicodedata.normalize("NFKC", text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            digest = hashlib.blake2b(text[i : i + 2].encode(), digest_size=8).digest()
+            seed = int.from_bytes(digest, "little")
+            vector[seed % self.dim] += 1.0 if seed & 1 << 40 else -1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def make_corpus(size: int, rng: random.Random) -> List[Tuple[str, str, str]]:
+    """Return (text, formula, object count phrase) triples."""
+    corpus = []
+    for _ in range(size):
+        a, b = rng.randint(1, 9), rng.randint(1, 9)
+        obj = rng.choice(OBJECTS)
+        formula = f"{a} + {b} = {a + b}"
+        count = f"{obj}を{KANJI[a]}こ"
+        text = (
+            f"{rng.choice(NAMES)}ちゃんは{rng.choice(PLACES)}で{count}見つけました。"
+            f"おともだちから{KANJI[b]}こもらいました。ぜんぶでいくつかな？"
+            f"しき: {formula}。" + "かずをかぞえてみよう。" * rng.randint(2, 20)
+        )
+        corpus.append((text, formula, count))
+    return corpus
+
+
+def measure(
+    name: str,
+    search: Callable[[str], Sequence[str]],
+    queries: List[Tuple[str, Set[str]]],
+    k: int,
+) -> None:
+    latencies, recalls = [], []
+    for query, relevant in queries:
+        start = time.perf_counter()
+        texts = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits = sum(1 for text in texts if text in relevant)
+        recalls.append(hits / min(k, len(relevant)))
+    latencies.sort()
+    print(
+        f"{name:>8}: recall@{k}={statistics.mean(recalls):.3f} "
+        f"p50={latencies[len(latencies) // 2]:.2f}ms "
+        f"p95={latencies[int(len(latencies) * 0.95)]:.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus = make_corpus(args.chunks, rng)
+    texts = [text for text, _, _ in corpus]
+    embedding = HashedBigramEmbeddings()
+
+    start = time.perf_counter()
+    store = SKLearnVectorStore.from_texts(texts, embedding=embedding)
+    print(f"vector store build: {time.perf_counter() - start:.2f}s for {len(texts)} chunks")
+    start = time.perf_counter()
+    index = NgramIndex(texts, store._ids)
+    print(f"n-gram index build: {time.perf_counter() - start:.2f}s, {len(index.postings)} terms")
+
+    queries = []
+    for _ in range(args.queries):
+        _, formula, count = rng.choice(corpus)
+        if rng.random() < 0.5:
+            # Formulas as the model says them, e.g. "3+5"
+            query = formula.split(" =")[0].replace(" ", "")
+            relevant = {text for text, f, _ in corpus if f.startswith(formula.split(" =")[0])}
+        else:
+            query = count
+            relevant = {text for text, _, c in corpus if c == count}
+        queries.append((query, relevant))
+
+    hybrid = HybridRetriever(vector_store=store, index=index, k=args.k)
+    measure(
+        "vector",
+        lambda q: [d.page_content for d in store.similarity_search(q, k=args.k)],
+        queries,
+        args.k,
+    )
+    measure("hybrid", lambda q: [d.page_content for d in hybrid.invoke(q)], queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
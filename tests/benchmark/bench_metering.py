@@ -0,0 +1,57 @@
+"""Measure the per-frame cost of usage metering.
+
+Times SessionMeter.count_up/count_down on realistic frames (a 128 ms client
+audio chunk, a model audio chunk, a usageMetadata message) and compares it
+with the work the relay already does per frame (json.dumps of the client
+frame).
+
+Usage:
+    python -m tests.benchmark.bench_metering --frames 200000
+"""
+
+import argparse
+import base64
+import json
+import time
+
+from app.metering import SessionMeter
+
+CLIENT_AUDIO = {
+    "realtimeInput": {
+        "mediaChunks": [{"mimeType": "audio/pcm", "data": base64.b64encode(bytes(4096)).decode()}]
+    }
+}
+MODEL_AUDIO = json.dumps({
+    "serverContent": {
+        "modelTurn": {"parts": [{"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(bytes(9600)).decode()}}]}
+    }
+}).encode()
+MODEL_TEXT = json.dumps({"serverContent": {"modelTurn": {"parts": [{"text": "3 + 2 は？" * 20}]}}}).encode()
+
+
+def per_frame_ns(func, frames: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        func()
+    return (time.perf_counter_ns() - start) / frames
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=200000)
+    args = parser.parse_args()
+
+    meter = SessionMeter("u1")
+    size = len(json.dumps(CLIENT_AUDIO))
+    baseline = per_frame_ns(lambda: json.dumps(CLIENT_AUDIO), args.frames)
+    up = per_frame_ns(lambda: meter.count_up(CLIENT_AUDIO, size), args.frames)
+    down_audio = per_frame_ns(lambda: meter.count_down(MODEL_AUDIO), args.frames)
+    down_text = per_frame_ns(lambda: meter.count_down(MODEL_TEXT), args.frames)
+    print(f"relay json.dumps of a client frame: {baseline:8.0f} ns")
+    print(f"count_up (client audio):            {up:8.0f} ns ({up / baseline:.1%} of the dumps)")
+    print(f"count_down (model audio):           {down_audio:8.0f} ns")
+    print(f"count_down (model text):            {down_text:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
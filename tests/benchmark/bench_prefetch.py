@@ -0,0 +1,110 @@
+"""Measure time-to-ready of ``/ws`` with and without a prefetch ticket.
+
+Opens sessions through ``websocket_endpoint`` until the client gets "Backend
+is ready for conversation". Without prefetch the websocket carries the ID
+token, and the token check, the user data read and the config build all
+happen after it opens. With prefetch, ``/session/prefetch`` runs first (as
+it does while the welcome screen shows) and the websocket carries the
+ticket. Every Firestore round trip and every token check takes the given
+latency; the Live API connect takes a fixed time. The prefetch itself is
+timed as well, since it is what moves off the critical path.
+
+Usage:
+    python -m tests.benchmark.bench_prefetch --sessions 400 --firestore-ms 30
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.client_pool import ClientPool
+from tests.benchmark.bench_setup_latency import FixedLatencyLive, ReadyClient, percentiles
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+
+def seeded_backend(rng: random.Random, users: int, latency: float) -> FakeFirestore:
+    db = FakeFirestore(latency=lambda kind: latency * rng.uniform(0.5, 1.5))
+    for i in range(users):
+        db.seed(f"users/u{i}", {"name": f"child{i}", "current_level": 2})
+        db.seed(f"users/u{i}/mathQuestions/q1", {"formula": "3 + 2", "level": 2})
+    return db
+
+
+async def time_to_ready(user_id: str, prefetch: bool) -> Tuple[float, float, "asyncio.Task[None]"]:
+    prefetched = 0.0
+    params: Dict[str, str] = {"id_token": user_id}
+    if prefetch:
+        started = time.monotonic()
+        response = await server.prefetch_session(authorization=f"Bearer {user_id}")
+        prefetched = time.monotonic() - started
+        params = {"ticket": response["ticket"]}
+    client = ReadyClient()
+    started = time.monotonic()
+    task = asyncio.create_task(server.websocket_endpoint(client, **params))
+    await client.ready.wait()
+    elapsed = time.monotonic() - started
+    client.disconnect()
+    return elapsed, prefetched, task
+
+
+async def run(sessions: int, concurrency: int, prefetch: bool) -> Tuple[List[float], List[float]]:
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency * 2))
+    semaphore = asyncio.Semaphore(concurrency)
+    times: List[float] = []
+    prefetch_times: List[float] = []
+    closing: List["asyncio.Task[None]"] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            elapsed, prefetched, task = await time_to_ready(f"u{i}", prefetch)
+        times.append(elapsed)
+        prefetch_times.append(prefetched)
+        closing.append(task)
+
+    await asyncio.gather(*(one(i) for i in range(sessions)))
+    await asyncio.gather(*closing)
+    return times, prefetch_times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--firestore-ms", type=float, default=30.0, help="typical Firestore round trip")
+    parser.add_argument("--verify-ms", type=float, default=20.0, help="ID token check")
+    parser.add_argument("--connect-ms", type=float, default=200.0, help="Live API connect time")
+    args = parser.parse_args()
+
+    server.logging.disable(server.logging.ERROR)
+    server.live_pool = ClientPool({"local": FixedLatencyLive(args.connect_ms / 1000)})
+
+    def verify_id_token(token: str) -> Dict[str, str]:
+        time.sleep(args.verify_ms / 1000)
+        return {"uid": token}
+
+    server.verify_id_token = verify_id_token
+    print(
+        f"time to ready (ms) over {args.sessions} sessions, Firestore {args.firestore_ms:.0f} ms, "
+        f"token check {args.verify_ms:.0f} ms, Live API connect {args.connect_ms:.0f} ms"
+    )
+    for name, prefetch in (("id_token", False), ("prefetch ticket", True)):
+        tools.db = seeded_backend(random.Random(7), args.sessions, args.firestore_ms / 1000)
+        tools._question_indexes.clear()
+        server.user_data_loader = server.UserDataLoader(tools.get_user_data)
+        times, prefetch_times = asyncio.run(run(args.sessions, args.concurrency, prefetch))
+        p50, p99, worst = percentiles(times)
+        line = f"  {name:<16} p50 {p50:7.0f}  p99 {p99:7.0f}  max {worst:7.0f}"
+        if prefetch:
+            line += f"  (prefetch p50 {percentiles(prefetch_times)[0]:.0f} ms, off the critical path)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare model-invented questions with questions drawn from the bank.
+
+For ``--questions`` questions per child, reports the arguments the model has
+to generate for each tool call (a proxy for output tokens), the bytes stored
+per question document, and the time the tool call blocks the turn, with
+``--rtt-ms`` per Firestore round trip.
+
+Usage:
+    python -m tests.benchmark.bench_question_bank --users 50 --questions 20
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+
+tools = load_firestore_tools()
+
+
+def stored_bytes(db: FakeFirestore) -> List[int]:
+    return [
+        len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+        for path, docs in db._collections.items()
+        if path.endswith("/mathQuestions")
+        for data in docs.values()
+    ]
+
+
+async def run(users: int, questions: int, rtt: float, use_bank: bool) -> Tuple[List[int], List[int], List[float]]:
+    db = FakeFirestore(latency=lambda kind: rtt)
+    tools.db = db
+    tools._question_indexes.clear()
+    tools._bank_cursors.clear()
+    argument_bytes: List[int] = []
+    call_seconds: List[float] = []
+    for user in range(users):
+        user_id = f"u{user}"
+        db.seed(f"users/{user_id}", {"name": f"child{user}", "current_level": 3})
+        tools.get_user_data(user_id)
+        for n in range(questions):
+            if use_bank:
+                args: Dict[str, Any] = {"user_id": user_id, "level": 3}
+                started = time.perf_counter()
+                tools.get_next_question(**args)
+            else:
+                # モデルが毎回考えて送ってくる問題と同じ大きさの引数
+                item = tools.question_bank.nth_for(user_id, 3, n)
+                args = {
+                    "user_id": user_id, "question_text": item["question_text"], "formula": item["formula"],
+                    "answer": item["answer"], "level": 3,
+                }
+                started = time.perf_counter()
+                tools.add_math_question(**args)
+            call_seconds.append(time.perf_counter() - started)
+            argument_bytes.append(len(json.dumps(args, ensure_ascii=False).encode("utf-8")))
+            await asyncio.sleep(0)
+    await tools.flush_pending_writes()
+    return argument_bytes, stored_bytes(db), call_seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=20, help="questions per child")
+    parser.add_argument("--rtt-ms", type=float, default=5.0, help="Firestore round trip")
+    args = parser.parse_args()
+
+    print(f"{args.users} children x {args.questions} questions, {args.rtt_ms:.0f} ms per Firestore round trip")
+    for label, use_bank in (("add_math_question", False), ("get_next_question", True)):
+        arguments, stored, seconds = asyncio.run(run(args.users, args.questions, args.rtt_ms / 1000, use_bank))
+        print(
+            f"  {label:>17}: {sum(arguments) / len(arguments):5.0f} B of tool arguments per question, "
+            f"{sum(stored) / len(stored):5.0f} B stored per question, "
+            f"tool call {sum(seconds) / len(seconds) * 1000:5.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
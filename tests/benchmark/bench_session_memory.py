@@ -0,0 +1,130 @@
+"""Measure the memory held per live relay session.
+
+Opens many GeminiSession relays against fake client and Live API websockets,
+drives each through a few audio frames, a model turn and a tool call, and
+reports the tracemalloc delta per session while they are all idle-but-open.
+Each allocation is attributed to the innermost frame in this repository, so
+the fakes (which stand in for the websocket libraries' own buffers) are
+reported separately from the relay's cost: session object, coroutines,
+tasks, learner state and resume buffers.
+
+Usage:
+    python -m tests.benchmark.bench_session_memory --sessions 2000
+"""
+
+import argparse
+import asyncio
+import base64
+import gc
+import os
+import tracemalloc
+from collections import Counter
+from typing import List, Tuple
+
+from app.learner_state import LearnerState
+from tests.fake_live import (
+    FakeClientWebSocket,
+    FakeLiveSession,
+    load_server,
+    tool_call_message,
+)
+
+server = load_server()
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+AUDIO = base64.b64encode(bytes(640)).decode()
+MODEL_TURN = {
+    "serverContent": {
+        "modelTurn": {"parts": [{"text": "3 + 2 は いくつかな？"}]},
+        "turnComplete": True,
+    }
+}
+
+
+def user_data(i: int) -> dict:
+    return {
+        "name": f"user{i}",
+        "current_level": 2,
+        "questions": [
+            {"id": f"q{j}", "formula": f"{j} + 2 = ?", "level": 2, "correctCount": 1, "wrongCount": 0}
+            for j in range(5)
+        ],
+    }
+
+
+async def open_sessions(count: int) -> Tuple[list, List[asyncio.Task]]:
+    sessions = []
+    tasks = []
+    for i in range(count):
+        user_id = f"u{i}"
+        state = LearnerState.from_user_data(user_id, user_data(i))
+        client = FakeClientWebSocket()
+        live = FakeLiveSession()
+        session = server.GeminiSession(
+            live,
+            client,
+            server.tool_functions,
+            learner_state=state,
+            reconnect=server.resume_callable(state),
+        )
+        tasks.append(asyncio.create_task(session.run()))
+        client.push({"setup": {"run_id": f"r{i}", "user_id": user_id}})
+        for _ in range(3):
+            client.push({"realtimeInput": {"mediaChunks": [{"mimeType": "audio/pcm", "data": AUDIO}]}})
+        live._ws.push(MODEL_TURN)
+        live._ws.push(tool_call_message("unknown_tool", user_id=user_id))
+        sessions.append((session, client, live))
+    # Let every relay drain its input and park on the next receive.
+    for _ in range(20):
+        await asyncio.sleep(0)
+    for _, client, live in sessions:
+        client.sent_bytes.clear()
+        live._ws.sent.clear()
+    return sessions, tasks
+
+
+def repo_frame(traceback: tracemalloc.Traceback) -> str:
+    """Return the innermost frame of an allocation that is in this repository."""
+    for frame in reversed(traceback):
+        if frame.filename.startswith(ROOT):
+            return f"{os.path.relpath(frame.filename, ROOT)}:{frame.lineno}"
+    return "<other>"
+
+
+async def measure(count: int) -> float:
+    gc.collect()
+    tracemalloc.start(32)
+    before = tracemalloc.take_snapshot()
+    sessions, tasks = await open_sessions(count)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    by_site: Counter = Counter()
+    for stat in after.compare_to(before, "traceback"):
+        by_site[repo_frame(stat.traceback)] += stat.size_diff
+    total = sum(by_site.values())
+    relay = sum(size for site, size in by_site.items() if not site.startswith("tests/"))
+    print(f"{count} sessions: {total / count:,.0f} bytes/session in total")
+    print(f"relay (excluding fakes): {relay / count:,.0f} bytes/session")
+    print("top allocation sites per session:")
+    for site, size in by_site.most_common(12):
+        print(f"  {size / count:8,.0f} B  {site}")
+
+    for _, client, _ in sessions:
+        client.disconnect()
+    await asyncio.gather(*tasks)
+    return total / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=2000)
+    args = parser.parse_args()
+    server.logging.disable(server.logging.CRITICAL)
+    asyncio.run(measure(args.sessions))
+
+
+if __name__ == "__main__":
+    main()
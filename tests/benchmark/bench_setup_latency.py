@@ -0,0 +1,135 @@
+"""Measure time-to-ready of connection setup against a slow Firestore.
+
+Runs ``connect_and_run`` end to end (lease, user data read, Live API
+connect) until the client gets "Backend is ready for conversation". Every
+Firestore round trip blocks for a latency drawn from a distribution with a
+slow tail, and the Live API connect takes a fixed time. Setups are timed
+with the user data deadline and hedging turned off, with hedging only, and
+with both.
+
+Usage:
+    python -m tests.benchmark.bench_setup_latency --sessions 400 --tail-rate 0.03
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from app.client_pool import ClientPool
+from app.connection_setup import UserDataLoader
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+READY = "Backend is ready for conversation"
+
+
+class FixedLatencyLive:
+    """A Live API region whose connect takes ``latency`` seconds."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.aio = self
+        self.live = self
+
+    @asynccontextmanager
+    async def connect(self, model: str, config: Any = None) -> AsyncIterator[FakeLiveSession]:
+        await asyncio.sleep(self.latency)
+        yield FakeLiveSession()
+
+
+class ReadyClient(FakeClientWebSocket):
+    def __init__(self) -> None:
+        super().__init__()
+        self.ready = asyncio.Event()
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        await super().send_json(data)
+        if data.get("status") == READY:
+            self.ready.set()
+
+
+def slow_backend(rng: random.Random, users: int, base: float, tail: float, tail_rate: float) -> FakeFirestore:
+    db = FakeFirestore(latency=lambda kind: tail if rng.random() < tail_rate else base * rng.uniform(0.5, 1.5))
+    for i in range(users):
+        db.seed(f"users/u{i}", {"name": f"child{i}", "current_level": 2})
+        db.seed(f"users/u{i}/mathQuestions/q1", {"formula": "3 + 2", "level": 2})
+    return db
+
+
+async def time_to_ready(user_id: str) -> Tuple[float, "asyncio.Task[None]"]:
+    client = ReadyClient()
+    started = time.monotonic()
+    task = asyncio.create_task(server.connect_and_run(client, user_id))
+    await client.ready.wait()
+    elapsed = time.monotonic() - started
+    client.disconnect()
+    return elapsed, task
+
+
+async def run(sessions: int, concurrency: int) -> List[float]:
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency * 2))
+    semaphore = asyncio.Semaphore(concurrency)
+    times: List[float] = []
+    # 準備ができたら切断し、セッションの後片付けは待たずに次の接続へ進む
+    closing: List["asyncio.Task[None]"] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            # uid は接続ごとに分ける（同じ uid だと準備中の古い接続が引き継がれて閉じる）
+            elapsed, task = await time_to_ready(f"u{i}")
+        times.append(elapsed)
+        closing.append(task)
+
+    await asyncio.gather(*(one(i) for i in range(sessions)))
+    await asyncio.gather(*closing)
+    return times
+
+
+def percentiles(times: List[float]) -> Tuple[float, float, float]:
+    ordered = sorted(times)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return at(0.5), at(0.99), ordered[-1] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--base-ms", type=float, default=30.0, help="typical Firestore round trip")
+    parser.add_argument("--tail-ms", type=float, default=3000.0, help="round trip in the slow tail")
+    parser.add_argument("--tail-rate", type=float, default=0.03, help="share of round trips in the tail")
+    parser.add_argument("--connect-ms", type=float, default=200.0, help="Live API connect time")
+    parser.add_argument("--deadline-ms", type=float, default=1500.0)
+    parser.add_argument("--hedge-ms", type=float, default=300.0)
+    args = parser.parse_args()
+
+    server.logging.disable(server.logging.ERROR)
+    server.live_pool = ClientPool({"local": FixedLatencyLive(args.connect_ms / 1000)})
+    modes = {
+        "no deadline, no hedge": UserDataLoader(tools.get_user_data, deadline=float("inf"), hedge_after=0),
+        "hedge only": UserDataLoader(tools.get_user_data, deadline=float("inf"), hedge_after=args.hedge_ms / 1000),
+        "hedge + deadline": UserDataLoader(
+            tools.get_user_data, deadline=args.deadline_ms / 1000, hedge_after=args.hedge_ms / 1000
+        ),
+    }
+    print(f"time to ready (ms) over {args.sessions} sessions, {args.tail_rate:.0%} of round trips take {args.tail_ms:.0f} ms")
+    for name, loader in modes.items():
+        tools.db = slow_backend(random.Random(7), args.sessions, args.base_ms / 1000, args.tail_ms / 1000, args.tail_rate)
+        tools._question_indexes.clear()
+        server.user_data_loader = loader
+        p50, p99, worst = percentiles(asyncio.run(run(args.sessions, args.concurrency)))
+        print(f"  {name:<24} p50 {p50:7.0f}  p99 {p99:7.0f}  max {worst:7.0f}")
+
+
+if __name__ == "__main__":
+    main()
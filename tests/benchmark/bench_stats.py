@@ -0,0 +1,83 @@
+"""Measure what dashboards polling ``/stats`` cost in Firestore round trips.
+
+``--dashboards`` parents and teachers each poll one of ``--users`` children
+every ``--interval`` seconds for ``--minutes`` of simulated time, sending
+the ETag of their last response. Reports Firestore round trips, billed
+document reads, and how many responses were full bodies or 304s, without
+the server-side cache (ttl 0) and with it.
+
+Usage:
+    python -m tests.benchmark.bench_stats --dashboards 500 --users 100 --minutes 10
+"""
+
+import argparse
+import asyncio
+import random
+from typing import Dict, Optional, Tuple
+
+from app.stats import StatsCache, etag_matches
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+
+tools = load_firestore_tools()
+
+
+def seed(users: int, questions: int) -> FakeFirestore:
+    rng = random.Random(5)
+    db = FakeFirestore()
+    for i in range(users):
+        db.seed(f"users/u{i}", {"name": f"child{i}", "current_level": 5})
+        for q in range(questions):
+            db.seed(
+                f"users/u{i}/mathQuestions/q{q}",
+                {"level": rng.randint(1, 5), "correctCount": rng.randint(0, 5), "wrongCount": rng.randint(0, 3),
+                 "updatedAt": db.now()},
+            )
+    return db
+
+
+async def run(args: argparse.Namespace, ttl: float) -> Tuple[FakeFirestore, Dict[str, int]]:
+    db = seed(args.users, args.questions)
+    tools.db = db
+    now = [0.0]
+    cache = StatsCache(tools.get_user_stats, ttl=ttl, clock=lambda: now[0])
+    etags: Dict[int, Optional[str]] = {}
+    responses = {"200": 0, "304": 0}
+    rng = random.Random(7)
+    children = [rng.randrange(args.users) for _ in range(args.dashboards)]
+    db.reset_counts()
+    for tick in range(int(args.minutes * 60 / args.interval)):
+        now[0] = tick * args.interval
+        for dashboard, child in enumerate(children):
+            entry, _ = await cache.get(f"u{child}")
+            if etag_matches(etags.get(dashboard), entry.etag):
+                responses["304"] += 1
+            else:
+                responses["200"] += 1
+                etags[dashboard] = entry.etag
+    return db, responses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dashboards", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--questions", type=int, default=200, help="questions per child")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between polls")
+    parser.add_argument("--minutes", type=float, default=10.0)
+    parser.add_argument("--ttl", type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(
+        f"{args.dashboards} dashboards polling {args.users} children every {args.interval:.0f}s "
+        f"for {args.minutes:.0f} min"
+    )
+    for label, ttl in (("no cache", 0.0), (f"cache ttl {args.ttl:.0f}s", args.ttl)):
+        db, responses = asyncio.run(run(args, ttl))
+        print(
+            f"  {label:>14}: {db.total_rpcs:6d} Firestore round trips, {db.reads:6d} document reads, "
+            f"{responses['200']} full responses, {responses['304']} not modified"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measure the relay latency the session tap adds with slow subscribers.
+
+Streams model audio frames through GeminiSession at a steady rate and times
+each frame from the fake Live API websocket to the client websocket. The
+run is repeated without a tap and with three subscribers that cannot keep
+up: one awaiting 20 ms per event, one blocking a worker thread for 5 ms per
+event, and one that never returns.
+
+Usage:
+    python -m tests.benchmark.bench_tap --frames 2000 --interval-ms 2
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import time
+from typing import List, Optional, Tuple
+
+from app.tap import TapEvent, TapRegistry
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+server = load_server()
+
+MODEL_AUDIO = json.dumps({
+    "serverContent": {
+        "modelTurn": {"parts": [{"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(bytes(9600)).decode()}}]}
+    }
+}).encode()
+
+
+class TimedClient(FakeClientWebSocket):
+    def __init__(self) -> None:
+        super().__init__()
+        self.received_at: List[float] = []
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.received_at.append(time.perf_counter())
+
+
+async def slow(user_id: str, event: TapEvent) -> None:
+    await asyncio.sleep(0.02)
+
+
+def blocking(user_id: str, event: TapEvent) -> None:
+    time.sleep(0.005)
+
+
+async def stuck(user_id: str, event: TapEvent) -> None:
+    await asyncio.Event().wait()
+
+
+async def relay(frames: int, interval: float, registry: Optional[TapRegistry]) -> Tuple[List[float], list]:
+    live = FakeLiveSession()
+    client = TimedClient()
+    tap = registry.open_tap("bench") if registry is not None else None
+    session = server.GeminiSession(live, client, {}, tap=tap)
+    task = asyncio.create_task(session.run())
+    sent_at: List[float] = []
+    for _ in range(frames):
+        sent_at.append(time.perf_counter())
+        live._ws.incoming.put_nowait(MODEL_AUDIO)
+        await asyncio.sleep(interval)
+    while len(client.received_at) < frames:
+        await asyncio.sleep(0.01)
+    stats = tap.stats() if tap is not None else []
+    client.disconnect()
+    await asyncio.wait_for(task, 5)
+    return [(received - sent) * 1e6 for sent, received in zip(sent_at, client.received_at)], stats
+
+
+def summary(latencies: List[float]) -> str:
+    ordered = sorted(latencies)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return f"p50 {at(0.5):7.1f} us  p99 {at(0.99):7.1f} us  max {ordered[-1]:8.1f} us"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--interval-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    registry = TapRegistry(maxsize=256)
+    registry.subscribe("slow", slow)
+    registry.subscribe("blocking", blocking)
+    registry.subscribe("stuck", stuck)
+    server.logging.disable(server.logging.ERROR)
+
+    baseline, _ = asyncio.run(relay(args.frames, args.interval_ms / 1000, None))
+    tapped, stats = asyncio.run(relay(args.frames, args.interval_ms / 1000, registry))
+    print(f"model frame relay latency over {args.frames} frames, one every {args.interval_ms} ms")
+    print(f"  no tap:                 {summary(baseline)}")
+    print(f"  3 slow subscribers:     {summary(tapped)}")
+    for subscriber in stats:
+        print(f"    {subscriber['subscriber']:<10} delivered {subscriber['delivered']:6}  dropped {subscriber['dropped']:6}")
+
+
+if __name__ == "__main__":
+    main()
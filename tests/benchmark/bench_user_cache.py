@@ -0,0 +1,96 @@
+"""Measure reconnect latency when a child lands on a different worker.
+
+Starts ``--workers`` processes, as uvicorn or gunicorn would, each with its
+own FakeFirestore whose round trips take ``--rtt-ms``. Each child connects
+to one worker (``get_user_data``), answers a question there, and reconnects
+to another worker. The reconnect is timed without the shared cache, when
+every worker pays the Firestore reads again, and with the SQLite cache
+shared through USER_CACHE_PATH.
+
+Usage:
+    python -m tests.benchmark.bench_user_cache --workers 4 --users 200
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+from app.user_cache import UserCache
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+
+tools = load_firestore_tools()
+
+
+def start_worker(rtt: float, cache_path: Optional[str], users: int) -> None:
+    # Firestore の状態は全ワーカーで同じ内容から始める（書き込みは各ワーカーのフェイクに残る）
+    db = FakeFirestore(latency=lambda kind: rtt)
+    for i in range(users):
+        db.seed(f"users/u{i}", {"name": f"child{i}", "current_level": 2})
+        db.seed(f"users/u{i}/mathQuestions/q1", {"formula": "3 + 2", "level": 2, "correctCount": 0, "wrongCount": 0})
+    tools.db = db
+    tools.user_cache = UserCache(cache_path) if cache_path else None
+
+
+def connect(user_id: str) -> Tuple[int, float]:
+    started = time.perf_counter()
+    tools.get_user_data(user_id)
+    return os.getpid(), time.perf_counter() - started
+
+
+def answer(user_id: str) -> None:
+    tools.save_user_level(user_id, 3)
+
+
+def run(workers: int, users: int, rtt: float, cache_path: Optional[str]) -> Tuple[List[float], List[float]]:
+    pools = [
+        multiprocessing.Pool(1, initializer=start_worker, initargs=(rtt, cache_path, users))
+        for _ in range(workers)
+    ]
+    first: List[float] = []
+    reconnect: List[float] = []
+    try:
+        for i in range(users):
+            user_id = f"u{i}"
+            home, other = pools[i % workers], pools[(i + 1) % workers]
+            first.append(home.apply(connect, (user_id,))[1])
+            reconnect.append(other.apply(connect, (user_id,))[1])
+            # 書き込みで無効化された直後の接続は Firestore を読む
+            if i % 10 == 0:
+                home.apply(answer, (user_id,))
+                reconnect.append(other.apply(connect, (user_id,))[1])
+    finally:
+        for pool in pools:
+            pool.terminate()
+    return first, reconnect
+
+
+def summary(times: List[float]) -> str:
+    ordered = sorted(times)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return f"p50 {at(0.5):6.1f} ms  p99 {at(0.99):6.1f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=20.0, help="Firestore round trip")
+    args = parser.parse_args()
+
+    rtt = args.rtt_ms / 1000
+    print(f"{args.workers} workers, {args.users} children, {args.rtt_ms:.0f} ms per Firestore round trip")
+    first, reconnect = run(args.workers, args.users, rtt, None)
+    print(f"  no shared cache:  first connect {summary(first)} | reconnect elsewhere {summary(reconnect)}")
+    with tempfile.TemporaryDirectory() as directory:
+        first, reconnect = run(args.workers, args.users, rtt, os.path.join(directory, "users.sqlite3"))
+    print(f"  shared cache:     first connect {summary(first)} | reconnect elsewhere {summary(reconnect)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Measure relay throughput as the number of worker processes grows.
+
+Serves ``app.server`` the way gunicorn.conf.py does: the app is imported
+once, then the worker processes are forked and accept on one shared
+listening socket. The Live API is a local echo server, Firestore is in
+memory and ID tokens are taken as uids. Client processes keep
+``--concurrency`` sessions busy; each session connects, waits for the ready
+status, sends ``--frames`` audio frames, reads each echo back and closes.
+Reports completed sessions and relayed frames per second for 1, 2, 4, ...
+workers up to ``--workers``.
+
+The echo server and the clients run in their own processes, so run this on
+a box with spare cores beyond the workers being measured.
+
+Usage:
+    python -m tests.benchmark.bench_workers --workers 4 --seconds 20
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, List, Tuple
+
+import uvicorn
+import websockets
+
+from app.client_pool import ClientPool
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import LocalLiveServer, LocalRegionClient, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+READY = "Backend is ready for conversation"
+# 100ms の 16kHz PCM（フロントエンドが送る音声フレームと同じ大きさ）
+AUDIO_FRAME = json.dumps({
+    "realtimeInput": {
+        "mediaChunks": [{"mimeType": "audio/pcm;rate=16000", "data": base64.b64encode(bytes(3200)).decode()}]
+    }
+})
+
+fork = multiprocessing.get_context("fork")
+
+
+def listen() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    return sock
+
+
+def run_upstream(sock: socket.socket) -> None:
+    async def serve() -> None:
+        await LocalLiveServer().start(sock)
+        await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+def run_worker(sock: socket.socket) -> None:
+    # gunicorn の UvicornWorker と同じく、fork した子プロセスで共有ソケットから受け付ける
+    uvicorn.Server(uvicorn.Config(server.app, log_level="error", lifespan="on")).run(sockets=[sock])
+
+
+async def session(url: str, user_id: str, frames: int) -> int:
+    async with websockets.connect(f"{url}/ws?id_token={user_id}", max_size=None) as ws:
+        while json.loads(await ws.recv()).get("status") != READY:
+            pass
+        for _ in range(frames):
+            await ws.send(AUDIO_FRAME)
+            await ws.recv()
+    return frames
+
+
+def run_clients(url: str, client: int, concurrency: int, frames: int, deadline: float, results: Any) -> None:
+    async def loop(slot: int) -> Tuple[int, int]:
+        sessions = relayed = 0
+        while time.time() < deadline:
+            try:
+                relayed += await session(url, f"c{client}s{slot}n{sessions}", frames)
+                sessions += 1
+            except (OSError, websockets.ConnectionClosed):
+                await asyncio.sleep(0.05)
+        return sessions, relayed
+
+    async def main() -> List[Tuple[int, int]]:
+        return await asyncio.gather(*(loop(slot) for slot in range(concurrency)))
+
+    counts = asyncio.run(main())
+    results.put((sum(s for s, _ in counts), sum(r for _, r in counts)))
+
+
+def measure(workers: int, args: argparse.Namespace) -> Tuple[float, float]:
+    upstream_sock, server_sock = listen(), listen()
+    upstream_url = f"ws://127.0.0.1:{upstream_sock.getsockname()[1]}"
+    server.live_pool = ClientPool({"local": LocalRegionClient(SimpleNamespace(url=upstream_url))})
+    processes = [fork.Process(target=run_upstream, args=(upstream_sock,)) for _ in range(args.upstream_procs)]
+    processes += [fork.Process(target=run_worker, args=(server_sock,)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    time.sleep(1.0)
+
+    url = f"ws://127.0.0.1:{server_sock.getsockname()[1]}"
+    results = fork.Queue()
+    started = time.time()
+    deadline = started + args.seconds
+    per_client = max(1, args.concurrency // args.client_procs)
+    clients = [
+        fork.Process(target=run_clients, args=(url, i, per_client, args.frames, deadline, results))
+        for i in range(args.client_procs)
+    ]
+    for client in clients:
+        client.start()
+    counts = [results.get() for _ in clients]
+    elapsed = time.time() - started
+    for process in clients + processes:
+        process.terminate()
+        process.join()
+    upstream_sock.close()
+    server_sock.close()
+    return sum(s for s, _ in counts) / elapsed, sum(r for _, r in counts) / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=len(os.sched_getaffinity(0)), help="most workers to try")
+    parser.add_argument("--concurrency", type=int, default=200, help="sessions kept open at once")
+    parser.add_argument("--frames", type=int, default=20, help="audio frames per session")
+    parser.add_argument("--seconds", type=float, default=20.0, help="duration of each run")
+    parser.add_argument("--client-procs", type=int, default=2)
+    parser.add_argument("--upstream-procs", type=int, default=2)
+    args = parser.parse_args()
+
+    server.logging.disable(server.logging.ERROR)
+    server.verify_id_token = lambda token: {"uid": token}
+    tools.db = FakeFirestore()
+    ledger = tempfile.TemporaryDirectory()
+    server.usage_ledger.path = os.path.join(ledger.name, "usage_ledger.jsonl")
+
+    counts = [1]
+    while counts[-1] * 2 <= args.workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.workers:
+        counts.append(args.workers)
+    print(
+        f"{args.concurrency} concurrent sessions of {args.frames} audio frames, "
+        f"{len(os.sched_getaffinity(0))} cores available"
+    )
+    baseline = None
+    for workers in counts:
+        sessions, frames = measure(workers, args)
+        baseline = baseline or sessions
+        print(
+            f"  {workers:2d} workers: {sessions:7.1f} sessions/s  {frames:8.0f} frames/s  "
+            f"({sessions / baseline:.2f}x)"
+        )
+    ledger.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""In-memory stand-in for the Firestore client used by ``app.tools.firestore``.
+
+Implements the subset of the google-cloud-firestore API the app uses:
+documents, (group) queries with filters, ordering and cursors, transactions
+(compatible with ``firestore.transactional``), write batches and field
+transforms.
+"""
+
+import bisect
+import copy
+import datetime
+import importlib
+import itertools
+import os
+import sys
+import time
+import uuid
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from unittest.mock import patch
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+DOCUMENT_ID = "__name__"
+
+
+def load_firestore_tools() -> ModuleType:
+    """Import ``app.tools.firestore`` without Firebase credentials."""
+    if "app.tools.firestore" in sys.modules:
+        return sys.modules["app.tools.firestore"]
+    with patch.dict(os.environ, {"K_SERVICE": "test"}), patch(
+        "firebase_admin.initialize_app"
+    ), patch("firebase_admin.firestore.client"):
+        return importlib.import_module("app.tools.firestore")
+
+
+def _get_field(data: Dict[str, Any], field_path: str) -> Any:
+    value: Any = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _sort_value(value: Any) -> Tuple[int, Any]:
+    # Firestore orders values by type first; keep the types the app stores apart
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime.datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+class FakeSnapshot:
+    """A document snapshot."""
+
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[Dict[str, Any]]) -> None:
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str) -> Any:
+        return _get_field(self._data or {}, field_path)
+
+
+class FakeDocumentReference:
+    """A reference to a document path."""
+
+    def __init__(self, client: "FakeFirestore", path: str) -> None:
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction: Any = None, field_paths: Any = None) -> FakeSnapshot:
+        return self._client._read(self)
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._client._commit([("set", self, data, merge)])
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self._client._commit([("update", self, data, False)])
+
+    def delete(self) -> None:
+        self._client._commit([("delete", self, None, False)])
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+
+class FakeAggregationQuery:
+    """count()/sum()/avg() aggregations over a query."""
+
+    def __init__(self, query: "FakeQuery") -> None:
+        self._query = query
+        self._aggregations: List[Tuple[str, Optional[str], str]] = []
+
+    def count(self, alias: Optional[str] = None) -> "FakeAggregationQuery":
+        self._aggregations.append(("count", None, alias or "count"))
+        return self
+
+    def sum(self, field_path: str, alias: Optional[str] = None) -> "FakeAggregationQuery":
+        self._aggregations.append(("sum", field_path, alias or "sum"))
+        return self
+
+    def avg(self, field_path: str, alias: Optional[str] = None) -> "FakeAggregationQuery":
+        self._aggregations.append(("avg", field_path, alias or "avg"))
+        return self
+
+    def get(self, transaction: Any = None) -> List[List[Any]]:
+        self._query._client._record("aggregate")
+        rows = [data for _, data in self._query._matches()]
+        results = []
+        for kind, field_path, alias in self._aggregations:
+            values = [
+                v for v in (_get_field(row, field_path) for row in rows) if isinstance(v, (int, float))
+            ] if field_path else []
+            if kind == "count":
+                value: Any = len(rows)
+            elif kind == "sum":
+                value = sum(values)
+            else:
+                value = sum(values) / len(values) if values else None
+            results.append(_AggregationResult(alias, value))
+        return [results]
+
+
+class _AggregationResult:
+    def __init__(self, alias: str, value: Any) -> None:
+        self.alias = alias
+        self.value = value
+
+
+class FakeQuery:
+    """An immutable query over a collection or collection group."""
+
+    def __init__(
+        self,
+        client: "FakeFirestore",
+        collection_path: Optional[str] = None,
+        group_id: Optional[str] = None,
+        filters: Tuple[Tuple[str, str, Any], ...] = (),
+        orders: Tuple[Tuple[str, str], ...] = (),
+        limit_count: Optional[int] = None,
+        cursor: Optional[Tuple[Any, ...]] = None,
+        projection: Optional[Tuple[str, ...]] = None,
+    ) -> None:
+        self._client = client
+        self._collection_path = collection_path
+        self._group_id = group_id
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit_count
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes: Any) -> "FakeQuery":
+        values = dict(
+            collection_path=self._collection_path,
+            group_id=self._group_id,
+            filters=self._filters,
+            orders=self._orders,
+            limit_count=self._limit,
+            cursor=self._cursor,
+            projection=self._projection,
+        )
+        values.update(changes)
+        return FakeQuery(self._client, **values)
+
+    def where(
+        self,
+        field_path: Optional[str] = None,
+        op_string: Optional[str] = None,
+        value: Any = None,
+        *,
+        filter: Optional[FieldFilter] = None,  # pylint: disable=redefined-builtin
+    ) -> "FakeQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit_count=count)
+
+    def select(self, field_paths: List[str]) -> "FakeQuery":
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot: Any) -> "FakeQuery":
+        return self._copy(cursor=self._cursor_key(document_fields_or_snapshot))
+
+    def count(self, alias: Optional[str] = None) -> FakeAggregationQuery:
+        return FakeAggregationQuery(self).count(alias)
+
+    def sum(self, field_path: str, alias: Optional[str] = None) -> FakeAggregationQuery:
+        return FakeAggregationQuery(self).sum(field_path, alias)
+
+    def avg(self, field_path: str, alias: Optional[str] = None) -> FakeAggregationQuery:
+        return FakeAggregationQuery(self).avg(field_path, alias)
+
+    def _cursor_key(self, cursor: Any) -> Tuple[Any, ...]:
+        if isinstance(cursor, FakeDocumentReference):
+            cursor = self._client._read(cursor, count=False)
+        if isinstance(cursor, FakeSnapshot):
+            return self._sort_key(cursor.reference.path, cursor.to_dict() or {})
+        values = [cursor.get(field) for field, _ in self._orders]
+        return tuple(_sort_value(v) for v in values)
+
+    def _sort_key(self, path: str, data: Dict[str, Any]) -> Tuple[Any, ...]:
+        key = []
+        for field, _ in self._orders:
+            key.append(path if field == DOCUMENT_ID else _sort_value(_get_field(data, field)))
+        if not any(field == DOCUMENT_ID for field, _ in self._orders):
+            key.append(path)
+        return tuple(key)
+
+    def _matches_filters(self, path: str, data: Dict[str, Any]) -> bool:
+        for field, op, expected in self._filters:
+            value = path if field == DOCUMENT_ID else _get_field(data, field)
+            if op == "==" and value != expected:
+                return False
+            if op == "!=" and value == expected:
+                return False
+            if op == "in" and value not in expected:
+                return False
+            if op == "array_contains" and (not isinstance(value, list) or expected not in value):
+                return False
+            if op in ("<", "<=", ">", ">="):
+                if value is None or _sort_value(value)[0] != _sort_value(expected)[0]:
+                    return False
+                a, b = _sort_value(value), _sort_value(expected)
+                if not {"<": a < b, "<=": a <= b, ">": a > b, ">=": a >= b}[op]:
+                    return False
+        return True
+
+    def _sorted(self) -> List[Tuple[Tuple[Any, ...], str]]:
+        signature = (self._collection_path, self._group_id, self._filters, self._orders)
+        cached = self._client._query_cache.get(signature)
+        if cached is not None and cached[0] == self._client._version:
+            return cached[1]
+        if self._collection_path is not None:
+            docs = self._client._collections.get(self._collection_path, {})
+            candidates = ((f"{self._collection_path}/{doc_id}", data) for doc_id, data in docs.items())
+        else:
+            candidates = (
+                (f"{collection_path}/{doc_id}", data)
+                for collection_path, docs in self._client._collections.items()
+                if collection_path.rsplit("/", 1)[-1] == self._group_id
+                for doc_id, data in docs.items()
+            )
+        rows = [
+            (self._sort_key(path, data), path)
+            for path, data in candidates
+            if self._matches_filters(path, data)
+        ]
+        descending = any(direction == "DESCENDING" for _, direction in self._orders)
+        rows.sort(reverse=descending)
+        self._client._query_cache[signature] = (self._client._version, rows)
+        return rows
+
+    def _matches(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        rows = self._sorted()
+        start = 0
+        if self._cursor is not None:
+            if any(direction == "DESCENDING" for _, direction in self._orders):
+                start = next((i for i, (key, _) in enumerate(rows) if key < self._cursor), len(rows))
+            else:
+                start = bisect.bisect_right(_KeyView(rows), self._cursor)
+        end = len(rows) if self._limit is None else start + self._limit
+        for _, path in rows[start:end]:
+            collection_path, doc_id = path.rsplit("/", 1)
+            yield path, self._client._collections[collection_path][doc_id]
+
+    def stream(self, transaction: Any = None) -> Iterator[FakeSnapshot]:
+        self._client._record("query")
+        for path, data in self._matches():
+            self._client.reads += 1
+            if self._projection is not None:
+                data = {field: _get_field(data, field) for field in self._projection}
+            yield FakeSnapshot(FakeDocumentReference(self._client, path), copy.deepcopy(data))
+
+    def get(self, transaction: Any = None) -> List[FakeSnapshot]:
+        return list(self.stream(transaction))
+
+
+class _KeyView:
+    """Sequence view over the sort keys of sorted rows, for bisect."""
+
+    def __init__(self, rows: List[Tuple[Tuple[Any, ...], str]]) -> None:
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, index: int) -> Tuple[Any, ...]:
+        return self._rows[index][0]
+
+
+class FakeCollectionReference(FakeQuery):
+    """A collection; also a query over its documents."""
+
+    def __init__(self, client: "FakeFirestore", path: str) -> None:
+        super().__init__(client, collection_path=path)
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data: Dict[str, Any]) -> Tuple[datetime.datetime, FakeDocumentReference]:
+        ref = self.document()
+        ref.set(data)
+        return self._client.now(), ref
+
+
+class FakeWriteBatch:
+    """Buffers writes and applies them atomically on commit."""
+
+    def __init__(self, client: "FakeFirestore") -> None:
+        self._client = client
+        self._writes: List[Tuple[str, FakeDocumentReference, Any, bool]] = []
+
+    def set(self, reference: FakeDocumentReference, data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference: FakeDocumentReference, data: Dict[str, Any]) -> None:
+        self._writes.append(("update", reference, data, False))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._writes.append(("delete", reference, None, False))
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def commit(self) -> List[Any]:
+        writes, self._writes = self._writes, []
+        if writes:
+            self._client._commit(writes)
+        return []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """A transaction usable with ``firestore.transactional``."""
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, client: "FakeFirestore") -> None:
+        super().__init__(client)
+        self._id: Optional[bytes] = None
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id: Optional[bytes] = None) -> None:
+        self._client._record("begin_transaction")
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self) -> None:
+        self._client._record("rollback")
+        self._clean_up()
+
+    def _commit(self) -> List[Any]:
+        writes, self._writes = self._writes, []
+        self._client._record("commit")
+        if writes:
+            self._client._apply(writes)
+        self._id = None
+        return []
+
+    def get(self, ref_or_query: Any) -> Any:
+        return ref_or_query.get(transaction=self)
+
+
+class FakeFirestore:
+    """In-memory Firestore client.
+
+    ``reads`` counts documents returned to the caller (what Firestore bills),
+    ``writes`` counts document writes and ``rpcs`` counts round trips by kind.
+    ``latency``, when given, returns the seconds each round trip blocks for,
+    by kind, to stand in for a slow backend.
+    """
+
+    def __init__(self, latency: Optional[Callable[[str], float]] = None) -> None:
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._version = 0
+        self._query_cache: Dict[Any, Tuple[int, List[Tuple[Tuple[Any, ...], str]]]] = {}
+        self._clock = itertools.count()
+        self.reads = 0
+        self.writes = 0
+        self.rpcs: Dict[str, int] = {}
+        self.latency = latency
+
+    def now(self) -> datetime.datetime:
+        base = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        return base + datetime.timedelta(milliseconds=next(self._clock))
+
+    def reset_counts(self) -> None:
+        self.reads = 0
+        self.writes = 0
+        self.rpcs = {}
+
+    @property
+    def total_rpcs(self) -> int:
+        return sum(self.rpcs.values())
+
+    def _record(self, kind: str) -> None:
+        self.rpcs[kind] = self.rpcs.get(kind, 0) + 1
+        if self.latency is not None:
+            time.sleep(self.latency(kind))
+
+    def collection(self, path: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, path)
+
+    def collection_group(self, collection_id: str) -> FakeQuery:
+        return FakeQuery(self, group_id=collection_id)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs: Any) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def get_all(self, references: List[FakeDocumentReference], transaction: Any = None) -> Iterator[FakeSnapshot]:
+        self._record("batch_get")
+        for reference in references:
+            yield self._read(reference, record=False)
+
+    def _read(self, reference: FakeDocumentReference, record: bool = True, count: bool = True) -> FakeSnapshot:
+        if record:
+            self._record("get")
+        collection_path, doc_id = reference.path.rsplit("/", 1)
+        data = self._collections.get(collection_path, {}).get(doc_id)
+        if count:
+            # Firestore bills a read for missing documents too
+            self.reads += 1
+        return FakeSnapshot(reference, copy.deepcopy(data))
+
+    def seed(self, path: str, data: Dict[str, Any]) -> None:
+        """Store a document without counting it as a write."""
+        collection_path, doc_id = path.rsplit("/", 1)
+        self._collections.setdefault(collection_path, {})[doc_id] = data
+        self._version += 1
+
+    def data(self, path: str) -> Optional[Dict[str, Any]]:
+        """Return a stored document without counting a read."""
+        collection_path, doc_id = path.rsplit("/", 1)
+        return copy.deepcopy(self._collections.get(collection_path, {}).get(doc_id))
+
+    def documents(self, collection_path: str) -> Dict[str, Dict[str, Any]]:
+        """Return every document in a collection without counting reads."""
+        return copy.deepcopy(self._collections.get(collection_path, {}))
+
+    def _commit(self, writes: List[Tuple[str, FakeDocumentReference, Any, bool]]) -> None:
+        self._record("commit")
+        self._apply(writes)
+
+    def _apply(self, writes: List[Tuple[str, FakeDocumentReference, Any, bool]]) -> None:
+        for kind, reference, _, _ in writes:
+            if kind == "update":
+                collection_path, doc_id = reference.path.rsplit("/", 1)
+                if doc_id not in self._collections.get(collection_path, {}):
+                    raise NotFound(f"No document to update: {reference.path}")
+        now = self.now()
+        for kind, reference, data, merge in writes:
+            collection_path, doc_id = reference.path.rsplit("/", 1)
+            docs = self._collections.setdefault(collection_path, {})
+            self.writes += 1
+            if kind == "delete":
+                docs.pop(doc_id, None)
+            elif kind == "set" and not merge:
+                docs[doc_id] = {}
+                self._merge(docs[doc_id], data, now)
+            elif kind == "set":
+                docs.setdefault(doc_id, {})
+                self._merge(docs[doc_id], data, now)
+            else:
+                for field_path, value in data.items():
+                    *parents, leaf = field_path.split(".")
+                    target = docs[doc_id]
+                    for part in parents:
+                        target = target.setdefault(part, {})
+                    self._assign(target, leaf, value, now)
+        self._version += 1
+
+    def _merge(self, target: Dict[str, Any], data: Dict[str, Any], now: datetime.datetime) -> None:
+        for key, value in data.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge(target[key], value, now)
+            elif isinstance(value, dict):
+                target[key] = {}
+                self._merge(target[key], value, now)
+            else:
+                self._assign(target, key, value, now)
+
+    def _assign(self, target: Dict[str, Any], key: str, value: Any, now: datetime.datetime) -> None:
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif value is transforms.SERVER_TIMESTAMP:
+            target[key] = now
+        elif isinstance(value, transforms.Increment):
+            current = target.get(key)
+            target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+        elif isinstance(value, transforms.ArrayUnion):
+            current = list(target.get(key) or [])
+            target[key] = current + [v for v in value.values if v not in current]
+        elif isinstance(value, transforms.ArrayRemove):
+            target[key] = [v for v in target.get(key) or [] if v not in value.values]
+        else:
+            target[key] = copy.deepcopy(value)
@@ -0,0 +1,186 @@
+"""Stand-ins for the client websocket and the upstream Live API session."""
+
+import asyncio
+from contextlib import asynccontextmanager
+import json
+import sys
+from types import ModuleType, SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+from unittest.mock import MagicMock, patch
+
+from google.auth.credentials import Credentials
+import websockets
+
+from tests.fake_firestore import load_firestore_tools
+
+
+def load_server() -> ModuleType:
+    """Import ``app.server`` without Google Cloud or Firebase credentials."""
+    if "app.server" in sys.modules:
+        return sys.modules["app.server"]
+    with patch(
+        "google.auth.default", return_value=(MagicMock(spec=Credentials), "test-project")
+    ):
+        load_firestore_tools()
+        import app.server  # pylint: disable=import-outside-toplevel
+
+        return app.server
+
+
+class FakeClientWebSocket:
+    """The browser side of ``/ws``: scripted input, recorded output."""
+
+    def __init__(self) -> None:
+        self.incoming: "asyncio.Queue[Any]" = asyncio.Queue()
+        self.sent_json: List[Dict[str, Any]] = []
+        self.sent_bytes: List[bytes] = []
+        self.closed = False
+        self.close_code: Optional[int] = None
+
+    def push(self, message: Dict[str, Any]) -> None:
+        self.incoming.put_nowait(message)
+
+    def disconnect(self) -> None:
+        self.incoming.put_nowait(ConnectionError("client went away"))
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_json(self) -> Dict[str, Any]:
+        message = await self.incoming.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        self.sent_json.append(data)
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.sent_bytes.append(data)
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None) -> None:
+        self.closed = True
+        self.close_code = code
+        self.disconnect()
+
+
+class FakeUpstreamWebSocket:
+    """The raw websocket of a Live API session (``session._ws``)."""
+
+    def __init__(self) -> None:
+        self.incoming: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+        self.sent: List[Dict[str, Any]] = []
+        self.closed = False
+
+    def push(self, message: Dict[str, Any]) -> None:
+        self.incoming.put_nowait(json.dumps(message).encode())
+
+    async def send(self, data: str) -> None:
+        self.sent.append(json.loads(data))
+
+    async def recv(self, decode: bool = True) -> Optional[bytes]:
+        return await self.incoming.get()
+
+    async def close(self) -> None:
+        self.closed = True
+        self.incoming.put_nowait(None)
+
+
+class FakeLiveSession:
+    """What ``genai_client.aio.live.connect`` yields."""
+
+    def __init__(self) -> None:
+        self._ws = FakeUpstreamWebSocket()
+
+
+class FakeLiveRegion:
+    """A Live API region for ``ClientPool`` that opens FakeLiveSessions."""
+
+    def __init__(self) -> None:
+        self.aio = self
+        self.live = self
+        self.sessions: List[FakeLiveSession] = []
+
+    @asynccontextmanager
+    async def connect(self, model: str, config: Any = None) -> AsyncIterator[FakeLiveSession]:
+        session = FakeLiveSession()
+        self.sessions.append(session)
+        yield session
+
+
+def tool_call_message(name: str, call_id: str = "call-1", **args: Any) -> Dict[str, Any]:
+    """Return a Live API server message asking for one tool call."""
+    return {"toolCall": {"functionCalls": [{"id": call_id, "name": name, "args": args}]}}
+
+
+class LocalLiveServer:
+    """A stand-in Live API endpoint on localhost for one region.
+
+    Answers the setup message with ``setupComplete`` after ``latency``
+    seconds and echoes everything else; ``down`` makes it refuse the
+    websocket handshake, as an outage would.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.down = False
+        self.connections = 0
+        self._server: Any = None
+
+    @property
+    def url(self) -> str:
+        port = self._server.sockets[0].getsockname()[1]
+        return f"ws://127.0.0.1:{port}"
+
+    async def start(self, sock: Any = None) -> "LocalLiveServer":
+        """Listen on a free port, or on ``sock`` when several processes share one."""
+        if sock is not None:
+            self._server = await websockets.serve(self._handle, sock=sock, process_request=self._check)
+        else:
+            self._server = await websockets.serve(self._handle, "127.0.0.1", 0, process_request=self._check)
+        return self
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _check(self, connection: Any, request: Any) -> Any:
+        if self.down:
+            return connection.respond(503, "region unavailable\n")
+        return None
+
+    async def _handle(self, websocket: Any) -> None:
+        self.connections += 1
+        try:
+            await websocket.recv()
+            await asyncio.sleep(self.latency)
+            await websocket.send(json.dumps({"setupComplete": {}}))
+            async for message in websocket:
+                await websocket.send(message)
+        except websockets.ConnectionClosed:
+            pass
+
+
+class LocalLiveSession:
+    def __init__(self, ws: Any) -> None:
+        self._ws = ws
+
+
+class _LocalLive:
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+    @asynccontextmanager
+    async def connect(self, model: str, config: Any = None) -> AsyncIterator[LocalLiveSession]:
+        # genai の AsyncLive.connect と同じく、setup を送って setupComplete を待つ
+        async with websockets.connect(self.url) as ws:
+            await ws.send(json.dumps({"setup": {"model": model}}))
+            await ws.recv(decode=False)
+            yield LocalLiveSession(ws)
+
+
+class LocalRegionClient:
+    """Looks like ``genai.Client`` to the client pool, talking to a LocalLiveServer."""
+
+    def __init__(self, server: LocalLiveServer) -> None:
+        self.aio = SimpleNamespace(live=_LocalLive(server.url))
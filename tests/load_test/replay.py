@@ -0,0 +1,227 @@
+"""Replay a recorded session trace through GeminiSession at the recorded timing.
+
+Traces are written by ``app.trace.TraceRecorder`` when ``SESSION_TRACE_DIR``
+is set. Client frames are fed to a fake client websocket and model frames to
+a fake Live API websocket at their recorded offsets. Payloads are synthesised
+at the recorded sizes when the trace was stripped, and tool calls block for
+their recorded duration, as the Firestore tools do.
+
+The report compares the relay time of every frame, recorded against
+replayed. It also lists stalls in the model's audio (gaps in a turn longer
+than ``--stall-ms``), split into time spent in tool calls, time the relay
+held the frame, and the remainder, which is upstream (model and network).
+
+Usage:
+    python -m tests.load_test.replay trace.jsonl [--speed 2] [--copies 50]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.trace import DOWN, TOOL, UP, load_trace
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, FakeUpstreamWebSocket, load_server
+
+server = load_server()
+
+STALL_MS = 500.0
+DRAIN_SECONDS = 0.5
+
+
+def synthetic_up(frame: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return a client message of the recorded kind and roughly the recorded size."""
+    if "p" in frame:
+        return frame["p"]
+    padding = "A" * max(0, frame["n"] - 90)
+    if frame["k"] == "audio":
+        return {"realtimeInput": {"mediaChunks": [{"mimeType": "audio/pcm", "data": padding}]}}
+    if frame["k"] == "video":
+        return {"realtimeInput": {"mediaChunks": [{"mimeType": "image/jpeg", "data": padding}]}}
+    if frame["k"] == "clientContent":
+        turns = [{"role": "user", "parts": [{"text": padding}]}]
+        return {"clientContent": {"turns": turns, "turnComplete": True}}
+    return None
+
+
+def synthetic_down(frame: Dict[str, Any], tool_names: Deque[str]) -> bytes:
+    """Return a Live API message of the recorded kind and roughly the recorded size."""
+    if "p" in frame:
+        return frame["p"].encode()
+    kind = frame["k"]
+    if kind == "toolCall":
+        calls = [{"id": f"call-{frame['t']}", "name": tool_names.popleft() if tool_names else "unknown", "args": {}}]
+        message: Dict[str, Any] = {"toolCall": {"functionCalls": calls}}
+    elif kind == "turnComplete":
+        message = {"serverContent": {"turnComplete": True}}
+    elif kind == "interrupted":
+        message = {"serverContent": {"interrupted": True}}
+    elif kind == "setupComplete":
+        message = {"setupComplete": {}}
+    else:
+        padding = "A" * max(0, frame["n"] - 110)
+        part = {"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": padding}} if kind == "audio" else {"text": padding}
+        message = {"serverContent": {"modelTurn": {"parts": [part]}}}
+    return json.dumps(message).encode()
+
+
+def blocking_tools(frames: List[Dict[str, Any]]) -> Dict[str, Callable]:
+    """Tool functions that block for the recorded duration of each call."""
+    durations: Dict[str, Deque[float]] = defaultdict(deque)
+    for frame in frames:
+        if frame["d"] == TOOL:
+            durations[frame["k"]].append(frame.get("w", 0.0) / 1000)
+
+    def make(name: str) -> Callable:
+        def tool(**_: Any) -> Dict[str, Any]:
+            if durations[name]:
+                time.sleep(durations[name].popleft())
+            return {}
+        return tool
+
+    return {name: make(name) for name in durations}
+
+
+class TimedClient(FakeClientWebSocket):
+    def __init__(self) -> None:
+        super().__init__()
+        self.received_at: List[float] = []
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.received_at.append(time.monotonic())
+        await super().send_bytes(data)
+
+
+class TimedUpstream(FakeUpstreamWebSocket):
+    def __init__(self) -> None:
+        super().__init__()
+        self.received_at: List[float] = []
+
+    async def send(self, data: str) -> None:
+        self.received_at.append(time.monotonic())
+        await super().send(data)
+
+
+@dataclass
+class ReplayResult:
+    """Relay times in ms, keyed by (direction, kind)."""
+
+    recorded: Dict[Tuple[str, str], List[float]] = field(default_factory=lambda: defaultdict(list))
+    replayed: Dict[Tuple[str, str], List[float]] = field(default_factory=lambda: defaultdict(list))
+
+
+async def replay_once(frames: List[Dict[str, Any]], speed: float, result: ReplayResult) -> None:
+    client = TimedClient()
+    live = FakeLiveSession()
+    live._ws = TimedUpstream()
+    session = server.GeminiSession(live, client, blocking_tools(frames))
+    task = asyncio.create_task(session.run())
+
+    tool_names = deque(frame["k"] for frame in frames if frame["d"] == TOOL)
+    sent: Dict[str, List[Tuple[float, Dict[str, Any]]]] = {UP: [], DOWN: []}
+    start = time.monotonic()
+    for frame in frames:
+        if frame["d"] == TOOL or "x" in frame:
+            continue
+        delay = start + frame["t"] / 1000 / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if frame["d"] == UP:
+            message = synthetic_up(frame)
+            if message is None:
+                continue
+            client.push(message)
+        else:
+            live._ws.incoming.put_nowait(synthetic_down(frame, tool_names))
+        sent[frame["d"]].append((time.monotonic(), frame))
+
+    await asyncio.sleep(DRAIN_SECONDS)
+    client.disconnect()
+    await asyncio.wait_for(task, 5)
+
+    for direction, arrivals in ((UP, live._ws.received_at), (DOWN, client.received_at)):
+        for (injected, frame), arrived in zip(sent[direction], arrivals):
+            key = (direction, frame["k"])
+            result.recorded[key].append(frame.get("w", 0.0))
+            result.replayed[key].append((arrived - injected) * 1000)
+
+
+def find_stalls(frames: List[Dict[str, Any]], stall_ms: float = STALL_MS) -> List[Dict[str, float]]:
+    """Find gaps in the model's output within a turn and attribute them."""
+    stalls = []
+    previous: Optional[Dict[str, Any]] = None
+    tool_time: List[Tuple[float, float]] = []
+    for frame in frames:
+        if frame["d"] == TOOL:
+            tool_time.append((frame["t"], frame.get("w", 0.0)))
+            continue
+        if frame["d"] != DOWN:
+            continue
+        if frame["k"] in ("turnComplete", "interrupted"):
+            previous = None
+            continue
+        if previous is not None:
+            gap = frame["t"] - previous["t"]
+            if gap > stall_ms:
+                tools = sum(w for t, w in tool_time if previous["t"] <= t < frame["t"])
+                relay = previous.get("w", 0.0) + frame.get("w", 0.0)
+                stalls.append({
+                    "t": frame["t"],
+                    "gap": gap,
+                    "tool": tools,
+                    "relay": relay,
+                    "upstream": max(0.0, gap - tools - relay),
+                })
+        previous = frame
+    return stalls
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def report(result: ReplayResult, stalls: List[Dict[str, float]], stall_ms: float = STALL_MS) -> None:
+    print("relay time per frame (ms): recorded p50/p95/max -> replayed p50/p95/max")
+    for key in sorted(result.recorded):
+        recorded, replayed = result.recorded[key], result.replayed[key]
+        print(
+            f"  {key[0]:>4} {key[1]:<14} n={len(recorded):<6}"
+            f" {percentile(recorded, .5):7.2f} {percentile(recorded, .95):7.2f} {max(recorded):8.2f} ->"
+            f" {percentile(replayed, .5):7.2f} {percentile(replayed, .95):7.2f} {max(replayed):8.2f}"
+        )
+    print(f"stalls in model output longer than {stall_ms:.0f} ms: {len(stalls)}")
+    for stall in sorted(stalls, key=lambda s: -s["gap"])[:10]:
+        print(
+            f"  at {stall['t'] / 1000:8.2f}s gap {stall['gap']:7.0f} ms ="
+            f" tool {stall['tool']:6.0f} + relay {stall['relay']:6.1f} + upstream {stall['upstream']:6.0f}"
+        )
+
+
+async def replay(frames: List[Dict[str, Any]], speed: float = 1.0, copies: int = 1) -> ReplayResult:
+    """Replay ``copies`` concurrent sessions of the trace and collect relay times."""
+    result = ReplayResult()
+    await asyncio.gather(*(replay_once(frames, speed, result) for _ in range(copies)))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay faster (>1) or slower")
+    parser.add_argument("--copies", type=int, default=1, help="concurrent sessions replaying the trace")
+    parser.add_argument("--stall-ms", type=float, default=STALL_MS)
+    args = parser.parse_args()
+
+    header, *frames = load_trace(args.trace)
+    print(f"session {header['session']}: {len(frames)} frames, {header['evicted']} evicted by the ring buffer")
+    server.logging.disable(server.logging.WARNING)
+    result = asyncio.run(replay(frames, args.speed, args.copies))
+    report(result, find_stalls(frames, args.stall_ms), args.stall_ms)
+
+
+if __name__ == "__main__":
+    main()
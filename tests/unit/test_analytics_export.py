@@ -0,0 +1,122 @@
+import json
+import random
+from pathlib import Path
+from typing import Any, List
+
+import pandas as pd
+import pytest
+
+from app.jobs import analytics_export
+from app.jobs.analytics_export import AnalyticsExport
+from app.question_bank import QuestionBank, normalize_formula
+from tests.fake_firestore import FakeFirestore
+
+
+def make_db(users: int = 200, questions_per_user: int = 100) -> FakeFirestore:
+    """Seed a fake Firestore with synthetic questions for many users."""
+    rng = random.Random(1)
+    db = FakeFirestore()
+    for user in range(users):
+        for question in range(questions_per_user):
+            a, b = rng.randint(1, 5), rng.randint(1, 5)
+            formula = f"{a} + {b} = ?" if rng.random() < 0.5 else f"{a}＋{b}＝？"
+            db.seed(
+                f"users/u{user:04d}/mathQuestions/q{question:04d}",
+                {
+                    "level": a,
+                    "formula": formula,
+                    "correctCount": rng.randint(0, 3),
+                    "wrongCount": rng.randint(0, 2),
+                },
+            )
+    return db
+
+
+def test_export_aggregates_and_partitions(tmp_path: Path) -> None:
+    """Totals match the raw documents and output is partitioned by level."""
+    db = make_db(users=20, questions_per_user=50)
+    result = AnalyticsExport(db, str(tmp_path / "out"), str(tmp_path / "ckpt"), page_size=64).run()
+
+    raw = [
+        data
+        for path, docs in db._collections.items()
+        for data in docs.values()
+    ]
+    assert result["questions"].sum() == len(raw) == 1000
+    assert result["correct"].sum() == sum(d["correctCount"] for d in raw)
+    # Full-width and half-width spellings of a formula are one row
+    assert result.duplicated(["level", "formula"]).sum() == 0
+    assert set(result["formula"]) <= {f"{a}+{b}" for a in range(1, 6) for b in range(1, 6)}
+
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == [f"level={i}" for i in range(1, 6)]
+    written = pd.read_parquet(tmp_path / "out")
+    assert written["questions"].sum() == 1000
+    assert not (tmp_path / "ckpt").exists()
+
+
+def test_export_resumes_after_interruption(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A crashed run resumes from its checkpoint without double counting."""
+    expected = AnalyticsExport(make_db(), str(tmp_path / "a"), str(tmp_path / "ca"), page_size=1000).run()
+
+    db = make_db()
+    calls: List[int] = []
+    aggregate_page = analytics_export.aggregate_page
+
+    def flaky_aggregate(snapshots: List[Any], question_bank: Any = None) -> pd.DataFrame:
+        calls.append(len(snapshots))
+        if len(calls) == 8:
+            raise ConnectionError("deadline exceeded")
+        return aggregate_page(snapshots, question_bank)
+
+    monkeypatch.setattr(analytics_export, "aggregate_page", flaky_aggregate)
+    job = AnalyticsExport(db, str(tmp_path / "b"), str(tmp_path / "cb"), page_size=1000, checkpoint_every=3)
+    with pytest.raises(ConnectionError):
+        job.run()
+    checkpoint = json.loads((tmp_path / "cb" / "checkpoint.json").read_text())
+    assert checkpoint["rows"] == 6000
+
+    monkeypatch.setattr(analytics_export, "aggregate_page", aggregate_page)
+    db.reset_counts()
+    resumed = job.run()
+    # Only the remaining 14 pages plus the cursor document are read again
+    assert db.reads == 14000 + 1
+    pd.testing.assert_frame_equal(resumed, expected)
+
+
+def test_export_includes_compacted_level_stats(tmp_path: Path) -> None:
+    """Questions folded into levelStats are still counted, the unlisted ones as OTHER_FORMULAS."""
+    db = FakeFirestore()
+    db.seed("users/u1/mathQuestions/q1", {"level": 2, "formula": "3 + 2 = ?", "correctCount": 1, "wrongCount": 0})
+    db.seed("users/u1/levelStats/2", {
+        "level": 2, "questions": 5, "correct": 6, "wrong": 3,
+        "formulas": [{"formula": "3+2", "questions": 3, "correct": 4, "wrong": 1}],
+    })
+    db.seed("users/u2/levelStats/1", {
+        "level": 1, "questions": 2, "correct": 2, "wrong": 0,
+        "formulas": [{"formula": "1+1", "questions": 2, "correct": 2, "wrong": 0}],
+    })
+    result = AnalyticsExport(db, str(tmp_path / "out"), str(tmp_path / "ckpt"), page_size=1).run()
+
+    rows = {
+        (row.level, row.formula): (row.questions, row.correct, row.wrong)
+        for row in result.itertuples(index=False)
+    }
+    assert rows == {
+        (2, "3+2"): (4, 5, 1),
+        (2, analytics_export.OTHER_FORMULAS): (2, 2, 2),
+        (1, "1+1"): (2, 2, 0),
+    }
+
+
+def test_bank_questions_take_their_formula_from_the_bank(tmp_path: Path) -> None:
+    """Bank questions store only results; the export looks their formula up by id."""
+    bank = QuestionBank.load()
+    item = bank.nth_for("u1", 2, 0)
+    db = FakeFirestore()
+    db.seed(f"users/u1/mathQuestions/{item['question_id']}", {"level": 2, "correctCount": 2, "wrongCount": 1})
+    db.seed(f"users/u2/mathQuestions/{item['question_id']}", {"level": 2, "correctCount": 1, "wrongCount": 0})
+    result = AnalyticsExport(db, str(tmp_path / "out"), str(tmp_path / "ckpt"), question_bank=bank).run()
+
+    assert result[["level", "formula", "questions", "correct", "wrong"]].to_dict("records") == [
+        {"level": 2, "formula": normalize_formula(item["formula"]), "questions": 2, "correct": 3, "wrong": 1}
+    ]
@@ -0,0 +1,97 @@
+import asyncio
+from typing import AsyncIterator, Dict
+
+import pytest
+import pytest_asyncio
+
+from app.client_pool import ClientPool
+from tests.fake_live import LocalLiveServer, LocalRegionClient
+
+
+@pytest_asyncio.fixture
+async def regions() -> AsyncIterator[Dict[str, LocalLiveServer]]:
+    """Three stand-in regions with different connect latencies."""
+    servers = {
+        "us-central1": await LocalLiveServer(latency=0.05).start(),
+        "asia-northeast1": await LocalLiveServer(latency=0.0).start(),
+        "europe-west4": await LocalLiveServer(latency=0.15).start(),
+    }
+    yield servers
+    for server in servers.values():
+        await server.stop()
+
+
+def make_pool(regions: Dict[str, LocalLiveServer], **kwargs) -> ClientPool:
+    return ClientPool({name: LocalRegionClient(server) for name, server in regions.items()}, **kwargs)
+
+
+async def open_session(pool: ClientPool) -> None:
+    async with pool.connect(model="gemini") as session:
+        await session._ws.send("ping")
+        assert await session._ws.recv() == "ping"
+
+
+@pytest.mark.asyncio
+async def test_picks_fastest_region(regions: Dict[str, LocalLiveServer]) -> None:
+    """After exploring every region, sessions go to the fastest one."""
+    pool = make_pool(regions)
+    for _ in range(8):
+        await open_session(pool)
+    assert all(stats.latency is not None for stats in pool.stats.values())
+    assert pool.ranked() == ["asia-northeast1", "us-central1", "europe-west4"]
+    assert regions["asia-northeast1"].connections >= 5
+
+
+@pytest.mark.asyncio
+async def test_fails_over_during_outage(regions: Dict[str, LocalLiveServer]) -> None:
+    """An outage in the best region moves sessions to the next one and back."""
+    pool = make_pool(regions)
+    for _ in range(4):
+        await open_session(pool)
+
+    regions["asia-northeast1"].down = True
+    before = regions["us-central1"].connections
+    for _ in range(3):
+        await open_session(pool)
+    assert regions["us-central1"].connections == before + 3
+    assert pool.ranked()[-1] == "asia-northeast1"
+    assert pool.stats["asia-northeast1"].failure_rate > 0
+
+    regions["asia-northeast1"].down = False
+    pool.stats["asia-northeast1"].cooldown_until = 0.0
+    for _ in range(10):
+        await open_session(pool)
+    assert pool.ranked()[0] == "asia-northeast1"
+
+
+@pytest.mark.asyncio
+async def test_slow_region_times_out(regions: Dict[str, LocalLiveServer]) -> None:
+    """A region slower than the connect timeout counts as a failure."""
+    regions["asia-northeast1"].latency = 1.0
+    pool = make_pool(regions, connect_timeout=0.5)
+    for region, stats in pool.stats.items():
+        stats.latency = 0.001 if region == "asia-northeast1" else 0.1
+    await open_session(pool)
+    assert pool.stats["asia-northeast1"].failure_rate > 0
+    assert regions["us-central1"].connections + regions["europe-west4"].connections == 1
+
+
+@pytest.mark.asyncio
+async def test_all_regions_down_raises_last_error(regions: Dict[str, LocalLiveServer]) -> None:
+    for server in regions.values():
+        server.down = True
+    pool = make_pool(regions)
+    with pytest.raises(Exception, match="503"):
+        await open_session(pool)
+
+
+@pytest.mark.asyncio
+async def test_deadline_stops_trying_regions(regions: Dict[str, LocalLiveServer]) -> None:
+    """Once the connect deadline passes, the remaining regions are not tried."""
+    for server in regions.values():
+        server.latency = 1.0
+    pool = make_pool(regions, connect_timeout=0.2)
+    with pytest.raises(asyncio.TimeoutError):
+        async with pool.connect(model="gemini", deadline=0.3):
+            pass
+    assert sum(server.connections for server in regions.values()) == 2
@@ -0,0 +1,84 @@
+import os
+import threading
+import weakref
+from typing import List
+
+import pytest
+
+from app import clients
+from app.clients import LazyClient, initialize_clients
+from tests.fake_live import load_server
+
+
+def test_client_is_created_once_on_first_use() -> None:
+    created: List[object] = []
+
+    def factory() -> object:
+        created.append(object())
+        return created[-1]
+
+    client = LazyClient(factory, "test")
+    assert not client.initialized and created == []
+
+    threads = [threading.Thread(target=client.instance) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert client.instance() is created[0]
+
+
+def test_attributes_are_forwarded() -> None:
+    client = LazyClient(lambda: {"a": 1}, "dict")
+    assert client.get("a") == 1
+    assert client.initialized
+
+
+def test_forked_child_creates_its_own_client() -> None:
+    created: List[int] = []
+
+    def factory() -> int:
+        created.append(os.getpid())
+        return os.getpid()
+
+    client = LazyClient(factory, "test")
+    assert client.instance() == os.getpid()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        fresh = not client.initialized and client.instance() == os.getpid() and len(created) == 2
+        os.write(write, b"1" if fresh else b"0")
+        os._exit(0)
+    os.close(write)
+    result = os.read(read, 1)
+    os.waitpid(pid, 0)
+    os.close(read)
+    assert result == b"1"
+    assert client.instance() == os.getpid()
+    assert len(created) == 1
+
+
+def test_failed_initialization_is_retried_on_use(monkeypatch: pytest.MonkeyPatch) -> None:
+    # アプリのクライアントは作らないよう、このテストのクライアントだけを登録する
+    monkeypatch.setattr(clients, "_clients", weakref.WeakSet())
+    attempts = []
+
+    def factory() -> str:
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("no credentials")
+        return "client"
+
+    client = LazyClient(factory, "flaky")
+    initialize_clients()
+    assert not client.initialized
+    assert client.instance() == "client"
+
+
+def test_importing_the_server_creates_no_client() -> None:
+    server = load_server()
+    for client in (server.firebase_app, server.logger, *server.live_pool.clients.values()):
+        if isinstance(client, LazyClient):
+            assert not client.initialized, client
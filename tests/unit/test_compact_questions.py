@@ -0,0 +1,230 @@
+import datetime
+import random
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+from app.jobs.compact_questions import QuestionCompaction
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+
+tools = load_firestore_tools()
+
+NOW = datetime.datetime(2025, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_db(users: int = 12, questions_per_user: int = 60) -> FakeFirestore:
+    """Seed users whose questions are spread over the last 90 days."""
+    rng = random.Random(3)
+    db = FakeFirestore()
+    for user in range(users):
+        index: Dict[str, str] = {}
+        for question in range(questions_per_user):
+            question_id = f"q{question:03d}"
+            level = rng.randint(1, 3)
+            a, b = rng.randint(1, 4), rng.randint(1, 4)
+            index[f"l{level}_{a}{b}{question}"] = question_id
+            db.seed(
+                f"users/u{user:03d}/mathQuestions/{question_id}",
+                {
+                    "level": level,
+                    "formula": f"{a} + {b} = ?" if rng.random() < 0.5 else f"{a}＋{b}",
+                    "correctCount": rng.randint(0, 3),
+                    "wrongCount": rng.randint(0, 2),
+                    "updatedAt": NOW - datetime.timedelta(days=rng.uniform(0, 90)),
+                },
+            )
+        db.seed(f"users/u{user:03d}", {"name": f"child{user}", "current_level": 3, "questionIndex": index})
+    return db
+
+
+def questions(db: FakeFirestore) -> Dict[str, Dict[str, Any]]:
+    return {
+        f"{path}/{doc_id}": data
+        for path, docs in db._collections.items()
+        if path.endswith("/mathQuestions")
+        for doc_id, data in docs.items()
+    }
+
+
+def level_stats(db: FakeFirestore) -> List[Dict[str, Any]]:
+    return [data for path, docs in db._collections.items() if path.endswith("/levelStats") for data in docs.values()]
+
+
+def level_stats_of(db: FakeFirestore, user_id: str) -> List[Dict[str, Any]]:
+    return list(db.documents(f"users/{user_id}/levelStats").values())
+
+
+def compaction(db: FakeFirestore, tmp_path: Path, **kwargs: Any) -> QuestionCompaction:
+    kwargs.setdefault("batch_size", 7)
+    kwargs.setdefault("users_per_page", 5)
+    return QuestionCompaction(db, str(tmp_path / "checkpoint.json"), retention_days=30, now=NOW, **kwargs)
+
+
+def test_old_questions_roll_up_into_level_stats(tmp_path: Path) -> None:
+    db = make_db()
+    before = questions(db)
+    cutoff = NOW - datetime.timedelta(days=30)
+    old = {path: data for path, data in before.items() if data["updatedAt"] < cutoff}
+
+    result = compaction(db, tmp_path).run()
+
+    after = questions(db)
+    assert result == {"users": 12, "questions": len(old)}
+    assert set(after) == set(before) - set(old)
+    stats = level_stats(db)
+    assert sum(s["questions"] for s in stats) == len(old)
+    assert sum(s["correct"] for s in stats) == sum(d["correctCount"] for d in old.values())
+    assert sum(s["wrong"] for s in stats) == sum(d["wrongCount"] for d in old.values())
+    for s in stats:
+        assert s["accuracy"] == pytest.approx(s["correct"] / (s["correct"] + s["wrong"]))
+        assert 0 < len(s["formulas"]) <= 10
+        # 全角と半角の式は同じ式として数える
+        assert all("＋" not in f["formula"] and "=" not in f["formula"] for f in s["formulas"])
+
+    user = db.data("users/u000")
+    remaining = set(db.documents("users/u000/mathQuestions"))
+    assert set(user["questionIndex"].values()) == remaining
+    assert user["compactedLevels"] == sorted({int(s["level"]) for s in level_stats_of(db, "u000")})
+    assert not (tmp_path / "checkpoint.json").exists()
+
+
+def test_rerun_is_a_no_op(tmp_path: Path) -> None:
+    db = make_db(users=3)
+    compaction(db, tmp_path).run()
+    stats = level_stats(db)
+    assert compaction(db, tmp_path).run() == {"users": 3, "questions": 0}
+    assert level_stats(db) == stats
+
+
+class CrashingBatches:
+    """Wraps a FakeFirestore so that the n-th commit fails."""
+
+    def __init__(self, db: FakeFirestore, fail_at: int) -> None:
+        self._db = db
+        self.commits = 0
+        self.fail_at = fail_at
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._db, name)
+
+    def batch(self) -> Any:
+        batch = self._db.batch()
+        commit = batch.commit
+
+        def failing_commit() -> Any:
+            self.commits += 1
+            if self.commits == self.fail_at:
+                raise RuntimeError("deadline exceeded")
+            return commit()
+
+        batch.commit = failing_commit
+        return batch
+
+
+def test_resumes_after_interruption_without_double_counting(tmp_path: Path) -> None:
+    expected_db = make_db()
+    (tmp_path / "uninterrupted").mkdir()
+    compaction(expected_db, tmp_path / "uninterrupted").run()
+    expected = sorted((s["level"], s["questions"], s["correct"]) for s in level_stats(expected_db))
+
+    db = make_db()
+    crashing = CrashingBatches(db, fail_at=25)
+    with pytest.raises(RuntimeError):
+        compaction(crashing, tmp_path).run()
+    assert (tmp_path / "checkpoint.json").exists()
+
+    compaction(db, tmp_path).run()
+    assert sorted((s["level"], s["questions"], s["correct"]) for s in level_stats(db)) == expected
+    assert questions(db) == questions(expected_db)
+
+
+def test_writes_are_rate_limited(tmp_path: Path) -> None:
+    db = make_db(users=4)
+    now = [0.0]
+    slept: List[float] = []
+
+    def sleep(seconds: float) -> None:
+        slept.append(seconds)
+        now[0] += seconds
+
+    job = compaction(db, tmp_path, writes_per_second=20, clock=lambda: now[0], sleep=sleep)
+    writes_before = db.writes
+    job.run()
+    writes = db.writes - writes_before
+    # 最初の1秒分（20）を超えた書き込みは 20/秒 に均される
+    assert sum(slept) == pytest.approx((writes - 20) / 20, abs=0.5)
+
+
+def test_get_user_data_falls_back_to_level_stats(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    db = FakeFirestore()
+    db.seed("users/u1", {"name": "はなこ", "current_level": 2, "questionIndex": {"l2_x": "q1"}})
+    db.seed(
+        "users/u1/mathQuestions/q1",
+        {"level": 2, "formula": "3 + 2 = ?", "correctCount": 2, "wrongCount": 1,
+         "updatedAt": NOW - datetime.timedelta(days=60)},
+    )
+    compaction(db, tmp_path).run()
+    assert db.documents("users/u1/mathQuestions") == {}
+    assert db.data("users/u1")["questionIndex"] == {}
+
+    monkeypatch.setattr(tools, "db", db)
+    tools._question_indexes.clear()
+    db.reset_counts()
+    user_data = tools.get_user_data("u1")
+    assert user_data["questions"] == [
+        {"level": 2, "formula": "3+2", "correctCount": 2, "wrongCount": 1, "compacted": True}
+    ]
+    # 集約していないレベル1では levelStats を読まない
+    assert db.rpcs == {"get": 2, "query": 2}
+    tools._question_indexes.clear()
+
+
+def seed_old_question(db: FakeFirestore) -> str:
+    fingerprint = tools.question_fingerprint("3 + 2 = ?", 2)
+    db.seed("users/u1", {"name": "はなこ", "current_level": 2, "questionIndex": {fingerprint: "q1"}})
+    db.seed(
+        "users/u1/mathQuestions/q1",
+        {"level": 2, "formula": "3 + 2 = ?", "correctCount": 2, "wrongCount": 1,
+         "updatedAt": NOW - datetime.timedelta(days=60)},
+    )
+    return fingerprint
+
+
+@pytest.mark.asyncio
+async def test_compacted_question_ids_are_not_reused(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    db = FakeFirestore()
+    fingerprint = seed_old_question(db)
+    monkeypatch.setattr(tools, "db", db)
+    tools._question_indexes.clear()
+    # サーバーが指紋インデックスを読み込んだあとで集約される
+    assert tools.add_math_question("u1", "りんごが3こ", "3 + 2 = ?", "5", 2) == {"question_id": "q1"}
+
+    compaction(db, tmp_path, on_compacted=tools.forget_questions).run()
+
+    question_id = tools.add_math_question("u1", "りんごが3こ", "３＋２", "5", 2)["question_id"]
+    assert question_id != "q1"
+    await tools.flush_pending_writes("u1")
+    assert db.data("users/u1")["questionIndex"] == {fingerprint: question_id}
+    assert set(db.documents("users/u1/mathQuestions")) == {question_id}
+    tools._question_indexes.clear()
+
+
+@pytest.mark.asyncio
+async def test_answer_to_a_question_compacted_elsewhere_drops_its_id(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    db = FakeFirestore()
+    seed_old_question(db)
+    monkeypatch.setattr(tools, "db", db)
+    tools._question_indexes.clear()
+    assert tools.add_math_question("u1", "りんごが3こ", "3 + 2 = ?", "5", 2) == {"question_id": "q1"}
+
+    # 別のプロセスで集約された（このプロセスのキャッシュは知らない）
+    compaction(db, tmp_path).run()
+    tools.upsert_math_question_result("u1", "q1", True)
+    await tools.flush_pending_writes("u1")
+
+    assert tools.add_math_question("u1", "りんごが3こ", "3 + 2 = ?", "5", 2)["question_id"] != "q1"
+    await tools.flush_pending_writes("u1")
+    tools._question_indexes.clear()
@@ -0,0 +1,69 @@
+import asyncio
+import base64
+import json
+import os
+import zlib
+
+import pytest
+
+from app.compression import CompressionPolicy, negotiate
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server, tool_call_message
+
+server = load_server()
+
+AUDIO = json.dumps({
+    "serverContent": {"modelTurn": {"parts": [
+        {"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(os.urandom(4800)).decode()}}
+    ]}}
+}).encode()
+TOOL_CALL = json.dumps(tool_call_message(
+    "upsert_math_question_result", user_id="u1", question_id="l3_0123456789ab", is_correct=True,
+    note="りんごが3こあって、2こもらったら、ぜんぶでなんこになるかな？" * 4,
+), ensure_ascii=False).encode()
+
+
+def test_client_must_ask_for_deflate() -> None:
+    assert negotiate(None) is None
+    assert negotiate("gzip") is None
+    assert negotiate("deflate") is not None
+    assert negotiate("gzip, deflate") is not None
+
+
+def test_only_kinds_that_benefit_are_compressed() -> None:
+    policy = CompressionPolicy(kinds=frozenset({"toolCall", "other"}), huffman_kinds=frozenset(), min_bytes=256)
+    compressed = policy.encode(TOOL_CALL, "toolCall")
+    assert compressed[0] == 0x78 and len(compressed) < len(TOOL_CALL)
+    assert zlib.decompress(compressed) == TOOL_CALL
+
+    assert policy.encode(AUDIO, "audio") is AUDIO
+    small = b'{"serverContent":{"turnComplete":true}}'
+    assert policy.encode(small, "other") is small
+    # 縮まなければそのまま送る
+    noise = os.urandom(1000)
+    assert policy.encode(noise, "other") is noise
+
+
+def test_huffman_kinds_recover_the_base64_overhead() -> None:
+    policy = CompressionPolicy(kinds=frozenset(), huffman_kinds=frozenset({"audio"}))
+    compressed = policy.encode(AUDIO, "audio")
+    assert zlib.decompress(compressed) == AUDIO
+    assert len(compressed) < 0.8 * len(AUDIO)
+
+
+@pytest.mark.asyncio
+async def test_relay_compresses_per_message() -> None:
+    live = FakeLiveSession()
+    client = FakeClientWebSocket()
+    policy = CompressionPolicy(kinds=frozenset({"toolCall"}), huffman_kinds=frozenset())
+    session = server.GeminiSession(live, client, {"upsert_math_question_result": lambda **_: None}, compression=policy)
+    task = asyncio.create_task(session.run())
+
+    live._ws.incoming.put_nowait(AUDIO)
+    live._ws.incoming.put_nowait(TOOL_CALL)
+    await asyncio.sleep(0.05)
+    assert client.sent_bytes[0] == AUDIO
+    assert client.sent_bytes[1][0] == 0x78
+    assert zlib.decompress(client.sent_bytes[1]) == TOOL_CALL
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from typing import Any, Dict, Generator, List, Optional
+
+import pytest
+
+from app.connection_setup import CACHED, FRESH, HEDGED, MINIMAL, UserDataLoader
+from app.learner_state import LearnerState
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+USER_DATA = {"name": "はなこ", "current_level": 3, "questions": []}
+
+
+class SlowReads:
+    """A user data read whose successive calls take the given seconds."""
+
+    def __init__(self, *delays: float) -> None:
+        self.delays: List[float] = list(delays)
+        self.calls = 0
+
+    def __call__(self, user_id: str) -> Optional[Dict[str, Any]]:
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        time.sleep(delay)
+        return {**USER_DATA, "delay": delay}
+
+
+@pytest.mark.asyncio
+async def test_fast_read_is_fresh() -> None:
+    loader = UserDataLoader(SlowReads(0.0), deadline=1.0, hedge_after=0.2)
+    user_data, source, late = await loader.load("u1")
+    assert source == FRESH and late is None
+    assert user_data["current_level"] == 3
+
+
+@pytest.mark.asyncio
+async def test_slow_read_is_hedged() -> None:
+    """A second read started after hedge_after wins over a stuck first one."""
+    reads = SlowReads(0.5, 0.0)
+    loader = UserDataLoader(reads, deadline=1.0, hedge_after=0.1)
+    started = time.monotonic()
+    user_data, source, late = await loader.load("u1")
+    assert source == HEDGED and late is None
+    assert user_data["delay"] == 0.0
+    assert time.monotonic() - started < 0.4
+    assert reads.calls == 2
+    # 負けた読み取りもスレッドでは最後まで走る
+    await asyncio.sleep(0.5)
+
+
+
+@pytest.mark.asyncio
+async def test_hedge_after_a_failed_first_read_is_labelled_hedged() -> None:
+    """The source names the read that returned, even after failed reads were dropped."""
+    calls = []
+
+    def fetch(user_id: str) -> Dict[str, Any]:
+        calls.append(user_id)
+        if len(calls) == 1:
+            # ヘッジした読み取りより先に失敗する
+            time.sleep(0.15)
+            raise RuntimeError("deadline exceeded")
+        time.sleep(0.15)
+        return USER_DATA
+
+    loader = UserDataLoader(fetch, deadline=1.0, hedge_after=0.1)
+    user_data, source, late = await loader.load("u1")
+    assert user_data == USER_DATA and len(calls) == 2
+    assert source == HEDGED and late is None
+
+@pytest.mark.asyncio
+async def test_missed_deadline_uses_cached_state() -> None:
+    loader = UserDataLoader(SlowReads(0.4), deadline=0.1, hedge_after=0.0)
+    loader.remember("u1", {"name": "はなこ", "current_level": 2, "questions": []})
+    started = time.monotonic()
+    user_data, source, late = await loader.load("u1")
+    assert time.monotonic() - started < 0.3
+    assert source == CACHED and user_data["current_level"] == 2
+    assert (await late)["current_level"] == 3
+    # 遅れて届いた結果が次の接続のキャッシュになる
+    assert loader._cache["u1"]["current_level"] == 3
+
+
+@pytest.mark.asyncio
+async def test_missed_deadline_without_cache_starts_minimal() -> None:
+    loader = UserDataLoader(SlowReads(0.3), deadline=0.05, hedge_after=0.0)
+    user_data, source, late = await loader.load("u1")
+    assert user_data is None and source == MINIMAL
+    assert (await late)["name"] == "はなこ"
+
+
+@pytest.mark.asyncio
+async def test_failed_read_raises() -> None:
+    def broken(user_id: str) -> None:
+        raise RuntimeError("firestore unavailable")
+
+    loader = UserDataLoader(broken, deadline=1.0, hedge_after=0.1)
+    with pytest.raises(RuntimeError):
+        await loader.load("u1")
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    monkeypatch.setattr(tools, "db", fake)
+    tools._question_indexes.clear()
+    yield fake
+    tools._question_indexes.clear()
+
+
+@pytest.mark.asyncio
+async def test_late_user_data_reaches_the_session(db: FakeFirestore) -> None:
+    """A session started provisionally picks up the user data when it arrives."""
+    late: "asyncio.Future[Optional[Dict[str, Any]]]" = asyncio.get_running_loop().create_future()
+    state = LearnerState.from_user_data("u1", None)
+    state.provisional = True
+    live = FakeLiveSession()
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(live, client, server.tool_functions, learner_state=state, late_user_data=late)
+    task = asyncio.create_task(session.run())
+
+    # 届くまでは Firestore のツールをそのまま使う（仮のレベル1で上書きしない）
+    db.seed("users/u1", {"name": "はなこ", "current_level": 3})
+    response = session._call_tool("increment_user_level", {"user_id": "u1"})
+    assert response["current_level"] == 4
+
+    late.set_result({"name": "はなこ", "current_level": 4, "questions": []})
+    await asyncio.sleep(0.05)
+    assert not state.provisional
+    assert state.name == "はなこ" and state.level == 4
+    text = live._ws.sent[-1]["clientContent"]["turns"][0]["parts"][0]["text"]
+    assert "ユーザー情報が届きました" in text and "'current_level': 4" in text
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
@@ -0,0 +1,192 @@
+import asyncio
+import random
+import signal
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Generator, List
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.client_pool import ClientPool
+from app.drain import DRAIN_CLOSE_CODE, DRAIN_STATUS, Drain
+from app.learner_state import LearnerState
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+READY = "Backend is ready for conversation"
+
+
+class RecordingLive:
+    """A Live API region that records the config of each connect."""
+
+    def __init__(self) -> None:
+        self.aio = self
+        self.live = self
+        self.configs: List[Any] = []
+
+    @asynccontextmanager
+    async def connect(self, model: str, config: Any = None) -> AsyncIterator[FakeLiveSession]:
+        self.configs.append(config)
+        yield FakeLiveSession()
+
+
+class DrainingSession:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.reconnect_after: List[float] = []
+
+    async def drain(self, reconnect_after: float) -> None:
+        self.reconnect_after.append(reconnect_after)
+        await asyncio.sleep(self.delay)
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    fake.seed("users/u1", {"name": "はなこ", "current_level": 3})
+    monkeypatch.setattr(tools, "db", fake)
+    tools._question_indexes.clear()
+    yield fake
+    tools._question_indexes.clear()
+
+
+@pytest.mark.asyncio
+async def test_reconnects_are_spread_over_the_window() -> None:
+    drain = Drain(spread=5, rng=random.Random(1))
+    sessions = [DrainingSession() for _ in range(200)]
+    flushed = []
+
+    async def flush() -> None:
+        flushed.append(True)
+
+    await drain.run(sessions, flush)
+    delays = [session.reconnect_after[0] for session in sessions]
+    assert drain.draining and flushed
+    assert all(0 <= delay <= 5 for delay in delays)
+    # 半分ずつ前後に分かれる（一斉に再接続しない）
+    assert 60 < sum(delay < 2.5 for delay in delays) < 140
+
+
+@pytest.mark.asyncio
+async def test_stuck_session_does_not_hold_the_drain() -> None:
+    drain = Drain(timeout=0.1)
+
+    async def flush() -> None:
+        pass
+
+    started = time.monotonic()
+    await drain.run([DrainingSession(delay=5)], flush)
+    assert time.monotonic() - started < 0.5
+
+
+@pytest.mark.asyncio
+async def test_sigterm_drains_before_the_server_shuts_down() -> None:
+    events: List[str] = []
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: events.append("server"))
+    drain = Drain()
+
+    async def drain_sessions() -> None:
+        events.append("drain")
+
+    try:
+        drain.install(drain_sessions)
+        signal.raise_signal(signal.SIGTERM)
+        signal.raise_signal(signal.SIGTERM)
+        await asyncio.sleep(0.05)
+        drain.uninstall()
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    assert events == ["drain", "server"]
+
+
+@pytest.mark.asyncio
+async def test_drained_session_saves_progress_and_hints_reconnect(
+    db: FakeFirestore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": RecordingLive()}))
+    monkeypatch.setattr(server, "user_data_loader", server.UserDataLoader(tools.get_user_data))
+    # 休止の見張りが relay の終わりをすぐ見つけるようにする
+    monkeypatch.setattr(server, "IDLE_CHECK_INTERVAL_SECONDS", 0.001)
+    client = FakeClientWebSocket()
+    task = asyncio.create_task(server.connect_and_run(client, "u1"))
+    await asyncio.sleep(0.05)
+    assert {"status": READY} in client.sent_json
+    (session,) = [lease.session for lease in server.session_registry.leases.values() if lease.session is not None]
+    session.learner_state.record_result("q1", True)
+    session.learner_state.record_result("q2", True)
+    # 接続が終わった時点で、クライアントに伝わっていたもの
+    seen_when_done: List[Any] = []
+    task.add_done_callback(lambda _: seen_when_done.extend([list(client.sent_json), client.close_code]))
+    written = asyncio.Event()
+
+    async def slow_write() -> None:
+        await asyncio.sleep(0.05)
+        written.set()
+
+    tools._schedule_write("u1", slow_write())
+    draining = asyncio.create_task(session.drain(1.5))
+    await asyncio.sleep(0.01)
+    # 書き込みを待っているあいだも、子供のマイクの音声は届き続ける
+    client.push({"realtimeInput": {"mediaChunks": [{"mimeType": "audio/pcm", "data": "AAAA"}]}})
+    await asyncio.sleep(0.01)
+    assert not task.done()
+
+    await asyncio.wait_for(draining, 1)
+    await asyncio.wait_for(task, 1)
+    assert written.is_set()
+    user_data = tools.get_user_data("u1")
+    assert user_data["session"] == {"streak": 2, "correct": 2, "wrong": 0}
+    sent_json, close_code = seen_when_done
+    assert sent_json[-1] == {"status": DRAIN_STATUS, "reconnectAfterMs": 1500}
+    assert close_code == DRAIN_CLOSE_CODE
+
+
+def test_stale_snapshot_is_ignored(db: FakeFirestore) -> None:
+    db.seed("users/u2", {
+        "name": "たろう", "current_level": 2,
+        "sessionSnapshot": {"streak": 2, "correct": 4, "wrong": 1, "savedAt": time.time() - 3600},
+    })
+    assert "session" not in tools.get_user_data("u2")
+
+
+@pytest.mark.asyncio
+async def test_next_session_continues_from_the_snapshot(db: FakeFirestore, monkeypatch: pytest.MonkeyPatch) -> None:
+    live = RecordingLive()
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": live}))
+    monkeypatch.setattr(server, "user_data_loader", server.UserDataLoader(tools.get_user_data))
+    tools.save_session_snapshot("u1", {"streak": 2, "correct": 2, "wrong": 1})
+
+    client = FakeClientWebSocket()
+    task = asyncio.create_task(server.connect_and_run(client, "u1"))
+    await asyncio.sleep(0.05)
+    assert {"status": READY} in client.sent_json
+    instruction = " ".join(part.text for part in live.configs[0].system_instruction.parts)
+    assert "【お休みからの再開】" in instruction
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
+    await tools.flush_pending_writes("u1")
+    # スナップショットは1回だけ使う
+    assert "session" not in tools.get_user_data("u1")
+
+
+def test_draining_server_refuses_new_sessions(db: FakeFirestore, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(server, "drain", Drain())
+    server.drain.draining = True
+    client = TestClient(server.app)
+
+    with client.websocket_connect("/ws?id_token=u1") as ws:
+        hint = ws.receive_json()
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert hint["status"] == DRAIN_STATUS and 0 <= hint["reconnectAfterMs"] <= 5000
+    assert closed.value.code == DRAIN_CLOSE_CODE
+
+    response = client.post("/session/prefetch", headers={"Authorization": "Bearer u1"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
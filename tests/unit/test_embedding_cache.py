@@ -0,0 +1,146 @@
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from app.embedding_cache import (
+    CachedEmbeddings,
+    EmbeddingBatcher,
+    embedding_cache_lookups,
+    normalize_query,
+)
+from app.metrics import render as render_metrics
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic embedding backend that records every call.
+
+    Like Vertex AI, a text embedded as a query gets a different vector from
+    the same text embedded as a document.
+    """
+
+    def __init__(self) -> None:
+        self.calls: List[List[str]] = []
+        self.task_types: List[Optional[str]] = []
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str, task_type: Optional[str] = "RETRIEVAL_QUERY") -> List[float]:
+        return [float(len(text)), float(sum(map(ord, text)) % 97), float(task_type == "RETRIEVAL_QUERY")]
+
+    def embed(
+        self, texts: List[str], batch_size: int = 0, embeddings_task_type: Optional[str] = None
+    ) -> List[List[float]]:
+        with self._lock:
+            self.calls.append(list(texts))
+            self.task_types.append(embeddings_task_type)
+        return [self._vector(text, embeddings_task_type) for text in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts, embeddings_task_type="RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text], 1, "RETRIEVAL_QUERY")[0]
+
+
+def test_normalize_query() -> None:
+    """Full-width characters, case and whitespace share one cache key."""
+    assert normalize_query("  ３＋２は  いくつ？ ") == normalize_query("3+2は いくつ?")
+    assert normalize_query("MLOps") == "mlops"
+
+
+def test_lru_and_disk_cache(tmp_path: Path) -> None:
+    """Repeated queries hit memory, and a new process hits the disk cache."""
+    backend = FakeEmbeddings()
+    cache_path = str(tmp_path / "cache.sqlite")
+    cached = CachedEmbeddings(backend, cache_path=cache_path, max_entries=1)
+
+    first = cached.embed_query("りんご が 三こ")
+    assert cached.embed_query("りんご  が 三こ") == first
+    cached.embed_query("みかん")
+    # "りんご" was evicted from the LRU but is still on disk
+    assert cached.embed_query("りんご が 三こ") == first
+    stats = cached.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["embed_calls"] == 2
+    cached.close()
+
+    reopened = CachedEmbeddings(backend, cache_path=cache_path)
+    assert reopened.embed_query("みかん") is not None
+    assert reopened.stats()["hit_rate"] == 1.0
+    assert len(backend.calls) == 2
+    reopened.close()
+
+
+def test_batcher_merges_concurrent_requests() -> None:
+    """Concurrent misses from many threads are embedded in a single call."""
+    backend = FakeEmbeddings()
+    batcher = EmbeddingBatcher(backend, max_batch_size=64, max_wait_ms=200)
+    cached = CachedEmbeddings(backend, cache_path=None, batcher=batcher)
+
+    queries = [f"Question {i % 8}" for i in range(32)]
+    barrier = threading.Barrier(len(queries))
+    results = {}
+
+    def worker(index: int, query: str) -> None:
+        barrier.wait()
+        results[index] = cached.embed_query(query)
+
+    threads = [
+        threading.Thread(target=worker, args=(i, q)) for i, q in enumerate(queries)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(backend.calls) == 1
+    # 正規化したキーではなく、聞かれたままの文をクエリとして埋め込む
+    assert sorted(backend.calls[0]) == sorted(set(queries))
+    assert backend.task_types == ["RETRIEVAL_QUERY"]
+    assert all(results[i] == backend._vector(q) for i, q in enumerate(queries))
+    assert results[0] != backend.embed_documents([queries[0]])[0]
+    assert cached.stats()["embed_calls"] == 1
+    cached.close()
+
+
+def test_batcher_dedupes_on_the_normalized_query() -> None:
+    """Phrasings sharing a cache key are embedded once, as first asked."""
+    backend = FakeEmbeddings()
+    batcher = EmbeddingBatcher(backend, max_batch_size=64, max_wait_ms=200)
+
+    futures = [batcher.submit(text) for text in ["Question 1", "question  1", "ＱＵＥＳＴＩＯＮ 1", "Question 2"]]
+    vectors = [future.result(5) for future in futures]
+    batcher.close()
+
+    assert backend.calls == [["Question 1", "Question 2"]]
+    assert vectors[0] == vectors[1] == vectors[2] == backend._vector("Question 1")
+
+
+def test_lookups_are_counted_in_metrics() -> None:
+    """Concurrent lookups are all counted, here and in /metrics."""
+    before = {
+        outcome: embedding_cache_lookups.value(outcome=outcome) for outcome in ("memory_hit", "miss")
+    }
+    cached = CachedEmbeddings(FakeEmbeddings(), cache_path=None)
+    cached.embed_query("りんご")
+    barrier = threading.Barrier(8)
+
+    def worker() -> None:
+        barrier.wait()
+        for _ in range(500):
+            cached.embed_query("りんご")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cached.stats()["memory_hits"] == 4000
+    assert embedding_cache_lookups.value(outcome="memory_hit") - before["memory_hit"] == 4000
+    assert embedding_cache_lookups.value(outcome="miss") - before["miss"] == 1
+    assert "embedding_cache_lookups_total" in render_metrics()
+    cached.close()
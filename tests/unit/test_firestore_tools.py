@@ -0,0 +1,85 @@
+import asyncio
+from typing import Generator
+
+import pytest
+
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+
+tools = load_firestore_tools()
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    """Replace the Firestore client with an in-memory fake."""
+    fake = FakeFirestore()
+    monkeypatch.setattr(tools, "db", fake)
+    tools._question_indexes.clear()
+    yield fake
+    tools._question_indexes.clear()
+
+
+def test_question_fingerprint_normalizes_formula() -> None:
+    """Whitespace, full-width characters and the "= ?" tail are ignored."""
+    assert tools.question_fingerprint("3 + 2 = ?", 1) == tools.question_fingerprint("３＋２＝？", 1)
+    assert tools.question_fingerprint("6 ÷ 2", 3) == tools.question_fingerprint("6/2=", 3)
+    assert tools.question_fingerprint("3 + 2 = ?", 1) != tools.question_fingerprint("3 + 2 = ?", 2)
+
+
+@pytest.mark.asyncio
+async def test_add_math_question_reuses_existing_question(db: FakeFirestore) -> None:
+    """The same formula at the same level is written once per user."""
+    db.seed("users/u1", {"name": "はなこ", "current_level": 1})
+
+    first = tools.add_math_question("u1", "りんごが三こ…", "3 + 2 = ?", "5", 1)
+    await asyncio.sleep(0)
+    second = tools.add_math_question("u1", "みかんが三こ…", "３＋２＝？", "5", 1)
+    await asyncio.sleep(0)
+
+    assert first == second
+    questions = db.documents("users/u1/mathQuestions")
+    assert list(questions) == [first["question_id"]]
+    assert db.data("users/u1")["questionIndex"] == {
+        tools.question_fingerprint("3 + 2", 1): first["question_id"]
+    }
+    assert db.rpcs == {"get": 1, "commit": 1}
+
+    # A fresh process loads the index from the user document
+    tools._question_indexes.clear()
+    db.reset_counts()
+    third = tools.add_math_question("u1", "…", "3+2=?", "5", 1)
+    assert third == first
+    assert db.rpcs == {"get": 1}
+
+
+@pytest.mark.asyncio
+async def test_get_user_data_seeds_question_index(db: FakeFirestore) -> None:
+    """Connecting loads the index so the first question needs no extra read."""
+    db.seed("users/u1", {"name": "たろう", "current_level": 2, "questionIndex": {"l2_x": "q1"}})
+    db.seed("users/u1/mathQuestions/q1", {"level": 2, "formula": "4 + 4 = ?"})
+
+    user_data = tools.get_user_data("u1")
+    assert user_data["current_level"] == 2
+    assert "questionIndex" not in user_data
+    db.reset_counts()
+    result = tools.add_math_question("u1", "…", "5 + 1 = ?", "6", 2)
+    await asyncio.sleep(0)
+    assert db.rpcs == {"commit": 1}
+    assert set(db.documents("users/u1/mathQuestions")) == {"q1", result["question_id"]}
+
+
+@pytest.mark.asyncio
+async def test_reading_user_data_keeps_unwritten_entries(db: FakeFirestore) -> None:
+    """A user data read that overlaps pending writes adds to the cached index instead of replacing it."""
+    db.seed("users/u1", {"name": "はなこ", "current_level": 2, "questionIndex": {"l2_x": "q1"},
+                         "bankCursor": {"2": 1}})
+    tools._bank_cursors.clear()
+    tools.get_user_data("u1")
+    added = tools.add_math_question("u1", "…", "4 + 4 = ?", "8", 2)
+    tools.get_next_question("u1", 2)
+
+    # 書き込みが終わる前に、別のスレッドで読み直す（ヘッジした読み取りなど）
+    await asyncio.to_thread(tools.get_user_data, "u1")
+    assert tools._question_indexes["u1"] == {"l2_x": "q1", tools.question_fingerprint("4+4", 2): added["question_id"]}
+    assert tools._bank_cursors["u1"] == {"2": 2}
+    await tools.flush_pending_writes("u1")
+    tools._bank_cursors.clear()
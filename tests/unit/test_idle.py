@@ -0,0 +1,105 @@
+import asyncio
+import base64
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+
+import numpy as np
+import pytest
+
+from app.idle import audio_rms, is_voiced
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+server = load_server()
+
+
+def audio_message(amplitude: int, samples: int = 320) -> dict:
+    pcm = (np.sin(np.arange(samples) / 5) * amplitude).astype("<i2").tobytes()
+    data = base64.b64encode(pcm).decode()
+    return {"realtimeInput": {"mediaChunks": [{"mimeType": "audio/pcm", "data": data}]}}
+
+
+def test_is_voiced() -> None:
+    """Quiet audio does not count as activity; speech and typed text do."""
+    assert audio_rms("") == 0.0
+    assert not is_voiced(audio_message(50))
+    assert is_voiced(audio_message(8000))
+    assert is_voiced({"clientContent": {"turns": [], "turnComplete": True}})
+
+
+async def wait_until(predicate, timeout: float = 2.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_suspend_when_idle_and_resume_on_speech() -> None:
+    """The upstream session is closed while idle and reopened when the child speaks."""
+    first = FakeLiveSession()
+    reconnected: List[FakeLiveSession] = []
+
+    @asynccontextmanager
+    async def reconnect() -> AsyncIterator[FakeLiveSession]:
+        session = FakeLiveSession()
+        reconnected.append(session)
+        yield session
+
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(
+        first, client, server.tool_functions, reconnect=reconnect, idle_timeout=0.05
+    )
+    task = asyncio.create_task(session.run())
+
+    await wait_until(lambda: session.suspended)
+    assert first._ws.closed
+
+    for _ in range(10):
+        client.push(audio_message(50))
+    client.push(audio_message(8000))
+    await wait_until(lambda: reconnected and not session.suspended)
+
+    sent = reconnected[0]._ws.sent
+    assert 1 < len(sent) <= 1 + server.RESUME_PREROLL_FRAMES + 1
+    assert sent[-1] == audio_message(8000)
+    assert session.connection_seconds_saved > 0
+
+    client.disconnect()
+    await asyncio.wait_for(task, 2)
+
+
+@pytest.mark.asyncio
+async def test_no_suspend_without_reconnect() -> None:
+    """Sessions without a way to reconnect keep their upstream connection."""
+    live = FakeLiveSession()
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(live, client, server.tool_functions, idle_timeout=0.01)
+    task = asyncio.create_task(session.run())
+    await asyncio.sleep(0.05)
+    assert not session.suspended and not live._ws.closed
+    client.disconnect()
+    await asyncio.wait_for(task, 2)
+
+
+@pytest.mark.asyncio
+async def test_upstream_close_ends_the_session() -> None:
+    """Only an idle suspension reconnects; the model closing the session ends it."""
+    live = FakeLiveSession()
+    reconnected: List[FakeLiveSession] = []
+
+    @asynccontextmanager
+    async def reconnect() -> AsyncIterator[FakeLiveSession]:
+        session = FakeLiveSession()
+        reconnected.append(session)
+        yield session
+
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(live, client, server.tool_functions, reconnect=reconnect, idle_timeout=60)
+    task = asyncio.create_task(session.run())
+    live._ws.incoming.put_nowait(None)
+    await asyncio.sleep(0.05)
+    assert not session.suspended
+
+    client.push(audio_message(8000))
+    await asyncio.wait_for(task, 2)
+    assert not reconnected
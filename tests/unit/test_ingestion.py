@@ -0,0 +1,77 @@
+from pathlib import Path
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from app.ingestion import iter_local_documents, refresh_vector_store
+from app.vector_store import get_vector_store
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic embeddings that count how many texts were embedded."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return [[float(len(text)), float(text.count("た")), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def write_doc(path: Path, topics: List[str]) -> None:
+    """Write one ~1500 character paragraph per topic, i.e. one chunk each."""
+    paragraphs = [f"{topic}のおはなし。" + "たしざんをしよう。" * 160 for topic in topics]
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+
+def test_reingest_only_embeds_changes(tmp_path: Path) -> None:
+    """Unchanged chunks are free, edits embed one chunk, removals tombstone."""
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write_doc(docs / "a.md", ["りんご", "みかん", "ぶどう"])
+    write_doc(docs / "b.txt", ["くるま", "でんしゃ"])
+    persist_path = str(tmp_path / "store.json")
+    embedding = CountingEmbeddings()
+
+    first = refresh_vector_store(embedding, iter_local_documents([str(docs)]), persist_path)
+    assert first.chunks_added == 5
+    assert embedding.texts == 5
+
+    second = refresh_vector_store(embedding, iter_local_documents([str(docs)]), persist_path)
+    assert not second.changed
+    assert second.embed_calls == 0
+    assert embedding.texts == 5
+
+    write_doc(docs / "a.md", ["りんご", "みかん", "もも"])
+    (docs / "b.txt").unlink()
+    third = refresh_vector_store(embedding, iter_local_documents([str(docs)]), persist_path)
+    assert third.chunks_added == 1
+    assert third.chunks_tombstoned == 3
+    assert embedding.texts == 6
+
+    write_doc(docs / "b.txt", ["くるま", "でんしゃ"])
+    fourth = refresh_vector_store(embedding, iter_local_documents([str(docs)]), persist_path)
+    assert fourth.chunks_revived == 2
+    assert fourth.embed_calls == 0
+
+    store = get_vector_store(embedding=embedding, urls=[], persist_path=persist_path)
+    assert len(store._texts) == 5
+    assert all("ぶどう" not in text for text in store._texts)
+
+
+def test_get_vector_store_builds_from_local_paths(tmp_path: Path) -> None:
+    """A missing store is built offline from local files."""
+    write_doc(tmp_path / "a.md", ["りんご"])
+    persist_path = str(tmp_path / "store.json")
+    store = get_vector_store(
+        embedding=CountingEmbeddings(),
+        persist_path=persist_path,
+        paths=[str(tmp_path / "a.md")],
+    )
+    docs = store.similarity_search("りんご", k=1)
+    assert docs[0].metadata["source"].endswith("a.md")
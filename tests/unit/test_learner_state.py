@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.learner_state import LearnerState
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server, tool_call_message
+
+tools = load_firestore_tools()
+server = load_server()
+
+
+def test_streak_and_level_up() -> None:
+    """Three correct answers in a row make the child ready to level up."""
+    state = LearnerState.from_user_data("u1", {"name": "はなこ", "current_level": 2, "questions": []})
+    state.record_question("q1", "3 + 2 = ?", 2)
+    for is_correct in (True, False, True, True):
+        state.record_result("q1", is_correct)
+    assert state.streak == 2 and not state.ready_for_level_up
+    state.record_result("q1", True)
+    assert state.ready_for_level_up
+    assert state.level_up() == 3
+    assert state.streak == 0
+    assert state.to_user_data() == {
+        "name": "はなこ",
+        "current_level": 3,
+        "questions": [
+            {"id": "q1", "formula": "3 + 2 = ?", "level": 2, "correctCount": 4, "wrongCount": 1}
+        ],
+    }
+
+
+def test_new_user_has_no_user_data() -> None:
+    """A child without a user document stays new until the name is set."""
+    state = LearnerState.from_user_data("u1", None)
+    assert state.to_user_data() is None
+    state.apply_tool_result("set_user_name", {"user_id": "u1", "name": "たろう"}, {"name": "たろう", "current_level": 1})
+    assert state.to_user_data() == {"name": "たろう", "current_level": 1, "questions": []}
+
+
+@pytest.mark.asyncio
+async def test_session_levels_up_without_reading(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tool calls update the session state and level-up is a single write."""
+    db = FakeFirestore()
+    monkeypatch.setattr(tools, "db", db)
+    db.seed("users/u1", {"name": "はなこ", "current_level": 1})
+    state = LearnerState.from_user_data("u1", tools.get_user_data("u1"))
+    session = server.GeminiSession(
+        FakeLiveSession(), FakeClientWebSocket(), server.tool_functions, learner_state=state
+    )
+
+    question = session._call_tool(
+        "add_math_question",
+        {"user_id": "u1", "question_text": "…", "formula": "1 + 1 = ?", "answer": "2", "level": 1},
+    )
+    for _ in range(3):
+        response = session._call_tool(
+            "upsert_math_question_result",
+            {"user_id": "u1", "question_id": question["question_id"], "is_correct": True},
+        )
+    assert response["streak"] == 3
+    assert response["ready_for_level_up"]
+    await asyncio.sleep(0)
+
+    db.reset_counts()
+    response = session._call_tool("increment_user_level", {"user_id": "u1"})
+    assert response["current_level"] == 2
+    assert response["streak"] == 0
+    assert db.reads == 0
+    assert db.rpcs == {"commit": 1}
+    assert db.data("users/u1")["current_level"] == 2
+
+
+@pytest.mark.asyncio
+async def test_model_sees_the_progress_summary(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The streak and level-up readiness are sent to the model with each result."""
+    db = FakeFirestore()
+    monkeypatch.setattr(tools, "db", db)
+    db.seed("users/u1", {"name": "はなこ", "current_level": 1})
+    state = LearnerState.from_user_data("u1", tools.get_user_data("u1"))
+    live = FakeLiveSession()
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(live, client, server.tool_functions, learner_state=state)
+    task = asyncio.create_task(session.run())
+
+    for i in range(3):
+        live._ws.push(tool_call_message(
+            "upsert_math_question_result", call_id=f"call-{i}", user_id="u1", question_id="q1", is_correct=True
+        ))
+    await asyncio.sleep(0.05)
+    responses = [
+        response
+        for sent in live._ws.sent if "toolResponse" in sent
+        for response in sent["toolResponse"]["functionResponses"]
+    ]
+    assert [response["id"] for response in responses] == ["call-0", "call-1", "call-2"]
+    assert responses[-1]["response"]["streak"] == 3
+    assert responses[-1]["response"]["ready_for_level_up"] is True
+    assert responses[0]["response"]["ready_for_level_up"] is False
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
+    await tools.flush_pending_writes("u1")
@@ -0,0 +1,58 @@
+from pathlib import Path
+from typing import List
+
+from langchain_community.vectorstores import SKLearnVectorStore
+from langchain_core.embeddings import Embeddings
+
+from app.lexical_index import (
+    HybridRetriever,
+    NgramIndex,
+    char_ngrams,
+    load_or_build_index,
+)
+
+TEXTS = [
+    "りんごが三こあります。二こたべると、のこりはいくつかな？",
+    "くるまが五だいとまっています。",
+    "3 + 4 = 7 のけいさんをしよう。",
+    "みかんを八こかいました。",
+]
+
+
+class LengthEmbeddings(Embeddings):
+    """Embeds every text to the same direction, so only BM25 breaks ties."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [1.0, 0.0]
+
+
+def test_char_ngrams_normalizes_digits() -> None:
+    """ASCII and full-width digits map onto the same kanji numeral terms."""
+    assert char_ngrams("3こ") == char_ngrams("３こ") == char_ngrams("三こ")
+    assert "三こ" in char_ngrams("3こ")
+
+
+def test_bm25_ranks_matching_chunk_first() -> None:
+    """Number words and formulas find the chunk that contains them."""
+    index = NgramIndex(TEXTS)
+    assert index.search("三+四", k=2)[0][0] == 2
+    assert index.search("くるま 5だい", k=2)[0][0] == 1
+    assert index.search("ZZZ", k=2) == []
+
+
+def test_hybrid_retriever(tmp_path: Path) -> None:
+    """The retriever reranks lexical candidates and persists its index."""
+    store = SKLearnVectorStore.from_texts(TEXTS, embedding=LengthEmbeddings())
+    index_path = str(tmp_path / "index.pkl")
+    index = load_or_build_index(store, index_path)
+    assert load_or_build_index(store, index_path).fingerprint == index.fingerprint
+
+    retriever = HybridRetriever(vector_store=store, index=index, k=1)
+    docs = retriever.invoke("みかん 8こ")
+    assert docs[0].page_content == TEXTS[3]
+    assert "id" in docs[0].metadata
+    # No lexical match at all falls back to plain vector search
+    assert len(retriever.invoke("ZZZ")) == 1
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.loop_monitor import LoopMonitor
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+server = load_server()
+
+
+def slow_tool(**_: object) -> dict:
+    time.sleep(0.3)
+    return {}
+
+
+@pytest.mark.asyncio
+async def test_blocking_tool_is_attributed_to_call_site() -> None:
+    """A tool blocking the loop is reported at the relay line that called it."""
+    monitor = LoopMonitor(threshold=0.02, interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    session = server.GeminiSession(FakeLiveSession(), FakeClientWebSocket(), {"slow": slow_tool})
+    session._call_tool("slow", {})
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    snapshot = monitor.snapshot()
+    assert snapshot["lag_seconds"]["max"] >= 0.2
+    worst = snapshot["offenders"][0]
+    assert worst["site"].startswith("app/server.py:")
+    assert worst["site"].endswith(" _call_tool")
+    assert worst["episodes"] == 1
+    assert 0.15 <= worst["blocked_seconds"] <= 0.35
+    assert any("slow_tool" in line for line in worst["stack"])
+
+
+@pytest.mark.asyncio
+async def test_no_offenders_when_loop_is_responsive() -> None:
+    monitor = LoopMonitor(threshold=0.05, interval=0.01)
+    monitor.start()
+    for _ in range(20):
+        await asyncio.sleep(0.005)
+    await monitor.stop()
+    assert monitor.snapshot()["offenders"] == []
+    assert monitor.recent_lags
+
+
+def test_ops_endpoints_need_the_ops_token(monkeypatch: pytest.MonkeyPatch) -> None:
+    """/metrics and /debug/* are hidden without OPS_TOKEN and need it as a bearer token."""
+    client = TestClient(server.app)
+    paths = ["/metrics", "/debug/regions", "/debug/loop"]
+    monkeypatch.setattr(server, "OPS_TOKEN", "")
+    assert all(client.get(path).status_code == 404 for path in paths)
+
+    monkeypatch.setattr(server, "OPS_TOKEN", "s3cret")
+    assert all(client.get(path).status_code == 401 for path in paths)
+    assert client.get("/debug/loop", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    headers = {"Authorization": "Bearer s3cret"}
+    assert all(client.get(path, headers=headers).status_code == 200 for path in paths)
@@ -0,0 +1,120 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from app.client_pool import ClientPool
+from app.metering import SessionMeter, UsageLedger, read_ledger
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveRegion, FakeLiveSession, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+# 0.5 秒分の 16kHz の音声と、1 秒分の 24kHz の音声
+CLIENT_AUDIO = {
+    "realtimeInput": {
+        "mediaChunks": [{"mimeType": "audio/pcm", "data": base64.b64encode(bytes(16000)).decode()}]
+    }
+}
+MODEL_AUDIO = {
+    "serverContent": {
+        "modelTurn": {"parts": [{"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(bytes(48000)).decode()}}]}
+    }
+}
+USAGE = {"usageMetadata": {"promptTokenCount": 120, "responseTokenCount": 30, "totalTokenCount": 150}}
+HOUR = 1_760_000_000.0
+
+
+def test_meter_counts_audio_video_and_tokens() -> None:
+    meter = SessionMeter("u1")
+    meter.count_up(CLIENT_AUDIO, 21400)
+    meter.count_up({"realtimeInput": {"mediaChunks": [{"mimeType": "image/jpeg", "data": "AAAA"}]}}, 100)
+    meter.count_down(json.dumps(MODEL_AUDIO).encode())
+    meter.count_down(json.dumps(USAGE).encode())
+
+    usage = meter.take()
+    assert usage["up_frames"] == 2 and usage["down_frames"] == 2
+    assert usage["audio_in_seconds"] == pytest.approx(0.5, rel=0.01)
+    assert usage["audio_out_seconds"] == pytest.approx(1.0, rel=0.01)
+    assert usage["video_frames"] == 1
+    assert usage["total_tokens"] == 150
+    assert meter.take()["up_frames"] == 0
+
+
+def test_meter_counts_usage_sent_with_audio() -> None:
+    """Usage metadata on the last audio message of a turn is counted too."""
+    meter = SessionMeter("u1")
+    meter.count_down(json.dumps({**MODEL_AUDIO, **USAGE}).encode())
+    usage = meter.take()
+    assert usage["audio_out_seconds"] == pytest.approx(1.0, rel=0.01)
+    assert usage["total_tokens"] == 150
+
+
+def test_ledger_rolls_up_per_uid_and_hour(tmp_path) -> None:
+    """Flushes append deltas per uid and hour, and closed meters are dropped."""
+    ledger = UsageLedger(str(tmp_path / "usage.jsonl"))
+    first, second, other = ledger.open_meter("u1"), ledger.open_meter("u1"), ledger.open_meter("u2")
+    for meter in (first, second, other):
+        meter.count_up(CLIENT_AUDIO, 1000)
+    assert ledger.flush(HOUR) == 2
+
+    first.count_down(json.dumps(USAGE).encode())
+    ledger.close_meter(first)
+    ledger.close_meter(other)
+    assert ledger.flush(HOUR + 10) == 1
+    assert ledger.meters == {second}
+    assert ledger.flush(HOUR + 3600) == 0
+
+    with open(ledger.path, encoding="utf-8") as f:
+        totals = read_ledger(f)
+    [(uid, hour)] = [key for key in totals if key[0] == "u1"]
+    assert totals[(uid, hour)]["sessions"] == 2
+    assert totals[(uid, hour)]["up_bytes"] == 2000
+    assert totals[(uid, hour)]["total_tokens"] == 150
+
+
+@pytest.mark.asyncio
+async def test_session_meters_relayed_frames(tmp_path) -> None:
+    ledger = UsageLedger(str(tmp_path / "usage.jsonl"))
+    client = FakeClientWebSocket()
+    live = FakeLiveSession()
+    meter = ledger.open_meter("u1")
+    session = server.GeminiSession(live, client, server.tool_functions, meter=meter)
+    task = asyncio.create_task(session.run())
+    client.push(CLIENT_AUDIO)
+    live._ws.push(MODEL_AUDIO)
+    live._ws.push(USAGE)
+    await asyncio.sleep(0.01)
+    client.disconnect()
+    await asyncio.wait_for(task, 2)
+
+    assert meter.closed
+    [entry] = ledger.collect()
+    assert entry["up_frames"] == 1 and entry["down_frames"] == 2
+    assert entry["prompt_tokens"] == 120
+
+
+@pytest.mark.asyncio
+async def test_connections_are_metered(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """connect_and_run opens a meter for each session on the server's ledger."""
+    region = FakeLiveRegion()
+    ledger = UsageLedger(str(tmp_path / "usage.jsonl"))
+    monkeypatch.setattr(tools, "db", FakeFirestore())
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": region}))
+    monkeypatch.setattr(server, "usage_ledger", ledger)
+
+    client = FakeClientWebSocket()
+    task = asyncio.create_task(server.connect_and_run(client, "u1"))
+    await asyncio.sleep(0.05)
+    client.push(CLIENT_AUDIO)
+    region.sessions[0]._ws.push(USAGE)
+    await asyncio.sleep(0.05)
+    client.disconnect()
+    await asyncio.wait_for(task, 2)
+
+    [entry] = ledger.collect()
+    assert entry["uid"] == "u1" and entry["sessions"] == 1
+    assert entry["up_frames"] == 1 and entry["total_tokens"] == 150
+    assert not ledger.meters
@@ -0,0 +1,140 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Generator, List
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.client_pool import ClientPool
+from app.prefetch import TICKET_REJECTED_STATUS, PrefetchTickets
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+READY = "Backend is ready for conversation"
+
+
+class RecordingLive:
+    """A Live API region that records the config of each connect."""
+
+    def __init__(self) -> None:
+        self.aio = self
+        self.live = self
+        self.configs: List[Any] = []
+
+    @asynccontextmanager
+    async def connect(self, model: str, config: Any = None) -> AsyncIterator[FakeLiveSession]:
+        self.configs.append(config)
+        yield FakeLiveSession()
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    fake.seed("users/u1", {"name": "はなこ", "current_level": 3})
+    monkeypatch.setattr(tools, "db", fake)
+    tools._question_indexes.clear()
+    yield fake
+    tools._question_indexes.clear()
+
+
+def test_ticket_proves_the_uid_until_it_expires() -> None:
+    now = [1000.0]
+    tickets = PrefetchTickets(secret="s", ttl=30, clock=lambda: now[0])
+    ticket = tickets.issue("u1", {"name": "はなこ"}, config="config")
+
+    prepared = tickets.redeem(ticket)
+    assert prepared.user_id == "u1" and prepared.config == "config"
+    # 用意したものは1回だけ使う。2回目は uid だけ
+    again = tickets.redeem(ticket)
+    assert again.user_id == "u1" and again.config is None
+
+    now[0] += 31
+    assert tickets.redeem(ticket) is None
+
+
+def test_tampered_or_foreign_ticket_is_rejected() -> None:
+    tickets = PrefetchTickets(secret="s")
+    payload, _, signature = tickets.issue("u1", None, config="config").partition(".")
+    other_uid = tickets.issue("u2", None, config="config").partition(".")[0]
+    assert tickets.redeem(f"{other_uid}.{signature}") is None
+    assert tickets.redeem("garbage") is None
+    assert tickets.redeem(f"{payload}.ｓｉｇ") is None
+    assert PrefetchTickets(secret="other").redeem(f"{payload}.{signature}") is None
+    # 同じ鍵を持つ別のワーカーは uid だけ信頼する
+    other_worker = PrefetchTickets(secret="s").redeem(f"{payload}.{signature}")
+    assert other_worker.user_id == "u1" and other_worker.config is None
+
+
+def test_expired_entries_are_dropped_when_issuing() -> None:
+    now = [0.0]
+    tickets = PrefetchTickets(secret="s", ttl=10, maxsize=3, clock=lambda: now[0])
+    for i in range(3):
+        tickets.issue(f"u{i}", None, config="config")
+    tickets.issue("u3", None, config="config")
+    assert len(tickets._prepared) == 3
+    now[0] = 20
+    tickets.issue("u4", None, config="config")
+    assert len(tickets._prepared) == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetched_session_skips_the_user_data_read(
+    db: FakeFirestore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    live = RecordingLive()
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": live}))
+    config = server.get_live_connect_config("u1", {"name": "はなこ", "current_level": 3, "questions": []})
+    tickets = PrefetchTickets(secret="s")
+    prepared = tickets.redeem(tickets.issue("u1", {"name": "はなこ", "current_level": 3, "questions": []}, config))
+
+    db.reset_counts()
+    client = FakeClientWebSocket()
+    task = asyncio.create_task(server.connect_and_run(client, "u1", prepared))
+    await asyncio.sleep(0.05)
+    assert {"status": READY} in client.sent_json
+    assert live.configs == [config]
+    assert db.total_rpcs == 0
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
+
+
+def test_prefetch_endpoint_issues_a_ticket_for_ws(db: FakeFirestore, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": RecordingLive()}))
+    client = TestClient(server.app)
+
+    with patch.object(server, "verify_id_token", side_effect=lambda token: {"uid": token}) as verify:
+        assert client.post("/session/prefetch").status_code == 401
+        response = client.post("/session/prefetch", headers={"Authorization": "Bearer u1"})
+        assert response.status_code == 200
+        assert response.json()["expires_in"] == server.prefetch_tickets.ttl
+        ticket = response.json()["ticket"]
+
+        verify.reset_mock()
+        db.reset_counts()
+        with client.websocket_connect(f"/ws?ticket={ticket}") as ws:
+            assert ws.receive_json() == {"status": READY}
+        verify.assert_not_called()
+        assert db.total_rpcs == 0
+
+        with client.websocket_connect("/ws?ticket=garbage") as ws:
+            assert ws.receive_json() == {"status": TICKET_REJECTED_STATUS}
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_json()
+        assert closed.value.code == 1008
+
+        # ID トークンも送ってくれば、チケットが使えなくてもそのまま始められる
+        with client.websocket_connect("/ws?ticket=garbage&id_token=u1") as ws:
+            assert ws.receive_json() == {"status": READY}
+        verify.assert_called_once_with("u1")
+
+
+def test_cloud_run_requires_a_shared_secret() -> None:
+    with pytest.raises(RuntimeError):
+        PrefetchTickets(secret="", require_secret=True)
+    assert PrefetchTickets(secret="s", require_secret=True).redeem("garbage") is None
@@ -0,0 +1,145 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Generator
+
+import pytest
+
+from app.learner_state import LearnerState
+from app.question_bank import QUESTION_BANK_PATH, QuestionBank, build_bank, save_bank
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server, tool_call_message
+
+tools = load_firestore_tools()
+server = load_server()
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    fake.seed("users/u1", {"name": "はなこ", "current_level": 2})
+    monkeypatch.setattr(tools, "db", fake)
+    tools._question_indexes.clear()
+    tools._bank_cursors.clear()
+    yield fake
+    tools._question_indexes.clear()
+    tools._bank_cursors.clear()
+
+
+def test_committed_bank_matches_the_generator(tmp_path: Path) -> None:
+    """The artifact is reproducible; rebuild it with app.jobs.build_question_bank."""
+    path = tmp_path / "bank.json"
+    save_bank(build_bank(), str(path))
+    assert path.read_text(encoding="utf-8") == Path(QUESTION_BANK_PATH).read_text(encoding="utf-8")
+    assert json.loads(path.read_text(encoding="utf-8")) == build_bank()
+
+
+def test_items_are_correct_and_keyed_by_fingerprint() -> None:
+    bank = build_bank()
+    for level, columns in bank["levels"].items():
+        assert len(set(columns["ids"])) == len(columns["ids"]) > 0
+        for question_id, formula, answer in zip(columns["ids"], columns["formulas"], columns["answers"]):
+            expression = formula.removesuffix(" = ?").replace("×", "*")
+            assert int(answer) == eval(expression)  # pylint: disable=eval-used
+            assert int(answer) >= 0
+            assert question_id == tools.question_fingerprint(formula, int(level))
+
+
+def test_each_child_sees_every_item_before_a_repeat() -> None:
+    bank = QuestionBank(build_bank())
+    size = bank.level_size(3)
+    walk = [bank.nth_for("u1", 3, n)["question_id"] for n in range(size)]
+    assert len(set(walk)) == size
+    assert bank.nth_for("u1", 3, size) == bank.nth_for("u1", 3, 0)
+    assert walk != [bank.nth_for("u2", 3, n)["question_id"] for n in range(size)]
+    # 用意したレベルより上では一番上のレベルの問題を出す
+    assert bank.nth_for("u1", 99, 0)["level"] == bank.max_level
+
+
+@pytest.mark.asyncio
+async def test_next_question_stores_ids_and_results_only(db: FakeFirestore) -> None:
+    tools.get_user_data("u1")
+    db.reset_counts()
+
+    first = tools.get_next_question("u1", 2)
+    second = tools.get_next_question("u1", 2)
+    await tools.flush_pending_writes("u1")
+
+    assert first["question_id"] != second["question_id"]
+    assert first["question_text"] and first["answer"]
+    # セッション開始時に読んだユーザードキュメントを使うので、読み取りはない
+    assert db.reads == 0
+    stored = db.data(f"users/u1/mathQuestions/{first['question_id']}")
+    assert set(stored) == {"level", "correctCount", "wrongCount", "createdAt", "updatedAt"}
+    assert db.data("users/u1")["bankCursor"] == {"2": 2}
+
+    tools.upsert_math_question_result("u1", first["question_id"], True)
+    await tools.flush_pending_writes("u1")
+    assert db.data(f"users/u1/mathQuestions/{first['question_id']}")["correctCount"] == 1
+
+
+
+@pytest.mark.asyncio
+async def test_bank_item_reaches_the_model(db: FakeFirestore) -> None:
+    """The model reads the question it should ask from the tool response."""
+    state = LearnerState.from_user_data("u1", tools.get_user_data("u1"))
+    live = FakeLiveSession()
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(live, client, server.tool_functions, learner_state=state)
+    task = asyncio.create_task(session.run())
+
+    live._ws.push(tool_call_message("get_next_question", call_id="call-7", user_id="u1", level=2))
+    await asyncio.sleep(0.05)
+    (message,) = [sent for sent in live._ws.sent if "toolResponse" in sent]
+    (function_response,) = message["toolResponse"]["functionResponses"]
+    item = QuestionBank.load().get(function_response["response"]["question_id"])
+    assert function_response["id"] == "call-7" and function_response["name"] == "get_next_question"
+    assert function_response["response"]["question_text"] == item["question_text"]
+    assert function_response["response"]["answer"] == item["answer"]
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
+    await tools.flush_pending_writes("u1")
+
+@pytest.mark.asyncio
+async def test_next_question_continues_in_another_process(db: FakeFirestore) -> None:
+    asked = [tools.get_next_question("u1", 1)["question_id"] for _ in range(3)]
+    await tools.flush_pending_writes("u1")
+
+    tools._question_indexes.clear()
+    tools._bank_cursors.clear()
+    db.reset_counts()
+    following = tools.get_next_question("u1", 1)
+    assert following["question_id"] not in asked
+    assert db.rpcs == {"get": 1}
+    await tools.flush_pending_writes("u1")
+
+
+@pytest.mark.asyncio
+async def test_repeated_item_keeps_its_results(db: FakeFirestore) -> None:
+    size = tools.question_bank.level_size(1)
+    db.seed("users/u1", {"name": "はなこ", "current_level": 1, "bankCursor": {"1": size}})
+    first = tools.question_bank.nth_for("u1", 1, 0)
+    db.seed(f"users/u1/mathQuestions/{first['question_id']}", {"level": 1, "correctCount": 2, "wrongCount": 1})
+
+    assert tools.get_next_question("u1", 1)["question_id"] == first["question_id"]
+    await tools.flush_pending_writes("u1")
+    stored = db.data(f"users/u1/mathQuestions/{first['question_id']}")
+    assert (stored["correctCount"], stored["wrongCount"]) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_user_data_resolves_bank_formulas(db: FakeFirestore) -> None:
+    item = tools.get_next_question("u1", 2)
+    await tools.flush_pending_writes("u1")
+    user_data = tools.get_user_data("u1")
+    assert [q["formula"] for q in user_data["questions"]] == [item["formula"]]
+
+
+def test_learner_state_records_bank_questions() -> None:
+    state = LearnerState("u1", name="はなこ", level=2)
+    item = QuestionBank(build_bank()).nth_for("u1", 2, 0)
+    response = state.apply_tool_result("get_next_question", {"user_id": "u1", "level": 2}, item)
+    assert response["question_text"] == item["question_text"]
+    assert response["asked_this_session"] == 1
+    assert state.asked[item["question_id"]]["formula"] == item["formula"]
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from app import rate_limit
+from app.rate_limit import InboundLimiter, TokenBucket, frame_kind
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+server = load_server()
+
+AUDIO = {"realtimeInput": {"mediaChunks": [{"mimeType": "audio/pcm", "data": "AAAA"}]}}
+VIDEO = {"realtimeInput": {"mediaChunks": [{"mimeType": "image/jpeg", "data": "AAAA"}]}}
+CONTENT = {"clientContent": {"turns": [], "turnComplete": True}}
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_refills() -> None:
+    """A bucket allows its burst at once, then refills at its rate."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    for _ in range(3):
+        assert bucket.available()
+        bucket.take()
+    assert not bucket.available()
+    assert bucket.delay_for() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.available()
+
+
+def test_frame_kind() -> None:
+    assert frame_kind(AUDIO) == "audio"
+    assert frame_kind(VIDEO) == "video"
+    assert frame_kind(CONTENT) == "clientContent"
+
+
+@pytest.mark.asyncio
+async def test_uid_budget_is_shared_between_connections() -> None:
+    """Two tabs of the same child share the per-uid budget."""
+    clock = FakeClock()
+    first = InboundLimiter("shared", clock)
+    second = InboundLimiter("shared", clock)
+    assert first.user_budget is second.user_budget
+    burst = int(rate_limit.USER_BUDGETS["video"][1])
+    admitted = [await limiter.admit(VIDEO) for limiter in [first, second] * burst]
+    assert admitted.count(True) == burst
+    dropped = rate_limit.inbound_frames.value(kind="video", outcome="dropped")
+    assert dropped >= burst
+
+
+@pytest.mark.asyncio
+async def test_client_content_is_delayed_not_dropped() -> None:
+    """Typed turns over budget wait for a token instead of being dropped."""
+    limiter = InboundLimiter("typist")
+    for _ in range(int(rate_limit.CONNECTION_BUDGETS["clientContent"][1])):
+        assert await limiter.admit(CONTENT)
+    before = rate_limit.inbound_frames.value(kind="clientContent", outcome="delayed")
+    assert await limiter.admit(CONTENT)
+    assert rate_limit.inbound_frames.value(kind="clientContent", outcome="delayed") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_flooding_client_does_not_starve_others() -> None:
+    """A client flooding audio is capped and the other session keeps relaying."""
+    sessions = []
+    for user_id in ("flooder", "polite"):
+        client = FakeClientWebSocket()
+        live = FakeLiveSession()
+        session = server.GeminiSession(
+            live, client, server.tool_functions, limiter=InboundLimiter(user_id)
+        )
+        sessions.append((client, live, asyncio.create_task(session.run())))
+    (flooder, flooder_live, _), (polite, polite_live, _) = sessions
+
+    for _ in range(5000):
+        flooder.push(AUDIO)
+    for _ in range(5):
+        polite.push(AUDIO)
+    await asyncio.sleep(0.05)
+
+    assert len(flooder_live._ws.sent) <= rate_limit.CONNECTION_BUDGETS["audio"][1] + 2
+    assert len(polite_live._ws.sent) == 5
+
+    for client, _, task in sessions:
+        client.disconnect()
+        await asyncio.wait_for(task, 2)
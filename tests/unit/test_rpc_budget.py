@@ -0,0 +1,131 @@
+"""Firestore round trips per conversation phase.
+
+Each scenario scripts the tool calls of a real conversation against the
+counting FakeFirestore and checks them against a budget. A change that adds
+round trips fails here; a change that removes some should lower the budget.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Generator
+
+import pytest
+
+from app.client_pool import ClientPool
+from app.session_registry import FirestoreLeaseBackend, SessionRegistry
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveRegion, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+# フェーズごとの RPC の上限（種類ごと）。接続にはセッションのリースを取るトランザクションも含む
+LEASE = {"begin_transaction": 1, "get": 1, "commit": 1}
+BUDGETS: Dict[str, Dict[str, int]] = {
+    "connect_new_user": {**LEASE, "get": 2},
+    "name_setup": {"commit": 1},
+    "ten_questions": {"commit": 20},
+    "level_up": {"commit": 1},
+    "connect_returning_user": {**LEASE, "get": 2, "query": 2},
+    "repeated_question": {"commit": 1},
+}
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    monkeypatch.setattr(tools, "db", fake)
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": FakeLiveRegion()}))
+    monkeypatch.setattr(server, "session_registry", SessionRegistry(FirestoreLeaseBackend(fake)))
+    monkeypatch.setattr(server, "user_data_loader", server.user_data_loader)
+    tools._question_indexes.clear()
+    yield fake
+    tools._question_indexes.clear()
+
+
+async def assert_within_budget(db: FakeFirestore, phase: str) -> None:
+    await tools.flush_pending_writes()
+    budget = BUDGETS[phase]
+    over = {
+        kind: count for kind, count in db.rpcs.items() if count > budget.get(kind, 0)
+    }
+    assert not over, f"{phase}: {db.rpcs} exceeds budget {budget}"
+    db.reset_counts()
+
+
+@asynccontextmanager
+async def connect(user_id: str) -> AsyncIterator["server.GeminiSession"]:
+    """Open a session through connect_and_run, as a new process would, and yield its relay."""
+    # 別のプロセスからの接続なので、前回の接続で覚えたユーザー情報は使わない
+    server.user_data_loader = server.UserDataLoader(tools.get_user_data)
+    client = FakeClientWebSocket()
+    task = asyncio.create_task(server.connect_and_run(client, user_id))
+    while {"status": "Backend is ready for conversation"} not in client.sent_json:
+        assert not task.done(), task.exception()
+        await asyncio.sleep(0.01)
+    try:
+        yield server.session_registry.leases[user_id].session
+    finally:
+        client.disconnect()
+        await asyncio.wait_for(task, 2)
+
+
+def ask(session: "server.GeminiSession", formula: str, level: int, is_correct: bool) -> str:
+    user_id = session.learner_state.user_id
+    question = session._call_tool(
+        "add_math_question",
+        {"user_id": user_id, "question_text": "…", "formula": formula, "answer": "?", "level": level},
+    )
+    session._call_tool(
+        "upsert_math_question_result",
+        {"user_id": user_id, "question_id": question["question_id"], "is_correct": is_correct},
+    )
+    return question["question_id"]
+
+
+@pytest.mark.asyncio
+async def test_first_conversation(db: FakeFirestore) -> None:
+    """A new child: connect, name setup, ten questions and a level-up."""
+    async with connect("u1") as session:
+        await assert_within_budget(db, "connect_new_user")
+
+        session._call_tool("set_user_name", {"user_id": "u1", "name": "はなこ"})
+        await assert_within_budget(db, "name_setup")
+
+        for i in range(10):
+            ask(session, f"{i} + 1 = ?", 1, is_correct=i != 3)
+        await assert_within_budget(db, "ten_questions")
+        assert session.learner_state.ready_for_level_up
+
+        session._call_tool("increment_user_level", {"user_id": "u1"})
+        await assert_within_budget(db, "level_up")
+
+    questions = db.documents("users/u1/mathQuestions")
+    assert len(questions) == 10
+    assert sum(q["correctCount"] for q in questions.values()) == 9
+    assert sum(q["wrongCount"] for q in questions.values()) == 1
+    assert db.data("users/u1")["current_level"] == 2
+
+
+@pytest.mark.asyncio
+async def test_returning_conversation(db: FakeFirestore) -> None:
+    """A returning child reconnects in a new process and repeats a question."""
+    async with connect("u1") as first:
+        first._call_tool("set_user_name", {"user_id": "u1", "name": "たろう"})
+        for _ in range(2):
+            first._call_tool("increment_user_level", {"user_id": "u1"})
+        question_id = ask(first, "2 + 2 = ?", 3, is_correct=True)
+        ask(first, "4 - 1 = ?", 2, is_correct=False)
+    await tools.flush_pending_writes()
+    tools._question_indexes.clear()
+    db.reset_counts()
+
+    async with connect("u1") as session:
+        await assert_within_budget(db, "connect_returning_user")
+        assert session.learner_state.level == 3
+        assert [q["formula"] for q in session.learner_state.previous_questions] == ["2 + 2 = ?", "4 - 1 = ?"]
+
+        # The same formula reuses the stored question: only the result is written
+        assert ask(session, "２＋２＝？", 3, is_correct=True) == question_id
+        await assert_within_budget(db, "repeated_question")
+    assert db.data(f"users/u1/mathQuestions/{question_id}")["correctCount"] == 2
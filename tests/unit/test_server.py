@@ -52,15 +52,23 @@ def mock_google_auth_default() -> Generator[None, None, None]:
 
 
 @pytest.fixture(autouse=True)
-def mock_dependencies() -> Generator[None, None, None]:
+def mock_dependencies(
+    mock_google_cloud_credentials: None, mock_google_auth_default: None
+) -> Generator[None, None, None]:
     """
     Mock Vertex AI dependencies for testing.
-    Patches genai client and tool functions.
+    Patches genai client, tool functions, ID token verification and Firestore.
     """
-    with patch("app.server.genai_client") as mock_genai, patch(
+    from app.client_pool import ClientPool
+    from tests.fake_firestore import FakeFirestore
+
+    mock_genai = MagicMock()
+    mock_genai.aio.live.connect = AsyncMock()
+    with patch("app.server.live_pool", ClientPool({"test-region": mock_genai})), patch(
         "app.server.tool_functions"
-    ) as mock_tools:
-        mock_genai.aio.live.connect = AsyncMock()
+    ) as mock_tools, patch(
+        "app.server.verify_id_token", return_value={"uid": "test-user"}
+    ), patch("app.tools.firestore.db", FakeFirestore()):
         mock_tools.return_value = {}
         yield
 
@@ -90,7 +98,10 @@ async def test_websocket_endpoint() -> None:
         None,  # Add None to trigger StopAsyncIteration after first message
     ]
 
-    with patch("app.server.genai_client") as mock_genai:
+    from app.client_pool import ClientPool
+
+    mock_genai = MagicMock()
+    with patch("app.server.live_pool", ClientPool({"test-region": mock_genai})):
         mock_genai.aio.live.connect.return_value.__aenter__.return_value = mock_session
         client = TestClient(app)
         with client.websocket_connect("/ws") as websocket:
@@ -133,7 +144,10 @@ async def test_websocket_error_handling() -> None:
     """Test websocket error handling."""
     from app.server import app
 
-    with patch("app.server.genai_client") as mock_genai:
+    from app.client_pool import ClientPool
+
+    mock_genai = MagicMock()
+    with patch("app.server.live_pool", ClientPool({"test-region": mock_genai})):
         mock_genai.aio.live.connect.side_effect = Exception("Connection failed")
 
         client = TestClient(app)
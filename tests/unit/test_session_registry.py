@@ -0,0 +1,154 @@
+import asyncio
+from typing import Tuple
+
+import pytest
+
+from app.session_registry import FirestoreLeaseBackend, InMemoryLeaseBackend, SessionRegistry
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server
+
+tools = load_firestore_tools()
+server = load_server()
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def start_session(user_id: str) -> Tuple[object, FakeClientWebSocket, asyncio.Task]:
+    state = server.LearnerState.from_user_data(user_id, {"name": "はなこ", "current_level": 1})
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(
+        FakeLiveSession(), client, server.tool_functions, learner_state=state
+    )
+    return session, client, asyncio.create_task(session.run())
+
+
+@pytest.mark.asyncio
+async def test_in_memory_lease_newest_wins() -> None:
+    clock = FakeClock()
+    backend = InMemoryLeaseBackend(clock)
+    assert await backend.acquire("u1", "a", ttl=30) is None
+    assert await backend.acquire("u1", "b", ttl=30) == "a"
+    assert await backend.renew({"u1": "a"}, ttl=30) == set()
+    assert await backend.renew({"u1": "b"}, ttl=30) == {"u1"}
+    await backend.release("u1", "a")
+    assert backend.leases["u1"][0] == "b"
+    clock.now += 60
+    assert await backend.acquire("u1", "c", ttl=30) is None
+
+
+@pytest.mark.asyncio
+async def test_local_takeover_flushes_writes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A second tab closes the first one after its pending writes are done."""
+    db = FakeFirestore()
+    monkeypatch.setattr(tools, "db", db)
+    tools._question_indexes.clear()
+    registry = SessionRegistry(InMemoryLeaseBackend())
+
+    first_lease = await registry.register("u1")
+    old_session, old_client, old_task = start_session("u1")
+    assert registry.attach(first_lease, old_session)
+    question = old_session._call_tool(
+        "add_math_question",
+        {"user_id": "u1", "question_text": "…", "formula": "1 + 1 = ?", "answer": "2", "level": 1},
+    )
+
+    second_lease = await registry.register("u1")
+    assert question["question_id"] in db.documents("users/u1/mathQuestions")
+    assert old_client.sent_json[-1] == {"status": "Session taken over by another connection"}
+    assert old_client.close_code == 4000
+    await asyncio.wait_for(old_task, 2)
+
+    # The old connection ending does not release the new lease
+    await registry.release(first_lease)
+    assert registry.leases["u1"] is second_lease
+    await registry.release(second_lease)
+    assert not registry.leases
+
+
+@pytest.mark.asyncio
+async def test_takeover_while_connecting() -> None:
+    """A connection taken over before its relay started is not attached."""
+    registry = SessionRegistry(InMemoryLeaseBackend())
+    connecting = await registry.register("u1")
+    await registry.register("u1")
+    assert connecting.revoked
+    assert not registry.attach(connecting, object())
+    registry.close()
+
+
+class UnavailableBackend(InMemoryLeaseBackend):
+    async def acquire(self, user_id: str, holder: str, ttl: float) -> None:
+        raise RuntimeError("lease store unavailable")
+
+
+@pytest.mark.asyncio
+async def test_failed_acquire_leaves_no_lease(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A lease the backend refused does not block the user's next session."""
+    registry = SessionRegistry(UnavailableBackend())
+    monkeypatch.setattr(server, "session_registry", registry)
+    with pytest.raises(RuntimeError):
+        await server.connect_and_run(FakeClientWebSocket(), "u1")
+    assert registry.leases == {}
+    registry.backend = InMemoryLeaseBackend()
+    lease = await registry.register("u1")
+    assert registry.leases == {"u1": lease}
+    await registry.release(lease)
+
+
+@pytest.mark.asyncio
+async def test_remote_takeover_on_renewal() -> None:
+    """A session on another instance is closed at its next renewal."""
+    backend = FirestoreLeaseBackend(FakeFirestore())
+    instance_a = SessionRegistry(backend, instance_id="a")
+    instance_b = SessionRegistry(backend, instance_id="b")
+
+    lease = await instance_a.register("u1")
+    session, client, task = start_session("u1")
+    instance_a.attach(lease, session)
+
+    await instance_b.register("u1")
+    await instance_a.renew()
+    assert client.closed
+    assert "u1" not in instance_a.leases
+    await asyncio.wait_for(task, 2)
+
+    # The lease in Firestore still belongs to instance b
+    await instance_a.release(lease)
+    await instance_b.renew()
+    assert "u1" in instance_b.leases
+    instance_b.close()
+
+
+@pytest.mark.asyncio
+async def test_renewals_are_batched_off_the_event_loop() -> None:
+    """All of an instance's leases are renewed in one transaction per batch, in a thread."""
+    db = FakeFirestore()
+    registry = SessionRegistry(FirestoreLeaseBackend(db, batch_size=100), instance_id="a")
+    for i in range(150):
+        await registry.register(f"u{i}")
+    await FirestoreLeaseBackend(db).acquire("u0", "b/other", ttl=30)
+
+    db.reset_counts()
+    db.latency = lambda kind: 0.05
+    ticks = 0
+
+    async def tick() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    await registry.renew()
+    ticker.cancel()
+
+    assert db.rpcs["commit"] == 2 and db.rpcs["batch_get"] == 2
+    assert ticks >= 5
+    assert "u0" not in registry.leases and len(registry.leases) == 149
+    registry.close()
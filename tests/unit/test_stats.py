@@ -0,0 +1,206 @@
+import asyncio
+import datetime
+import threading
+from typing import Any, Dict, Generator, List, Optional
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.stats import StatsCache, etag_matches
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import load_server
+
+tools = load_firestore_tools()
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    fake.seed("users/u1", {"name": "はなこ", "current_level": 3, "compactedLevels": [1]})
+    for i, (level, correct, wrong, days_ago) in enumerate(
+        [(1, 3, 1, 2), (2, 2, 2, 1), (2, 1, 0, 20), (3, 0, 1, 0)]
+    ):
+        fake.seed(
+            f"users/u1/mathQuestions/q{i}",
+            {"level": level, "correctCount": correct, "wrongCount": wrong,
+             "updatedAt": now - datetime.timedelta(days=days_ago)},
+        )
+    fake.seed("users/u1/levelStats/1", {"level": 1, "questions": 10, "correct": 12, "wrong": 4})
+    monkeypatch.setattr(tools, "db", fake)
+    yield fake
+
+
+def test_user_stats_use_aggregations(db: FakeFirestore) -> None:
+    db.reset_counts()
+    stats = tools.get_user_stats("u1")
+
+    assert stats["levels"] == [
+        {"level": 1, "questions": 11, "correct": 15, "wrong": 5, "accuracy": 0.75},
+        {"level": 2, "questions": 2, "correct": 3, "wrong": 2, "accuracy": 0.6},
+        {"level": 3, "questions": 1, "correct": 0, "wrong": 1, "accuracy": 0.0},
+    ]
+    assert stats["totals"] == {"questions": 14, "correct": 18, "wrong": 8, "accuracy": 18 / 26}
+    assert stats["recently_practised"] == {"days": 7, "questions": 3, "correct": 5, "wrong": 4, "accuracy": 5 / 9}
+    # 問題ドキュメントは1件も読まない
+    assert db.reads == 2
+    assert db.rpcs == {"get": 1, "aggregate": 4, "batch_get": 1}
+
+
+def test_unknown_user_has_no_stats(db: FakeFirestore) -> None:
+    assert tools.get_user_stats("nobody") is None
+
+
+@pytest.mark.asyncio
+async def test_cache_serves_hits_until_ttl() -> None:
+    now = [0.0]
+    fetched: List[str] = []
+
+    def fetch(user_id: str) -> Dict[str, Any]:
+        fetched.append(user_id)
+        return {"user": user_id}
+
+    cache = StatsCache(fetch, ttl=60, clock=lambda: now[0])
+    first, outcome = await cache.get("u1")
+    assert outcome == "miss"
+    assert (await cache.get("u1")) == (first, "hit")
+    now[0] = 61
+    second, outcome = await cache.get("u1")
+    assert outcome == "miss"
+    # 内容が変わらなければ ETag も変わらない
+    assert second.etag == first.etag
+    assert fetched == ["u1", "u1"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_fetch() -> None:
+    release = threading.Event()
+    calls = []
+
+    def fetch(user_id: str) -> Optional[Dict[str, Any]]:
+        calls.append(user_id)
+        release.wait(5)
+        return {"user": user_id}
+
+    cache = StatsCache(fetch)
+    tasks = [asyncio.create_task(cache.get("u1")) for _ in range(20)]
+    await asyncio.sleep(0.05)
+    release.set()
+    results = await asyncio.gather(*tasks)
+    assert calls == ["u1"]
+    assert len({entry.etag for entry, _ in results}) == 1
+    assert sorted(outcome for _, outcome in results) == ["coalesced"] * 19 + ["miss"]
+
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_does_not_cancel_the_shared_fetch() -> None:
+    release = threading.Event()
+    calls = []
+
+    def fetch(user_id: str) -> Optional[Dict[str, Any]]:
+        calls.append(user_id)
+        release.wait(5)
+        return {"user": user_id}
+
+    cache = StatsCache(fetch)
+    first = asyncio.create_task(cache.get("u1"))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(cache.get("u1"))
+    await asyncio.sleep(0.01)
+    # 最初に取りに来たダッシュボードが切断された
+    first.cancel()
+    await asyncio.sleep(0.01)
+    release.set()
+
+    entry, outcome = await asyncio.wait_for(waiter, 1)
+    assert outcome == "coalesced" and entry is not None
+    assert first.cancelled()
+    assert (await cache.get("u1")) == (entry, "hit")
+    assert calls == ["u1"]
+
+@pytest.mark.asyncio
+async def test_failed_fetch_is_not_cached() -> None:
+    results = [RuntimeError("unavailable"), {"user": "u1"}]
+
+    def fetch(user_id: str) -> Dict[str, Any]:
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    cache = StatsCache(fetch)
+    with pytest.raises(RuntimeError):
+        await cache.get("u1")
+    assert (await cache.get("u1"))[1] == "miss"
+
+
+@pytest.mark.asyncio
+async def test_invalidate_discards_a_fetch_in_flight() -> None:
+    """Stats read before a write are not cached after it."""
+    release = threading.Event()
+    versions = iter(["before", "after"])
+
+    def fetch(user_id: str) -> Dict[str, Any]:
+        release.wait(5)
+        return {"version": next(versions)}
+
+    cache = StatsCache(fetch)
+    stale = asyncio.create_task(cache.get("u1"))
+    await asyncio.sleep(0.01)
+    cache.invalidate("u1")
+    release.set()
+    await stale
+    entry, outcome = await cache.get("u1")
+    assert outcome == "miss"
+    assert b"after" in entry.body
+
+
+def test_etag_matches() -> None:
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"def"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_endpoint_answers_conditional_requests(db: FakeFirestore) -> None:
+    server = load_server()
+    server.stats_cache.invalidate("u1")
+    client = TestClient(server.app)
+    tokens = {"child": {"uid": "u1"}, "parent": {"uid": "p1", "children": ["u1"]}, "other": {"uid": "u2"}}
+
+    with patch.object(server, "verify_id_token", side_effect=lambda token: tokens[token]):
+        assert client.get("/stats/u1").status_code == 401
+        assert client.get("/stats/u1", headers={"Authorization": "Bearer other"}).status_code == 403
+
+        response = client.get("/stats/u1", headers={"Authorization": "Bearer parent"})
+        assert response.status_code == 200
+        assert response.json()["totals"]["questions"] == 14
+        assert response.headers["Cache-Control"].startswith("private, max-age=")
+        etag = response.headers["ETag"]
+
+        db.reset_counts()
+        response = client.get("/stats/u1", headers={"Authorization": "Bearer child", "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        assert db.total_rpcs == 0
+
+        assert client.get("/stats/u2", headers={"Authorization": "Bearer other"}).status_code == 404
+
+
+def test_writes_invalidate_cached_stats(db: FakeFirestore) -> None:
+    server = load_server()
+    server.stats_cache.invalidate("u1")
+    client = TestClient(server.app)
+    headers = {"Authorization": "Bearer child"}
+
+    with patch.object(server, "verify_id_token", return_value={"uid": "u1"}):
+        assert client.get("/stats/u1", headers=headers).json()["current_level"] == 3
+        assert client.get("/stats/u1", headers=headers).headers["X-Stats-Cache"] == "hit"
+        tools.save_user_level("u1", 4)
+        response = client.get("/stats/u1", headers=headers)
+        assert response.headers["X-Stats-Cache"] == "miss"
+        assert response.json()["current_level"] == 4
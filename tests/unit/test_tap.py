@@ -0,0 +1,137 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Any, List
+
+import pytest
+
+from app.tap import CLOSED, MODEL, TOOL, TapEvent, TapRegistry
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveSession, load_server, tool_call_message
+
+tools = load_firestore_tools()
+server = load_server()
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest() -> None:
+    """A subscriber that falls behind loses the oldest events, and only it does."""
+    release = asyncio.Event()
+    slow: List[Any] = []
+    fast: List[Any] = []
+
+    async def stuck(user_id: str, event: TapEvent) -> None:
+        await release.wait()
+        slow.append(event[1])
+
+    async def keeps_up(user_id: str, event: TapEvent) -> None:
+        fast.append(event[1])
+
+    registry = TapRegistry(maxsize=4)
+    registry.subscribe("slow", stuck)
+    registry.subscribe("fast", keeps_up, topics=[MODEL])
+    tap = registry.open_tap("u1")
+    await asyncio.sleep(0)
+    for i in range(10):
+        tap.publish(MODEL, i)
+        await asyncio.sleep(0)
+
+    assert fast == list(range(10))
+    slow_stats, fast_stats = tap.stats()
+    # 1つ目は受け取り済みで止まっているので、キューには最新の4つが残る
+    assert slow_stats == {"subscriber": "slow", "queued": 4, "delivered": 0, "dropped": 5}
+    assert fast_stats["dropped"] == 0
+
+    release.set()
+    tap.close()
+    await asyncio.sleep(0.01)
+    # 終了の通知も、あふれた分の古いものを押し出す
+    assert slow == [0, 7, 8, 9, None]
+    assert fast == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_plain_function_runs_off_the_loop() -> None:
+    threads: List[int] = []
+
+    def blocking(user_id: str, event: TapEvent) -> None:
+        time.sleep(0.05)
+        threads.append(threading.get_ident())
+
+    registry = TapRegistry()
+    registry.subscribe("blocking", blocking)
+    tap = registry.open_tap("u1")
+    started = time.monotonic()
+    tap.publish(MODEL, b"{}")
+    await asyncio.sleep(0)
+    assert time.monotonic() - started < 0.01
+    tap.close()
+    while len(threads) < 2:
+        await asyncio.sleep(0.01)
+    assert threading.get_ident() not in threads
+
+
+@pytest.mark.asyncio
+async def test_no_subscribers_no_tap() -> None:
+    assert TapRegistry().open_tap("u1") is None
+
+
+@pytest.mark.asyncio
+async def test_failing_subscriber_keeps_going() -> None:
+    seen: List[Any] = []
+
+    async def flaky(user_id: str, event: TapEvent) -> None:
+        seen.append(event[1])
+        if event[1] == 1:
+            raise ValueError("bad event")
+
+    registry = TapRegistry()
+    registry.subscribe("flaky", flaky)
+    tap = registry.open_tap("u1")
+    for i in range(3):
+        tap.publish(MODEL, i)
+    tap.close()
+    await asyncio.sleep(0.01)
+    assert seen == [0, 1, 2, None]
+    assert tap.stats()[0]["delivered"] == 3
+
+
+@pytest.mark.asyncio
+async def test_session_publishes_model_messages_and_tool_calls(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The relay forwards frames while a stuck subscriber holds none of them up."""
+    monkeypatch.setattr(tools, "db", FakeFirestore())
+    events: List[TapEvent] = []
+    never = asyncio.Event()
+
+    async def record(user_id: str, event: TapEvent) -> None:
+        events.append(event)
+
+    async def stuck(user_id: str, event: TapEvent) -> None:
+        await never.wait()
+
+    registry = TapRegistry()
+    registry.subscribe("analytics", record)
+    registry.subscribe("moderation", stuck, topics=[MODEL])
+    live = FakeLiveSession()
+    client = FakeClientWebSocket()
+    session = server.GeminiSession(live, client, server.tool_functions, tap=registry.open_tap("u1"))
+    task = asyncio.create_task(session.run())
+
+    live._ws.push({"serverContent": {"modelTurn": {"parts": [{"text": "こんにちは"}]}}})
+    live._ws.push(tool_call_message("increment_user_level", user_id="u1"))
+    for _ in range(50):
+        if len(client.sent_bytes) == 2 and len(events) == 3:
+            break
+        await asyncio.sleep(0.01)
+    assert len(client.sent_bytes) == 2
+
+    client.disconnect()
+    await asyncio.wait_for(task, 1)
+    await asyncio.sleep(0.01)
+    topics = [topic for topic, _, _ in events]
+    assert topics == [MODEL, MODEL, TOOL, CLOSED]
+    assert json.loads(events[0][1])["serverContent"]["modelTurn"]["parts"][0]["text"] == "こんにちは"
+    assert events[2][1]["name"] == "increment_user_level"
+    assert events[2][1]["response"]["current_level"] == 2
+    never.set()
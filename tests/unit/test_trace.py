@@ -0,0 +1,112 @@
+import asyncio
+import base64
+
+import pytest
+
+import app.trace
+from app.client_pool import ClientPool
+from app.trace import DOWN, TOOL, UP, TraceRecorder, load_trace
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+from tests.fake_live import FakeClientWebSocket, FakeLiveRegion, FakeLiveSession, load_server, tool_call_message
+from tests.load_test.replay import find_stalls, replay
+
+tools = load_firestore_tools()
+server = load_server()
+
+AUDIO = {"realtimeInput": {"mediaChunks": [{"mimeType": "audio/pcm", "data": base64.b64encode(bytes(64)).decode()}]}}
+MODEL_AUDIO = {"serverContent": {"modelTurn": {"parts": [{"inlineData": {"mimeType": "audio/pcm", "data": "AAAA"}}]}}}
+
+
+def test_ring_buffer_keeps_latest_frames(tmp_path) -> None:
+    """Only the newest frames are kept and payloads are stripped by default."""
+    recorder = TraceRecorder("u1", directory=str(tmp_path), max_frames=3)
+    for i in range(5):
+        recorder.record(UP, "audio", 100 + i, recorder.now(), recorder.now(), payload=AUDIO)
+    header, *frames = load_trace(recorder.dump())
+    assert header["evicted"] == 2
+    assert [frame["n"] for frame in frames] == [102, 103, 104]
+    assert all("p" not in frame for frame in frames)
+
+
+@pytest.mark.asyncio
+async def test_session_records_both_directions(tmp_path) -> None:
+    """Client frames, model frames and tool calls are written when the session ends."""
+    client = FakeClientWebSocket()
+    live = FakeLiveSession()
+    tools = {"lookup": lambda **_: {}}
+    session = server.GeminiSession(
+        live, client, tools, trace=TraceRecorder("u1", directory=str(tmp_path))
+    )
+    task = asyncio.create_task(session.run())
+    client.push(AUDIO)
+    live._ws.push(MODEL_AUDIO)
+    live._ws.push(tool_call_message("lookup"))
+    live._ws.push({"serverContent": {"turnComplete": True}})
+    await asyncio.sleep(0.01)
+    client.disconnect()
+    await asyncio.wait_for(task, 2)
+
+    [path] = tmp_path.iterdir()
+    _, *frames = load_trace(str(path))
+    kinds = [(frame["d"], frame["k"]) for frame in frames]
+    assert (UP, "audio") in kinds
+    assert (DOWN, "audio") in kinds
+    assert (TOOL, "lookup") in kinds
+    assert (DOWN, "turnComplete") in kinds
+    assert all(frame["w"] >= 0 for frame in frames)
+
+
+@pytest.mark.asyncio
+async def test_connections_are_traced_when_enabled(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """connect_and_run gives each session a recorder when SESSION_TRACE_DIR is set."""
+    region = FakeLiveRegion()
+    monkeypatch.setattr(tools, "db", FakeFirestore())
+    monkeypatch.setattr(server, "live_pool", ClientPool({"local": region}))
+    monkeypatch.setattr(app.trace, "TRACE_DIR", str(tmp_path))
+
+    client = FakeClientWebSocket()
+    task = asyncio.create_task(server.connect_and_run(client, "u1"))
+    await asyncio.sleep(0.05)
+    client.push(AUDIO)
+    region.sessions[0]._ws.push(MODEL_AUDIO)
+    await asyncio.sleep(0.05)
+    client.disconnect()
+    await asyncio.wait_for(task, 2)
+
+    [path] = tmp_path.iterdir()
+    assert path.name.startswith("u1-")
+    _, *frames = load_trace(str(path))
+    assert [(frame["d"], frame["k"]) for frame in frames] == [(UP, "audio"), (DOWN, "audio")]
+
+
+def test_stall_attributed_to_tool_call() -> None:
+    """A gap in the model's audio during a slow tool call is blamed on the tool."""
+    frames = [
+        {"t": 0, "d": DOWN, "k": "audio", "n": 500, "w": 0.1},
+        {"t": 100, "d": DOWN, "k": "toolCall", "n": 200, "w": 0.1},
+        {"t": 100, "d": TOOL, "k": "add_math_question", "n": 0, "w": 700},
+        {"t": 1000, "d": DOWN, "k": "audio", "n": 500, "w": 0.2},
+        {"t": 1100, "d": DOWN, "k": "turnComplete", "n": 50, "w": 0.1},
+        {"t": 3000, "d": DOWN, "k": "audio", "n": 500, "w": 0.1},
+    ]
+    [stall] = find_stalls(frames, stall_ms=500)
+    assert stall["gap"] == 900
+    assert stall["tool"] == 700
+    assert stall["upstream"] == pytest.approx(200 - 0.3)
+
+
+@pytest.mark.asyncio
+async def test_replay_reproduces_frames() -> None:
+    """Replaying a stripped trace relays every forwarded frame."""
+    frames = [
+        {"t": 0, "d": UP, "k": "audio", "n": 300, "w": 0.1},
+        {"t": 5, "d": UP, "k": "audio", "n": 300, "x": "dropped"},
+        {"t": 10, "d": DOWN, "k": "audio", "n": 800, "w": 0.2},
+        {"t": 15, "d": DOWN, "k": "toolCall", "n": 200, "w": 0.1},
+        {"t": 15, "d": TOOL, "k": "add_math_question", "n": 0, "w": 20},
+        {"t": 20, "d": DOWN, "k": "turnComplete", "n": 50, "w": 0.1},
+    ]
+    result = await replay(frames, speed=2, copies=3)
+    assert len(result.replayed[(UP, "audio")]) == 3
+    assert len(result.replayed[(DOWN, "audio")]) == 3
+    assert len(result.replayed[(DOWN, "toolCall")]) == 3
@@ -0,0 +1,99 @@
+import asyncio
+from pathlib import Path
+from typing import Generator
+
+import pytest
+
+from app.user_cache import UserCache
+from tests.fake_firestore import FakeFirestore, load_firestore_tools
+
+tools = load_firestore_tools()
+
+
+@pytest.fixture
+def cache_path(tmp_path: Path) -> str:
+    return str(tmp_path / "users.sqlite3")
+
+
+@pytest.fixture
+def db(monkeypatch: pytest.MonkeyPatch, cache_path: str) -> Generator[FakeFirestore, None, None]:
+    fake = FakeFirestore()
+    fake.seed("users/u1", {"name": "はなこ", "current_level": 2, "questionIndex": {"l2_abc": "q1"}})
+    fake.seed("users/u1/mathQuestions/q1", {"formula": "3 + 2", "level": 3, "correctCount": 1, "wrongCount": 0})
+    monkeypatch.setattr(tools, "db", fake)
+    monkeypatch.setattr(tools, "user_cache", UserCache(cache_path))
+    tools._question_indexes.clear()
+    yield fake
+    tools._question_indexes.clear()
+
+
+def test_workers_share_entries(cache_path: str) -> None:
+    """A value stored by one worker is a hit in another worker on the host."""
+    worker_a, worker_b = UserCache(cache_path), UserCache(cache_path)
+    hit, _, generation = worker_a.lookup("u1")
+    assert not hit and generation == 0
+    assert worker_a.store("u1", {"name": "はなこ"}, generation)
+    assert worker_b.lookup("u1") == (True, {"name": "はなこ"}, 0)
+
+
+def test_read_older_than_a_write_is_not_stored(cache_path: str) -> None:
+    worker_a, worker_b = UserCache(cache_path), UserCache(cache_path)
+    _, _, generation = worker_a.lookup("u1")
+    worker_b.invalidate("u1")
+    assert not worker_a.store("u1", {"name": "old"}, generation)
+    hit, _, generation = worker_a.lookup("u1")
+    assert not hit and generation == 1
+    assert worker_a.store("u1", {"name": "new"}, generation)
+    assert worker_b.lookup("u1")[:2] == (True, {"name": "new"})
+
+
+def test_entries_expire(cache_path: str) -> None:
+    cache = UserCache(cache_path, ttl=0.0)
+    cache.store("u1", None, 0)
+    assert cache.lookup("u1")[0] is False
+
+
+def test_reconnect_reads_from_cache(db: FakeFirestore) -> None:
+    first = tools.get_user_data("u1")
+    assert db.rpcs == {"get": 1, "query": 2}
+    db.reset_counts()
+    tools._question_indexes.clear()
+
+    # 別のワーカーへの再接続: Firestore を読まず、指紋インデックスも戻る
+    assert tools.get_user_data("u1") == first
+    assert db.rpcs == {}
+    assert tools._question_indexes["u1"] == {"l2_abc": "q1"}
+
+
+def test_new_user_is_cached(db: FakeFirestore) -> None:
+    assert tools.get_user_data("u2") is None
+    db.reset_counts()
+    assert tools.get_user_data("u2") is None
+    assert db.rpcs == {}
+
+
+@pytest.mark.asyncio
+async def test_write_tools_invalidate(db: FakeFirestore) -> None:
+    tools.get_user_data("u1")
+    tools.increment_user_level("u1")
+    assert tools.get_user_data("u1")["current_level"] == 3
+
+    tools.save_user_level("u1", 4)
+    assert tools.get_user_data("u1")["current_level"] == 4
+
+    tools.upsert_math_question_result("u1", "q1", True)
+    await tools.flush_pending_writes("u1")
+    db.reset_counts()
+    user_data = tools.get_user_data("u1")
+    assert db.rpcs["get"] == 1
+    assert [q["correctCount"] for q in user_data["questions"] if q["id"] == "q1"] == [2]
+
+    tools.set_user_name("u1", "はなちゃん")
+    assert tools.get_user_data("u1")["name"] == "はなちゃん"
+
+    tools.add_math_question("u1", "…", "4 + 4", "8", 1)
+    await asyncio.sleep(0)
+    await tools.flush_pending_writes("u1")
+    db.reset_counts()
+    tools.get_user_data("u1")
+    assert db.rpcs["get"] == 1